@@ -25,6 +25,25 @@ PARKS_FILE = settings.parks_file
 VEHICLES_FILE = settings.vehicles_file
 UMP_TZ_OFFSET = settings.ump_tz_offset
 REQUEST_TIMEOUT = settings.request_timeout
+# Параллелизм пакетных запросов к UMP и таймаут одного HTTP-вызова (0 -> REQUEST_TIMEOUT)
+UMP_BATCH_CONCURRENCY = max(1, settings.ump_batch_concurrency)
+UMP_CALL_TIMEOUT = settings.ump_call_timeout or REQUEST_TIMEOUT
+# Пул соединений асинхронного клиента UMP
+UMP_MAX_CONNECTIONS = max(1, settings.ump_max_connections)
+UMP_KEEPALIVE_SEC = settings.ump_keepalive_sec
+# Синхронные HTTP-сессии UMP: по одной на аккаунт (свой пул соединений и cookies)
+UMP_SESSION_MAX = max(1, settings.ump_session_max)
+UMP_SESSION_IDLE_SEC = settings.ump_session_idle_sec
+# Повторы запросов к UMP: попыток всего, пауза (полный джиттер) и глобальный бюджет повторов
+UMP_RETRY_ATTEMPTS = max(1, settings.ump_retry_attempts)
+UMP_RETRY_BASE_SEC = settings.ump_retry_base_sec
+UMP_RETRY_MAX_SEC = settings.ump_retry_max_sec
+UMP_RETRY_BUDGET_RATIO = settings.ump_retry_budget_ratio
+UMP_RETRY_MIN_PER_SEC = settings.ump_retry_min_per_sec
+# Предохранитель UMP: сбоев подряд до размыкания (0 — выключен), пауза до пробных запросов
+UMP_BREAKER_FAILURES = settings.ump_breaker_failures
+UMP_BREAKER_RESET_SEC = settings.ump_breaker_reset_sec
+UMP_BREAKER_HALF_OPEN_PROBES = max(1, settings.ump_breaker_half_open_probes)
 LOG_LEVEL = settings.log_level.upper()
 
 # --- Пользовательские данные авторизации ---
@@ -34,11 +53,48 @@ UMP_BRANCH_MAP = settings.ump_branch_map
 UMP_USER_ID = settings.ump_user_id
 USER_CREDS_DIR = settings.user_creds_dir
 USER_META_DIR = settings.user_meta_dir
+# Фоновое обновление токенов UMP незадолго до истечения (поле exp JWT)
+TOKEN_REFRESH_ENABLED = settings.token_refresh_enabled
+TOKEN_REFRESH_LEAD_SEC = settings.token_refresh_lead_sec
+TOKEN_REFRESH_INTERVAL_SEC = settings.token_refresh_interval_sec
 
 # --- Caching / Stability ---
 CACHE_DIR = settings.cache_dir
 CACHE_TTL_SEC = settings.cache_ttl_sec
+POSITION_CACHE_MAX = settings.position_cache_max
+# stale-while-revalidate: позиции не старше этого срока отдаются сразу (с пометкой stale)
+# и обновляются в фоне; 0 — режим выключен
+POSITION_STALE_OK_SEC = settings.position_stale_ok_sec
+VEHICLE_INDEX_TTL_SEC = settings.vehicle_index_ttl_sec
+# Массовое разрешение depot -> vehicle_id одним запросом списка ТС
+UMP_BULK_RESOLVE = settings.ump_bulk_resolve
+UMP_BULK_REFRESH_SEC = settings.ump_bulk_refresh_sec
 ANTI_FLAP_GRACE_M = settings.anti_flap_grace_m
+# Фоновый опрос часто запрашиваемых ТС (поддерживает кэш позиций тёплым)
+HOT_POLL_ENABLED = settings.hot_poll_enabled
+HOT_POLL_INTERVAL_SEC = settings.hot_poll_interval_sec
+HOT_POLL_MAX_PER_CYCLE = settings.hot_poll_max_per_cycle
+HOT_POLL_TTL_SEC = settings.hot_poll_ttl_sec
+HOT_POLL_MAX_VEHICLES = settings.hot_poll_max_vehicles
+
+# --- Карта: загрузка тайлов ---
+# Каталог тайлов на диске (<провайдер>/<z>/<x>/<y>.png) и его лимит в МБ (0 — без лимита)
+MAP_CACHE_DIR = settings.map_cache_dir
+MAP_TILE_CACHE_MAX_MB = max(0, settings.map_tile_cache_max_mb)
+# MAP_TPS — общий на процесс лимит запросов к провайдеру тайлов (кэш не ограничивается)
+MAP_TPS = settings.map_tps
+MAP_TILE_WORKERS = max(1, settings.map_tile_workers)
+# Декодированные тайлы в памяти (LRU по размеру в МБ); 0 — не держать
+MAP_TILE_MEM_CACHE_MB = max(0, settings.map_tile_mem_cache_mb)
+# Авто-zoom: парк вписывается в размер картинки (MAP_ZOOM — верхняя граница),
+# из тайлов вырезается только нужное окно — без большого холста и resize
+MAP_AUTO_ZOOM = settings.map_auto_zoom
+# Кэш готовых подложек парков (тайлы + контур): в памяти до MAP_BASE_CACHE_MAX штук и на диске
+MAP_BASE_CACHE_DIR = settings.map_base_cache_dir
+MAP_BASE_CACHE_MAX = settings.map_base_cache_max
+MAP_BASE_CACHE_TTL_SEC = settings.map_base_cache_ttl_sec
+# Лимит подложек на диске в МБ (вытесняются давно не читанные); 0 — без лимита
+MAP_BASE_CACHE_DISK_MB = max(0, settings.map_base_cache_disk_mb)
 
 _ensure_parent_dir(UMP_TOKEN_FILE)
 _ensure_parent_dir(UMP_COOKIES_FILE)
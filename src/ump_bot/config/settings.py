@@ -20,6 +20,20 @@ class Settings(BaseSettings):
     ump_cookies_file: str = Field("var/ump_cookies.txt", alias="UMP_COOKIES")
     ump_tz_offset: str = Field("180", alias="UMP_TIMEZONE_OFFSET")
     request_timeout: float = Field(20.0, alias="REQUEST_TIMEOUT")
+    ump_batch_concurrency: int = Field(8, alias="UMP_BATCH_CONCURRENCY")
+    ump_call_timeout: float = Field(0.0, alias="UMP_CALL_TIMEOUT")
+    ump_max_connections: int = Field(20, alias="UMP_MAX_CONNECTIONS")
+    ump_keepalive_sec: float = Field(30.0, alias="UMP_KEEPALIVE_SEC")
+    ump_session_max: int = Field(50, alias="UMP_SESSION_MAX")
+    ump_session_idle_sec: float = Field(900.0, alias="UMP_SESSION_IDLE_SEC")
+    ump_retry_attempts: int = Field(3, alias="UMP_RETRY_ATTEMPTS")
+    ump_retry_base_sec: float = Field(0.3, alias="UMP_RETRY_BASE_SEC")
+    ump_retry_max_sec: float = Field(5.0, alias="UMP_RETRY_MAX_SEC")
+    ump_retry_budget_ratio: float = Field(0.1, alias="UMP_RETRY_BUDGET_RATIO")
+    ump_retry_min_per_sec: float = Field(1.0, alias="UMP_RETRY_MIN_PER_SEC")
+    ump_breaker_failures: int = Field(5, alias="UMP_BREAKER_FAILURES")
+    ump_breaker_reset_sec: float = Field(30.0, alias="UMP_BREAKER_RESET_SEC")
+    ump_breaker_half_open_probes: int = Field(1, alias="UMP_BREAKER_HALF_OPEN_PROBES")
     log_level: str = Field("INFO", alias="LOG_LEVEL")
 
     # User auth data
@@ -27,13 +41,26 @@ class Settings(BaseSettings):
     user_cookies_dir: str = Field("var/user_cookies", alias="USER_COOKIES_DIR")
     user_creds_dir: str = Field("var/user_creds", alias="USER_CREDS_DIR")
     user_meta_dir: str = Field("var/user_meta", alias="USER_META_DIR")
+    token_refresh_enabled: bool = Field(True, alias="TOKEN_REFRESH_ENABLED")
+    token_refresh_lead_sec: float = Field(600.0, alias="TOKEN_REFRESH_LEAD_SEC")
+    token_refresh_interval_sec: float = Field(60.0, alias="TOKEN_REFRESH_INTERVAL_SEC")
     ump_branch_map: dict = Field(default_factory=dict, alias="UMP_BRANCH_MAP")
     ump_user_id: Optional[str] = Field(None, alias="UMP_USER_ID")
 
     # Caching / stability
     cache_dir: str = Field("var/cache", alias="CACHE_DIR")
     cache_ttl_sec: int = Field(120, alias="CACHE_TTL")
+    position_cache_max: int = Field(5000, alias="POSITION_CACHE_MAX")
+    position_stale_ok_sec: int = Field(0, alias="POSITION_STALE_OK_SEC")
+    vehicle_index_ttl_sec: int = Field(7 * 24 * 3600, alias="VEHICLE_INDEX_TTL")
+    ump_bulk_resolve: bool = Field(False, alias="UMP_BULK_RESOLVE")
+    ump_bulk_refresh_sec: int = Field(3600, alias="UMP_BULK_REFRESH_SEC")
     anti_flap_grace_m: float = Field(3.0, alias="ANTI_FLAP_GRACE_M")
+    hot_poll_enabled: bool = Field(False, alias="HOT_POLL_ENABLED")
+    hot_poll_interval_sec: float = Field(60.0, alias="HOT_POLL_INTERVAL_SEC")
+    hot_poll_max_per_cycle: int = Field(200, alias="HOT_POLL_MAX_PER_CYCLE")
+    hot_poll_ttl_sec: int = Field(3 * 3600, alias="HOT_POLL_TTL_SEC")
+    hot_poll_max_vehicles: int = Field(1000, alias="HOT_POLL_MAX_VEHICLES")
 
     # Bot / map
     bot_token: str = Field("", alias="TELEGRAM_BOT_TOKEN")
@@ -49,7 +76,15 @@ class Settings(BaseSettings):
     map_referer: str = Field("", alias="MAP_REFERER")
     map_api_key: str = Field("", alias="MAPTILER_API_KEY")
     map_tps: float = Field(3.0, alias="MAP_TPS")
+    map_tile_workers: int = Field(8, alias="MAP_TILE_WORKERS")
+    map_tile_mem_cache_mb: int = Field(64, alias="MAP_TILE_MEM_CACHE_MB")
+    map_tile_cache_max_mb: int = Field(512, alias="MAP_TILE_CACHE_MAX_MB")
     map_zoom: int = Field(17, alias="MAP_ZOOM")
+    map_auto_zoom: bool = Field(False, alias="MAP_AUTO_ZOOM")
+    map_base_cache_dir: str = Field("var/base_layers", alias="MAP_BASE_CACHE_DIR")
+    map_base_cache_max: int = Field(32, alias="MAP_BASE_CACHE_MAX")
+    map_base_cache_ttl_sec: int = Field(7 * 24 * 3600, alias="MAP_BASE_CACHE_TTL_SEC")
+    map_base_cache_disk_mb: int = Field(256, alias="MAP_BASE_CACHE_DISK_MB")
 
     @property
     def allowed_user_ids(self) -> List[str]:
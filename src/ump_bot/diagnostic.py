@@ -1,11 +1,11 @@
 import re
-import json
-import base64
 from typing import Dict, List, Optional, Any
 
 import requests
 
 from .infra.otbivka import _auth_headers
+from .infra.jwt_claims import token_user_id
+from .infra.sessions import get_session
 from .config import UMP_BASE_URL, REQUEST_TIMEOUT, UMP_USER_ID
 
 DEFAULT_INDICATORS = [
@@ -32,14 +32,11 @@ DEFAULT_INDICATORS = [
 ]
 
 _HTML_TAG_RE = re.compile(r"<[^>]+>")
-_SESSION: Optional[requests.Session] = None
 
 
-def _session() -> requests.Session:
-    global _SESSION
-    if _SESSION is None:
-        _SESSION = requests.Session()
-    return _SESSION
+def _session(token: Optional[str] = None, token_path: Optional[str] = None) -> requests.Session:
+    """Сессия аккаунта UMP (общая с otbivka: пул соединений и cookies пользователя)."""
+    return get_session(token=token, token_path=token_path)
 
 
 def _clean_html(text: str) -> str:
@@ -74,7 +71,7 @@ def fetch_branch_diagnostics(
     }
     payload["Filters"]["user_id"] = int(uid)
 
-    headers = _auth_headers(token=token, token_path=token_path)
+    headers = dict(_auth_headers(token=token, token_path=token_path))
     headers.update(
         {
             "Page-Id": "/vehicle-diagnostic",
@@ -85,7 +82,7 @@ def fetch_branch_diagnostics(
         }
     )
 
-    r = _session().post(
+    r = _session(token=token, token_path=token_path).post(
         f"{UMP_BASE_URL}/db-api-query",
         json=payload,
         headers=headers,
@@ -97,23 +94,7 @@ def fetch_branch_diagnostics(
 
 def extract_user_id_from_token(token: str) -> Optional[int]:
     """Пытается вытащить userId из JWT токена без проверки подписи."""
-    if not token or "." not in token:
-        return None
-    parts = token.split(".")
-    if len(parts) < 2:
-        return None
-    payload_b64 = parts[1]
-    # base64url padding
-    rem = len(payload_b64) % 4
-    if rem:
-        payload_b64 += "=" * (4 - rem)
-    try:
-        decoded = base64.urlsafe_b64decode(payload_b64.encode("utf-8"))
-        data = json.loads(decoded.decode("utf-8"))
-        uid = data.get("userId") or data.get("user_id") or data.get("user") or data.get("id")
-        return int(uid) if uid is not None else None
-    except Exception:
-        return None
+    return token_user_id(token)
 
 
 def _iter_items(data: Any):
@@ -166,7 +147,7 @@ def fetch_indicator_details(
     uid = user_id or UMP_USER_ID
     if not uid:
         raise ValueError("Не задан user_id (нужен для деталей диагностики)")
-    headers = _auth_headers(token=token, token_path=token_path)
+    headers = dict(_auth_headers(token=token, token_path=token_path))
     headers.update(
         {
             "Page-Id": "/vehicle-diagnostic",
@@ -186,7 +167,7 @@ def fetch_indicator_details(
         },
         "Id": 1,
     }
-    r = requests.post(
+    r = _session(token=token, token_path=token_path).post(
         f"{UMP_BASE_URL}/db-api-query",
         json=payload,
         headers=headers,
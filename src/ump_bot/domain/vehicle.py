@@ -1,13 +1,113 @@
-from typing import Optional, Tuple, TypedDict, Any
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Mapping, Optional
 
 
-class VehicleStatus(TypedDict, total=False):
-    vehicle_id: Optional[int]
+class _RecordMapping:
+    """
+    Доступ к слотам записи как к словарю: r.get("lat"), r["park_name"], "stale" in r.
+    Ключ «есть», если поле не None — так записи совпадают по форме со словарями,
+    которые раньше возвращали otbivka/ump_client.
+    """
+
+    __slots__ = ()
+    _ALWAYS: tuple = ()
+
+    def _field_names(self) -> Dict[str, Any]:
+        return self.__dataclass_fields__
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in self._field_names() else None
+        return default if value is None and key not in self._ALWAYS else value
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self._field_names():
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: object) -> bool:
+        if key not in self._field_names():
+            return False
+        return key in self._ALWAYS or getattr(self, key) is not None
+
+    def keys(self) -> Iterator[str]:
+        return (name for name in self._field_names() if name in self)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.keys())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.keys()}
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Mapping):
+            return self.to_dict() == dict(other)
+        if isinstance(other, _RecordMapping):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+
+@dataclass(slots=True, eq=False)
+class VehicleStatus(_RecordMapping):
+    """
+    Результат позиции ТС (get_position_and_check / batch_get_positions).
+    У успешных результатов координаты, время и парк есть всегда (даже None);
+    остальные поля — только если заданы. raw (ответ UMP) хранится лишь в режиме отладки.
+    """
+
+    ok: bool
     depot_number: str
-    lat: Optional[float]
-    lon: Optional[float]
-    time: Any
-    park_name: Optional[str]
-    in_park: Optional[bool]
-    ok: Optional[bool]
-    error: Optional[str]
+    vehicle_id: Optional[int] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    time: Any = None
+    in_park: Optional[bool] = None
+    park_name: Optional[str] = None
+    error: Optional[str] = None
+    status: Optional[int] = None
+    detail: Optional[str] = None
+    stale: Optional[bool] = None
+    age_sec: Optional[int] = None
+    raw: Optional[Dict] = None
+
+    @property
+    def _ALWAYS(self) -> tuple:
+        if self.ok:
+            return ("ok", "depot_number", "vehicle_id", "lat", "lon", "time", "in_park", "park_name")
+        return ("ok", "depot_number")
+
+
+@dataclass(slots=True, eq=False)
+class CachedPosition(_RecordMapping):
+    """Запись кэша позиций (память и SQLite)."""
+
+    _ALWAYS = ("ts", "vehicle_id", "lat", "lon", "in_park", "park_name", "time")
+
+    ts: float
+    vehicle_id: int
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    in_park: bool = False
+    park_name: Optional[str] = None
+    time: Any = None
+
+    @classmethod
+    def from_mapping(cls, data: Mapping) -> "CachedPosition":
+        if isinstance(data, cls):
+            return data
+        return cls(
+            ts=float(data.get("ts") or 0.0),
+            vehicle_id=int(data["vehicle_id"]),
+            lat=data.get("lat"),
+            lon=data.get("lon"),
+            in_park=bool(data.get("in_park")),
+            park_name=data.get("park_name"),
+            time=data.get("time"),
+        )
@@ -10,7 +10,7 @@ from telegram.ext import (
     filters,
 )
 
-from ..infra.otbivka import load_parks
+from ..infra.park_registry import get_parks
 from ..services import auth
 from ..services.warranty_act import (
     get_executor_name,
@@ -59,7 +59,7 @@ async def act_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     # Проверка выбранного парка
     park_name = user_park_cache.get(user_id)
     if not park_name or park_name == "all":
-        parks = load_parks()
+        parks = get_parks()
         keyboard = [[InlineKeyboardButton(p["name"], callback_data=f"act_park_{p['name']}")] for p in parks]
         await update.message.reply_text(
             "📍 Для начала выберите парк:",
@@ -113,7 +113,7 @@ async def handle_date(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def ask_address(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Запрос адреса выполнения работ."""
     park_name = context.user_data['act']['park_name']
-    parks = load_parks()
+    parks = get_parks()
     park = next((p for p in parks if p['name'] == park_name), None)
     
     if not park or not park.get('address_default'):
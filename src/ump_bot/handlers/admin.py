@@ -22,6 +22,15 @@ from ..config import (
     USER_META_DIR,
     USER_TOKEN_DIR,
 )
+from ..infra.base_layers import get_base_layer_cache
+from ..infra.circuit_breaker import get_ump_breaker
+from ..infra.hot_vehicles import get_hot_poller
+from ..infra.otbivka import position_cache_stats
+from ..infra.retry import get_ump_retry_policy
+from ..infra.tiles import get_tile_memory_cache
+from ..infra.jwt_claims import token_expiry
+from ..infra.sessions import get_session_manager
+from ..services.token_refresh import get_token_refresher
 from ..services import auth
 from ..services.settings import ADMIN_USER_ID, ALLOWED_USER_IDS, UMP_BOT_LOG_FILE
 from ..services.state import user_park_cache
@@ -162,6 +171,26 @@ def _try_systemctl_is_active(unit: str) -> Optional[str]:
         return None
 
 
+_BREAKER_STATES = {
+    "closed": "🟢 замкнут (UMP отвечает)",
+    "open": "🔴 разомкнут (запросы не выполняются)",
+    "half_open": "🟡 пробные запросы",
+}
+
+
+def _breaker_lines() -> list[str]:
+    b = get_ump_breaker().snapshot()
+    if not b["enabled"]:
+        return ["🛡 Предохранитель UMP: выключен"]
+    lines = [f"🛡 Предохранитель UMP: {_BREAKER_STATES.get(b['state'], b['state'])}"]
+    lines.append(f"- сбоев подряд: {b['failures']}/{b['threshold']}, срабатываний: {b['trips']}, отклонено: {b['rejected']}")
+    if b["state"] == "open":
+        lines.append(f"- пробный запрос через: {_fmt_duration_s(b['retry_in'])}")
+    if b["last_error"]:
+        lines.append(f"- последняя ошибка: {b['last_error']}")
+    return lines
+
+
 def _menu() -> InlineKeyboardMarkup:
     s = access_control.stats()
     kb = [
@@ -245,6 +274,40 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         lines.append(f"- creds: {len(creds_files)} ({USER_CREDS_DIR})")
         lines.append(f"- meta: {len(meta_files)} ({USER_META_DIR})")
         lines.append("")
+        pc = position_cache_stats()
+        lines.append("🗃 Кэш позиций (память):")
+        lines.append(f"- записей: {pc['size']}, ожидают записи на диск: {pc['pending_writes']}")
+        lines.append(f"- hits: {pc['hits']}, misses: {pc['misses']}, evictions: {pc['evictions']}")
+        lines.append("")
+        lines.extend(_breaker_lines())
+        rs = get_ump_retry_policy().stats()
+        lines.append(f"🔁 Повторы UMP: {rs['retries']} на {rs['requests']} запросов, отклонено бюджетом: {rs['denied']}")
+        ss = get_session_manager().stats()
+        lines.append(f"🔌 Сессии UMP: {ss['size']} активных, создано: {ss['created']}, закрыто: {ss['evicted']}")
+        bl = get_base_layer_cache().stats()
+        lines.append(
+            f"🗺 Подложки карт: {bl['size']} в памяти, hits: {bl['hits']}, "
+            f"с диска: {bl['disk_hits']}, misses: {bl['misses']}"
+        )
+        tm = get_tile_memory_cache().stats()
+        lines.append(
+            f"🧩 Тайлы в памяти: {tm['size']} ({tm['bytes'] / 1048576:.1f} из {tm['max_bytes'] / 1048576:.0f} МБ), "
+            f"hit rate: {tm['hit_rate']:.0%}, вытеснено: {tm['evictions']}"
+        )
+        tr = get_token_refresher().stats()
+        if tr["enabled"]:
+            lines.append(
+                f"🔄 Обновление токенов: {'работает' if tr['running'] else 'остановлено'}, "
+                f"обновлено: {tr['refreshed']}, неудач: {tr['failures']}"
+            )
+        hp = get_hot_poller().stats()
+        if hp["enabled"]:
+            lines.append(
+                f"🔥 Фоновый опрос: {'работает' if hp['running'] else 'остановлен'}, горячих ТС: {hp['hot']}, "
+                f"циклов: {hp['cycles']}, обновлено: {hp['refreshed']}, ошибок: {hp['errors']}, "
+                f"последний цикл: {hp['last_cycle_sec']:.1f}s"
+            )
+        lines.append("")
         lines.append("🔐 Ваш UMP токен:")
         p = auth._user_token_path(user_id)
         if p.exists():
@@ -254,6 +317,10 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 lines.append(f"- файл: {p}")
                 lines.append(f"- длина: {len(tok)}")
                 lines.append(f"- возраст: {_fmt_duration_s(age_s)}")
+                exp = token_expiry(tok)
+                if exp is not None:
+                    left = exp - time.time()
+                    lines.append(f"- истекает через: {_fmt_duration_s(left)}" if left > 0 else "- истёк")
             except Exception as e:
                 lines.append(f"- файл: {p}")
                 lines.append(f"- ошибка чтения: {e}")
@@ -389,9 +456,10 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     return r.status_code, dt
 
                 code, dt = await asyncio.to_thread(req)
-                return f"🌐 UMP healthcheck\n\n✅ {UMP_BASE_URL}\nHTTP: {code}\nВремя: {dt:.2f}s"
+                text = f"🌐 UMP healthcheck\n\n✅ {UMP_BASE_URL}\nHTTP: {code}\nВремя: {dt:.2f}s"
             except Exception as e:
-                return f"🌐 UMP healthcheck\n\n❌ {UMP_BASE_URL}\nОшибка: {e}"
+                text = f"🌐 UMP healthcheck\n\n❌ {UMP_BASE_URL}\nОшибка: {e}"
+            return text + "\n\n" + "\n".join(_breaker_lines())
 
         await q.edit_message_text(await do_check(), reply_markup=_menu())
         return
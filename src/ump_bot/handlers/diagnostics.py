@@ -106,10 +106,10 @@ async def test_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         info_lines.append("   Требуется авторизация через /login")
 
     # Проверка парков
-    from ..infra.otbivka import load_parks
+    from ..infra.park_registry import get_parks
 
     try:
-        parks = load_parks()
+        parks = get_parks()
         info_lines.append(f"\n🏢 ПАРКИ: найдено {len(parks)}")
         for p in parks:
             info_lines.append(f"   - {p['name']}")
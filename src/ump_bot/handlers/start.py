@@ -3,7 +3,7 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
-from ..infra.otbivka import load_parks
+from ..infra.park_registry import get_parks
 from ..services import auth
 from ..services.settings import ADMIN_USER_ID, ALLOWED_USER_IDS
 from ..services.state import user_park_cache
@@ -20,7 +20,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     user_id = update.effective_user.id
-    parks = load_parks()
+    parks = get_parks()
     park_names = [p["name"] for p in parks]
 
     text = (
@@ -80,7 +80,7 @@ async def parks_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await reply_private(update)
         return
 
-    parks = load_parks()
+    parks = get_parks()
     if not parks:
         await update.message.reply_text("❌ Парки не найдены в конфигурации.")
         return
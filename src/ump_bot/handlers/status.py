@@ -1,11 +1,11 @@
 import logging
 
-import asyncio
+import httpx
 import requests
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from ..infra.otbivka import get_position_and_check
+from ..infra.ump_client import get_position_and_check
 from ..services import auth
 from ..services.settings import ALLOWED_USER_IDS
 from ..utils.logging import log_print
@@ -30,7 +30,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     try:
-        result = await asyncio.to_thread(get_position_and_check, depot_number, token_path=token_path)
+        result = await get_position_and_check(depot_number, token_path=token_path)
 
         if not result.get("ok"):
             error = result.get("error", "unknown")
@@ -50,12 +50,14 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             f"   Lat: {result.get('lat', 0):.6f}\n"
             f"   Lon: {result.get('lon', 0):.6f}"
         )
+        if result.get("stale"):
+            text += f"\n\n⚠️ Данные из кэша ({result.get('age_sec', 0)} с назад), обновляются в фоне"
 
         await update.message.reply_text(text)
     except FileNotFoundError as e:
         logger.error(f"Token file not found: {e}", exc_info=True)
         await update.message.reply_text("❌ Нет токена UMP. Используйте /login для авторизации.")
-    except requests.HTTPError as e:
+    except (requests.HTTPError, httpx.HTTPStatusError) as e:
         status = e.response.status_code if e.response is not None else "unknown"
         logger.error(f"HTTP error in status_command: {status}", exc_info=True)
         if status == 401:
@@ -63,7 +65,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             new_path = auth.refresh_session(update.effective_user.id)
             if new_path:
                 try:
-                    result = await asyncio.to_thread(get_position_and_check, depot_number, token_path=new_path)
+                    result = await get_position_and_check(depot_number, token_path=new_path)
                     in_park = "✅ В парке" if result.get("in_park") else "❌ Вне парка"
                     park_name = result.get("park_name", "—")
                     text = (
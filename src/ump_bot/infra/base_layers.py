@@ -0,0 +1,225 @@
+# base_layers.py
+"""
+Кэш готовых подложек карт парков (тайлы + LANCZOS + контур + заголовок).
+
+От вызова к вызову /map меняются только метки ТС, поэтому подложка строится
+один раз на ключ (парк, zoom, размер, провайдер без ключа API, стиль)
+и хранится в памяти (LRU на MAP_BASE_CACHE_MAX штук) и на диске
+(MAP_BASE_CACHE_DIR, PNG + JSON с параметрами проекции; просроченные
+удаляются при чтении, общий размер ограничен MAP_BASE_CACHE_DISK_MB).
+Рендер копирует подложку и рисует поверх только ТС.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from ..config import (
+    MAP_BASE_CACHE_DIR,
+    MAP_BASE_CACHE_DISK_MB,
+    MAP_BASE_CACHE_MAX,
+    MAP_BASE_CACHE_TTL_SEC,
+)
+
+# (картинка RGB, параметры проекции)
+BaseLayer = Tuple[Image.Image, Dict[str, Any]]
+
+
+def base_layer_key(**parts: Any) -> str:
+    """Стабильный ключ подложки из её параметров (порядок аргументов не важен)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class BaseLayerCache:
+    # недописанные tmp и PNG без meta старше этого срока считаются брошенными
+    _ORPHAN_MAX_AGE_SEC = 3600
+
+    def __init__(
+        self,
+        max_items: int = MAP_BASE_CACHE_MAX,
+        disk_dir: Optional[str] = MAP_BASE_CACHE_DIR,
+        ttl_sec: float = MAP_BASE_CACHE_TTL_SEC,
+        max_disk_bytes: int = MAP_BASE_CACHE_DISK_MB * 1024 * 1024,
+    ):
+        self.max_items = max(1, int(max_items))
+        self.disk_dir = disk_dir or None
+        self.ttl_sec = float(ttl_sec)
+        self.max_disk_bytes = max(0, int(max_disk_bytes))
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._mem: "OrderedDict[str, BaseLayer]" = OrderedDict()
+        # None — каталог ещё не обходили
+        self._disk_bytes: Optional[int] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evicted = 0
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.disk_dir, key)
+        return base + ".png", base + ".json"
+
+    def _expired(self, meta_mtime: float, now: float) -> bool:
+        return self.ttl_sec > 0 and now - meta_mtime > self.ttl_sec
+
+    def _remove_disk(self, key: str) -> None:
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _load_disk(self, key: str) -> Optional[BaseLayer]:
+        if not self.disk_dir:
+            return None
+        png, meta_path = self._paths(key)
+        try:
+            if self._expired(os.path.getmtime(meta_path), time.time()):
+                self._remove_disk(key)
+                return None
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with Image.open(png) as im:
+                img = im.convert("RGB").copy()
+            # mtime PNG — время последнего чтения (по нему вытесняем), срок жизни — по meta
+            os.utime(png)
+        except (OSError, ValueError):
+            return None
+        return img, meta
+
+    def _save_disk(self, key: str, img: Image.Image, meta: Dict[str, Any]) -> None:
+        if not self.disk_dir:
+            return
+        png, meta_path = self._paths(key)
+        suffix = f"{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp = f"{png}.{suffix}"
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            # meta пишется последней: без неё подложка на диске не считается готовой
+            img.save(tmp, format="PNG")
+            os.replace(tmp, png)
+            tmp = f"{meta_path}.{suffix}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp, meta_path)
+            size = os.path.getsize(png) + os.path.getsize(meta_path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        if not self.max_disk_bytes:
+            return
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_locked()
+            else:
+                self._disk_bytes += size
+            if self._disk_bytes > self.max_disk_bytes:
+                self._disk_bytes = self._scan_disk_locked()
+
+    def _scan_disk_locked(self) -> int:
+        """
+        Обход каталога: удаляет просроченные подложки, брошенные tmp и PNG без meta;
+        при превышении лимита вытесняет давно не читанные (до 90% лимита).
+        """
+        now = time.time()
+        stat: Dict[str, Dict[str, os.stat_result]] = {}
+        try:
+            names = os.listdir(self.disk_dir)
+        except OSError:
+            return 0
+        for name in names:
+            full = os.path.join(self.disk_dir, name)
+            try:
+                st = os.stat(full)
+                if name.endswith(".tmp"):
+                    if now - st.st_mtime > self._ORPHAN_MAX_AGE_SEC:
+                        os.remove(full)
+                    continue
+            except OSError:
+                continue
+            key, ext = os.path.splitext(name)
+            if ext in (".png", ".json"):
+                stat.setdefault(key, {})[ext] = st
+        layers: List[Tuple[float, int, str]] = []
+        for key, files in stat.items():
+            png, meta = files.get(".png"), files.get(".json")
+            if png is None or meta is None:
+                # половина пары: свежую, возможно, ещё дописывают
+                if max(st.st_mtime for st in files.values()) < now - self._ORPHAN_MAX_AGE_SEC:
+                    self._remove_disk(key)
+                continue
+            if self._expired(meta.st_mtime, now):
+                self._remove_disk(key)
+                continue
+            layers.append((png.st_mtime, png.st_size + meta.st_size, key))
+        total = sum(size for _, size, _ in layers)
+        if total > self.max_disk_bytes:
+            target = int(self.max_disk_bytes * 0.9)
+            layers.sort()
+            for _, size, key in layers:
+                if total <= target:
+                    break
+                self._remove_disk(key)
+                total -= size
+                self.disk_evicted += 1
+        return total
+
+    def _remember(self, key: str, layer: BaseLayer) -> None:
+        with self._lock:
+            self._mem[key] = layer
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def get(self, key: str) -> Optional[BaseLayer]:
+        """Копия подложки (её можно рисовать) и параметры проекции, либо None."""
+        with self._lock:
+            layer = self._mem.get(key)
+            if layer is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+        if layer is None:
+            layer = self._load_disk(key)
+            if layer is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(key, layer)
+        img, meta = layer
+        return img.copy(), meta
+
+    def put(self, key: str, img: Image.Image, meta: Dict[str, Any]) -> None:
+        layer = (img.copy(), dict(meta))
+        self._remember(key, layer)
+        self._save_disk(key, layer[0], layer[1])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._mem),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+_CACHE = BaseLayerCache()
+
+
+def get_base_layer_cache() -> BaseLayerCache:
+    return _CACHE
@@ -0,0 +1,153 @@
+# circuit_breaker.py
+"""
+Предохранитель (circuit breaker) для вызовов UMP.
+
+closed    — запросы идут как обычно, считаются подряд идущие сбои;
+open      — после failure_threshold сбоев подряд запросы не выполняются вовсе
+            (CircuitOpenError сразу), пока не пройдёт reset_timeout_sec;
+half_open — пропускается не больше half_open_max_calls пробных запросов:
+            успех закрывает предохранитель, сбой снова открывает. Проба,
+            завершившаяся без исхода (отмена, ошибка не сети), обязана вызвать
+            release(), иначе её слот занят навсегда.
+
+Сбой — это отсутствие ответа (таймаут, ошибка соединения), 5xx и 429.
+Ответы 4xx (401, 404, ...) означают, что UMP жив, и сбоями не считаются.
+Один объект общий для синхронного и асинхронного клиентов (потокобезопасен).
+failure_threshold <= 0 отключает предохранитель.
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+from ..config import UMP_BREAKER_FAILURES, UMP_BREAKER_HALF_OPEN_PROBES, UMP_BREAKER_RESET_SEC
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """UMP считается недоступным — запрос не выполнялся."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name}: сервис недоступен, повтор через {retry_in:.0f} с")
+        self.retry_in = retry_in
+
+
+def is_failure_status(status_code: Optional[int]) -> bool:
+    return status_code is not None and (status_code >= 500 or status_code == 429)
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str = "UMP",
+        failure_threshold: int = UMP_BREAKER_FAILURES,
+        reset_timeout_sec: float = UMP_BREAKER_RESET_SEC,
+        half_open_max_calls: int = UMP_BREAKER_HALF_OPEN_PROBES,
+    ):
+        self.name = name
+        self.enabled = int(failure_threshold) > 0
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout_sec = float(reset_timeout_sec)
+        self.half_open_max_calls = max(1, int(half_open_max_calls))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.trips = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+
+    def _refresh(self, now: float) -> None:
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout_sec:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def _open(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self.trips += 1
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self._state
+
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def before_call(self) -> None:
+        """Разрешение на запрос; иначе CircuitOpenError (без обращения к сети)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._refresh(now)
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            self.rejected += 1
+            retry_in = max(0.0, self.reset_timeout_sec - (now - self._opened_at))
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._state != CLOSED:
+                self._state = CLOSED
+                self._probes = 0
+
+    def release(self) -> None:
+        """Вызов после before_call завершился без исхода — освобождаем слот пробы half_open."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_failure(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if error is not None:
+                self.last_error = f"{type(error).__name__}: {error}"[:200]
+            if not self.enabled:
+                return
+            if self._state == HALF_OPEN:
+                self._open(now)
+                return
+            self._failures += 1
+            if self._state == CLOSED and self._failures >= self.failure_threshold:
+                self._open(now)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            self._refresh(now)
+            retry_in = max(0.0, self.reset_timeout_sec - (now - self._opened_at)) if self._state == OPEN else 0.0
+            return {
+                "name": self.name,
+                "enabled": self.enabled,
+                "state": self._state,
+                "failures": self._failures,
+                "threshold": self.failure_threshold,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retry_in": retry_in,
+                "last_error": self.last_error,
+            }
+
+
+_UMP_BREAKER = CircuitBreaker("UMP")
+
+
+def get_ump_breaker() -> CircuitBreaker:
+    return _UMP_BREAKER
@@ -0,0 +1,254 @@
+# geofence.py
+"""
+Геофенсинг: попадание точек в полигоны парков и расстояние до границы.
+
+Скалярные функции — эталонная реализация (одна точка). Пакетные (points_*,
+classify_points) считают весь парк ТС сразу: цикл идёт по рёбрам полигона,
+а по точкам — векторно через NumPy; без NumPy — поточечно через скалярные.
+Результаты пакетных функций совпадают со скалярными бит в бит: операции
+те же и в том же порядке, а корень берётся от минимума квадратов расстояний
+тем же `** 0.5` (он монотонен, так что min и корень можно переставить).
+Расстояния считаются по рёбрам (x1, y1, dx, dy): для парков из реестра —
+по заранее построенным ParkGeometry.edges, для голого полигона — по _edges().
+"""
+import math
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except Exception:  # NumPy необязателен
+    np = None
+
+from .park_grid import ParkGrid
+from .park_registry import ParkGeometry
+
+Polygon = Sequence[Tuple[float, float]]
+Edges = Sequence[Tuple[float, float, float, float]]
+
+
+def meters_per_degree(lat_deg: float) -> Tuple[float,float]:
+    lat_m = 111_132.0
+    lon_m = 111_320.0 * math.cos(math.radians(lat_deg))
+    return lat_m, lon_m
+
+def _edges(polygon: Polygon) -> Edges:
+    """Рёбра полигона (x1, y1, dx, dy) — те же, что в ParkGeometry.edges."""
+    n = len(polygon)
+    out = []
+    for i in range(n):
+        x1, y1 = polygon[i]
+        x2, y2 = polygon[(i+1) % n]
+        out.append((x1, y1, x2 - x1, y2 - y1))
+    return out
+
+def point_in_polygon(lon: float, lat: float, polygon: Polygon) -> bool:
+    inside = False
+    n = len(polygon)
+    if n < 3: return False
+    for i in range(n):
+        x1, y1 = polygon[i]
+        x2, y2 = polygon[(i+1) % n]
+        cond = ((y1 > lat) != (y2 > lat)) and (lon < (x2 - x1) * (lat - y1) / (y2 - y1 + 1e-15) + x1)
+        if cond:
+            inside = not inside
+    return inside
+
+def point_in_polygon_with_tolerance(
+    lon: float, lat: float, polygon: Polygon, tol_m: float, edges: Optional[Edges] = None
+) -> bool:
+    if point_in_polygon(lon, lat, polygon):
+        return True
+    if tol_m <= 0:
+        return False
+    lons = [p[0] for p in polygon]; lats = [p[1] for p in polygon]
+    lat_m, lon_m = meters_per_degree(lat)
+    eps_lon = tol_m / max(lon_m, 1e-9)
+    eps_lat = tol_m / lat_m
+    in_bbox = (min(lons)-eps_lon <= lon <= max(lons)+eps_lon) and (min(lats)-eps_lat <= lat <= max(lats)+eps_lat)
+    if not in_bbox:
+        return False
+    for x1, y1, dx, dy in (edges if edges is not None else _edges(polygon)):
+        if dx == dy == 0:
+            continue
+        t = max(0.0, min(1.0, ((lon - x1)*dx + (lat - y1)*dy) / (dx*dx + dy*dy)))
+        proj_x = x1 + t*dx; proj_y = y1 + t*dy
+        d_lon = (lon - proj_x) * lon_m
+        d_lat = (lat - proj_y) * lat_m
+        dist_m = (d_lon*d_lon + d_lat*d_lat)**0.5
+        if dist_m <= tol_m:
+            return True
+    return False
+
+def distance_to_polygon_m(lon: float, lat: float, polygon: Polygon, edges: Optional[Edges] = None) -> float:
+    lat_m, lon_m = meters_per_degree(lat)
+    best = float("inf")
+    for x1, y1, dx, dy in (edges if edges is not None else _edges(polygon)):
+        if dx == dy == 0:
+            continue
+        t = max(0.0, min(1.0, ((lon - x1)*dx + (lat - y1)*dy) / (dx*dx + dy*dy)))
+        proj_x = x1 + t*dx; proj_y = y1 + t*dy
+        d_lon = (lon - proj_x) * lon_m
+        d_lat = (lat - proj_y) * lat_m
+        dist_m = (d_lon*d_lon + d_lat*d_lat)**0.5
+        if dist_m < best:
+            best = dist_m
+    if point_in_polygon(lon, lat, polygon):
+        return 0.0
+    return best
+
+def classify_point(
+    lon: float,
+    lat: float,
+    geometries: Sequence[ParkGeometry],
+    grace_m: float = 0.0,
+    grid: Optional[ParkGrid] = None,
+) -> Optional[str]:
+    """
+    Парк, в котором находится точка (с учётом tolerance_m), либо — анти-флап —
+    первый парк, до границы которого не больше grace_m.
+    Полигоны проверяются только для парков, в расширенный bbox которых попала точка;
+    с grid (построенной по тем же geometries) — только для парков из ячейки точки.
+    """
+    near = grid.candidates(lon, lat) if grid is not None else geometries
+    for g in near:
+        if g.near_bbox(lon, lat, g.tolerance_m) and point_in_polygon_with_tolerance(lon, lat, g.polygon, g.tolerance_m, g.edges):
+            return g.name
+    if grace_m > 0:
+        if grid is not None and not grid.covers(grace_m):
+            near = geometries
+        for g in near:
+            if g.near_bbox(lon, lat, grace_m) and distance_to_polygon_m(lon, lat, g.polygon, g.edges) <= grace_m:
+                return g.name
+    return None
+
+
+# ---------- Пакетный (векторный) режим ----------
+def _lon_m_for(lats) -> "np.ndarray":
+    # math.cos — ровно как в meters_per_degree (векторный cos может отличаться в последнем бите)
+    return np.array([meters_per_degree(la)[1] for la in lats.tolist()], dtype=float)
+
+def _np_inside(lons, lats, polygon: Polygon):
+    inside = np.zeros(lons.shape, dtype=bool)
+    n = len(polygon)
+    if n < 3:
+        return inside
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i in range(n):
+            x1, y1 = polygon[i]
+            x2, y2 = polygon[(i+1) % n]
+            cond = ((y1 > lats) != (y2 > lats)) & (lons < (x2 - x1) * (lats - y1) / (y2 - y1 + 1e-15) + x1)
+            inside ^= cond
+    return inside
+
+def _np_min_sq_dist(lons, lats, lon_m, edges: Edges):
+    lat_m = 111_132.0
+    best = np.full(lons.shape, np.inf)
+    for x1, y1, dx, dy in edges:
+        if dx == dy == 0:
+            continue
+        t = np.minimum(1.0, ((lons - x1)*dx + (lats - y1)*dy) / (dx*dx + dy*dy))
+        t = np.maximum(0.0, t)
+        proj_x = x1 + t*dx; proj_y = y1 + t*dy
+        d_lon = (lons - proj_x) * lon_m
+        d_lat = (lats - proj_y) * lat_m
+        np.minimum(best, d_lon*d_lon + d_lat*d_lat, out=best)
+    return best
+
+def _sqrt_like_scalar(sq) -> List[float]:
+    return [v ** 0.5 for v in sq.tolist()]
+
+def _as_arrays(lons, lats):
+    return np.asarray(lons, dtype=float).reshape(-1), np.asarray(lats, dtype=float).reshape(-1)
+
+def points_in_polygon(lons: Sequence[float], lats: Sequence[float], polygon: Polygon) -> List[bool]:
+    if np is None:
+        return [point_in_polygon(x, y, polygon) for x, y in zip(lons, lats)]
+    x, y = _as_arrays(lons, lats)
+    return _np_inside(x, y, polygon).tolist()
+
+def distances_to_polygon_m(lons: Sequence[float], lats: Sequence[float], polygon: Polygon) -> List[float]:
+    if np is None:
+        return [distance_to_polygon_m(x, y, polygon) for x, y in zip(lons, lats)]
+    x, y = _as_arrays(lons, lats)
+    dist = _sqrt_like_scalar(_np_min_sq_dist(x, y, _lon_m_for(y), _edges(polygon)))
+    inside = _np_inside(x, y, polygon).tolist()
+    return [0.0 if ins else d for d, ins in zip(dist, inside)]
+
+def _np_with_tolerance(x, y, lon_m, polygon: Polygon, tol_m: float, edges: Optional[Edges] = None):
+    hit = _np_inside(x, y, polygon)
+    if tol_m <= 0 or len(polygon) == 0:
+        return hit
+    lons = [p[0] for p in polygon]; lats = [p[1] for p in polygon]
+    eps_lon = tol_m / np.maximum(lon_m, 1e-9)
+    eps_lat = tol_m / 111_132.0
+    in_bbox = (min(lons) - eps_lon <= x) & (x <= max(lons) + eps_lon) & (min(lats) - eps_lat <= y) & (y <= max(lats) + eps_lat)
+    todo = in_bbox & ~hit
+    if todo.any():
+        idx = np.nonzero(todo)[0]
+        if edges is None:
+            edges = _edges(polygon)
+        dist = _sqrt_like_scalar(_np_min_sq_dist(x[idx], y[idx], lon_m[idx], edges))
+        hit[idx] = [d <= tol_m for d in dist]
+    return hit
+
+def points_in_polygon_with_tolerance(lons: Sequence[float], lats: Sequence[float], polygon: Polygon, tol_m: float) -> List[bool]:
+    if np is None:
+        return [point_in_polygon_with_tolerance(x, y, polygon, tol_m) for x, y in zip(lons, lats)]
+    x, y = _as_arrays(lons, lats)
+    return _np_with_tolerance(x, y, _lon_m_for(y), polygon, tol_m).tolist()
+
+def _np_near_bbox(g: ParkGeometry, x, y, margin_m: float):
+    eps_lat = 1.5 * margin_m / g.lat_m
+    eps_lon = 1.5 * margin_m / max(g.lon_m, 1e-9)
+    minx, miny, maxx, maxy = g.bbox
+    return (minx - eps_lon <= x) & (x <= maxx + eps_lon) & (miny - eps_lat <= y) & (y <= maxy + eps_lat)
+
+def classify_points(
+    lons: Sequence[float],
+    lats: Sequence[float],
+    geometries: Sequence[ParkGeometry],
+    grace_m: float = 0.0,
+    grid: Optional[ParkGrid] = None,
+) -> List[Optional[str]]:
+    """Пакетный classify_point: имя парка (или None) для каждой точки."""
+    if np is None:
+        return [classify_point(x, y, geometries, grace_m, grid) for x, y in zip(lons, lats)]
+    if grid is not None:
+        # индексы кандидатов относятся к геометриям сетки
+        geometries = grid.geometries
+    x, y = _as_arrays(lons, lats)
+    out: List[Optional[str]] = [None] * len(x)
+    if not len(x) or not geometries:
+        return out
+    # точки-кандидаты для каждого парка по сетке; без сетки — все точки
+    cand = grid.candidates_for_points(x.tolist(), y.tolist()) if grid is not None else None
+    every = np.arange(len(x))
+    todo = np.ones(len(x), dtype=bool)
+
+    def near(i: int, g: ParkGeometry, margin_m: float, use_grid: bool):
+        idx = np.asarray(cand.get(i, []), dtype=np.intp) if use_grid else every
+        idx = idx[todo[idx]]
+        return idx[_np_near_bbox(g, x[idx], y[idx], margin_m)] if len(idx) else idx
+
+    lon_m = _lon_m_for(y)
+    for i, g in enumerate(geometries):
+        idx = near(i, g, g.tolerance_m, cand is not None)
+        if not len(idx):
+            continue
+        hit = idx[_np_with_tolerance(x[idx], y[idx], lon_m[idx], g.polygon, g.tolerance_m, g.edges)]
+        for k in hit.tolist():
+            out[k] = g.name
+        todo[hit] = False
+    if grace_m > 0:
+        use_grid = cand is not None and grid.covers(grace_m)
+        for i, g in enumerate(geometries):
+            idx = near(i, g, grace_m, use_grid)
+            if not len(idx):
+                continue
+            dist = _sqrt_like_scalar(_np_min_sq_dist(x[idx], y[idx], lon_m[idx], g.edges))
+            inside = _np_inside(x[idx], y[idx], g.polygon).tolist()
+            hit = [k for k, d, ins in zip(idx.tolist(), dist, inside) if ins or d <= grace_m]
+            for k in hit:
+                out[k] = g.name
+            todo[hit] = False
+    return out
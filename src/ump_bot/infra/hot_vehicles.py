@@ -0,0 +1,168 @@
+# hot_vehicles.py
+"""
+Фоновый опрос «горячих» ТС (включается HOT_POLL_ENABLED).
+
+Каждый запрос позиции (/status, /map) отмечает ТС как горячее вместе с путём
+токена пользователя. Раз в HOT_POLL_INTERVAL_SEC отдельная asyncio-задача
+обновляет позиции горячих ТС, которые иначе истекли бы в кэше до следующего
+цикла, — не больше HOT_POLL_MAX_PER_CYCLE запросов за цикл, самые старые первыми.
+ТС перестаёт быть горячим через HOT_POLL_TTL_SEC после последнего запроса.
+Пока предохранитель UMP разомкнут, цикл пропускается.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..config import (
+    CACHE_TTL_SEC,
+    HOT_POLL_ENABLED,
+    HOT_POLL_INTERVAL_SEC,
+    HOT_POLL_MAX_PER_CYCLE,
+    HOT_POLL_MAX_VEHICLES,
+    HOT_POLL_TTL_SEC,
+)
+
+logger = logging.getLogger("ump_bot")
+
+
+class HotVehiclePoller:
+    def __init__(
+        self,
+        interval_sec: float = HOT_POLL_INTERVAL_SEC,
+        max_per_cycle: int = HOT_POLL_MAX_PER_CYCLE,
+        hot_ttl_sec: float = HOT_POLL_TTL_SEC,
+        max_vehicles: int = HOT_POLL_MAX_VEHICLES,
+    ):
+        self.interval_sec = max(1.0, float(interval_sec))
+        self.max_per_cycle = max(1, int(max_per_cycle))
+        self.hot_ttl_sec = float(hot_ttl_sec)
+        self.max_vehicles = max(1, int(max_vehicles))
+        self._lock = threading.Lock()
+        # depot_number -> (время последнего запроса, token_path); порядок — LRU
+        self._hot: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.cycles = 0
+        self.refreshed = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_cycle_sec = 0.0
+
+    def touch(self, depot_numbers: Iterable[str], token_path: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            for dep in depot_numbers:
+                dep = str(dep)
+                self._hot[dep] = (now, token_path)
+                self._hot.move_to_end(dep)
+            while len(self._hot) > self.max_vehicles:
+                self._hot.popitem(last=False)
+
+    def hot(self) -> Dict[str, Optional[str]]:
+        """Горячие ТС: {depot_number: token_path}; протухшие выбрасываются."""
+        cutoff = time.time() - self.hot_ttl_sec
+        with self._lock:
+            for dep in [d for d, (ts, _) in self._hot.items() if ts < cutoff]:
+                del self._hot[dep]
+            return {dep: tp for dep, (_, tp) in self._hot.items()}
+
+    def due(self) -> List[Tuple[str, Optional[str]]]:
+        """
+        ТС, которые нужно обновить в этом цикле: позиции нет в памяти или она
+        истечёт до следующего цикла. Самые старые первыми, не больше max_per_cycle.
+        """
+        from . import otbivka
+        from .vehicle_index import get_vehicle_index
+
+        index = get_vehicle_index()
+        expire_before = max(0.0, CACHE_TTL_SEC - self.interval_sec)
+        candidates = []
+        for dep, token_path in self.hot().items():
+            vid = index.get(dep)
+            age = otbivka._POSITIONS.age(vid) if vid is not None else None
+            if age is None:
+                candidates.append((float("inf"), dep, token_path))
+            elif age >= expire_before:
+                candidates.append((age, dep, token_path))
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        return [(dep, tp) for _, dep, tp in candidates[: self.max_per_cycle]]
+
+    async def poll_once(self) -> int:
+        """Один цикл обновления; возвращает число успешно обновлённых ТС."""
+        from .circuit_breaker import get_ump_breaker
+        from .ump_client import get_ump_client
+
+        if get_ump_breaker().is_open():
+            self.skipped += 1
+            return 0
+        due = self.due()
+        if not due:
+            return 0
+        by_token: Dict[Optional[str], List[str]] = {}
+        for dep, token_path in due:
+            by_token.setdefault(token_path, []).append(dep)
+        t0 = time.monotonic()
+        client = get_ump_client()
+        ok = 0
+        for token_path, deps in by_token.items():
+            results = await client.batch_get_positions(deps, token_path=token_path, refresh=True)
+            ok += sum(1 for r in results if r.get("ok"))
+            self.errors += sum(1 for r in results if not r.get("ok"))
+        self.cycles += 1
+        self.refreshed += ok
+        self.last_cycle_sec = time.monotonic() - t0
+        return ok
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning("Фоновый опрос ТС: ошибка цикла: %s", e)
+            await asyncio.sleep(self.interval_sec)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            size = len(self._hot)
+        return {
+            "enabled": HOT_POLL_ENABLED,
+            "running": self._task is not None and not self._task.done(),
+            "hot": size,
+            "cycles": self.cycles,
+            "refreshed": self.refreshed,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "last_cycle_sec": self.last_cycle_sec,
+        }
+
+
+_POLLER = HotVehiclePoller()
+
+
+def get_hot_poller() -> HotVehiclePoller:
+    return _POLLER
+
+
+def touch_hot(depot_numbers: Iterable[str], token_path: Optional[str] = None) -> None:
+    """Отметить ТС как запрошенные (без эффекта, если опрос выключен)."""
+    if HOT_POLL_ENABLED:
+        _POLLER.touch(depot_numbers, token_path)
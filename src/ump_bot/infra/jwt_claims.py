@@ -0,0 +1,47 @@
+# jwt_claims.py
+"""Чтение полей (claims) JWT-токена UMP без проверки подписи."""
+import base64
+import json
+from typing import Any, Dict, Optional
+
+
+def decode_jwt_payload(token: str) -> Optional[Dict[str, Any]]:
+    """Полезная нагрузка JWT (header.payload.signature) или None, если это не JWT."""
+    if not token or "." not in token:
+        return None
+    parts = token.strip().split(".")
+    if len(parts) < 2:
+        return None
+    payload_b64 = parts[1]
+    # base64url padding
+    rem = len(payload_b64) % 4
+    if rem:
+        payload_b64 += "=" * (4 - rem)
+    try:
+        decoded = base64.urlsafe_b64decode(payload_b64.encode("utf-8"))
+        data = json.loads(decoded.decode("utf-8"))
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def token_user_id(token: str) -> Optional[int]:
+    data = decode_jwt_payload(token)
+    if not data:
+        return None
+    uid = data.get("userId") or data.get("user_id") or data.get("user") or data.get("id")
+    try:
+        return int(uid) if uid is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """Момент истечения токена (unix time, поле exp) или None, если срок не указан."""
+    data = decode_jwt_payload(token)
+    if not data:
+        return None
+    try:
+        return float(data["exp"])
+    except (KeyError, TypeError, ValueError):
+        return None
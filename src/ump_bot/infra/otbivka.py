@@ -1,16 +1,36 @@
 # otbivka.py
-import os, json, re, math, requests
+import os, json, re, math, threading, time, atexit, requests
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Tuple, Dict
 from ..domain.park import Park
+from ..domain.vehicle import CachedPosition, VehicleStatus
+from . import geofence
+from .circuit_breaker import CircuitOpenError, get_ump_breaker, is_failure_status
+from .hot_vehicles import touch_hot
+from .retry import get_ump_retry_policy, is_retryable_status, parse_retry_after
+from .park_grid import ParkGrid
+from .park_registry import ParkGeometry, get_park_registry, load_parks
+from .position_cache import PositionCache
+from .position_store import PositionStore
+from .sessions import account_key, get_session
+from .singleflight import SingleFlight
+from .vehicle_index import get_vehicle_index
 from ..config import (
     UMP_BASE_URL,
     UMP_TOKEN_FILE,
     PARKS_FILE,
     UMP_TZ_OFFSET,
     REQUEST_TIMEOUT,
+    UMP_BATCH_CONCURRENCY,
+    UMP_CALL_TIMEOUT,
+    UMP_BULK_RESOLVE,
+    UMP_BULK_REFRESH_SEC,
     CACHE_DIR,
     CACHE_TTL_SEC,
+    POSITION_CACHE_MAX,
+    POSITION_STALE_OK_SEC,
     ANTI_FLAP_GRACE_M,
+    LOG_LEVEL,
 )
 try:
     from .login_token import login_and_save as _auto_login
@@ -18,7 +38,32 @@ except Exception:
     _auto_login = None
 
 # ---------- UMP auth/requests ----------
-_SESSION = None
+# path -> ((st_mtime_ns, st_size), token): файл перечитывается только при изменении
+_TOKEN_CACHE: Dict[str, Tuple[Tuple[int, int], str]] = {}
+# token -> готовые заголовки (общие для всех запросов пакета, не изменять на месте)
+_HEADERS_CACHE: Dict[str, Dict[str, str]] = {}
+_TOKEN_LOCK = threading.Lock()
+
+def invalidate_token_cache(token_path: Optional[str] = None) -> None:
+    """Сбрасывает кэш токена (после перелогина); без аргумента — целиком."""
+    with _TOKEN_LOCK:
+        if token_path is None:
+            _TOKEN_CACHE.clear()
+        else:
+            _TOKEN_CACHE.pop(token_path, None)
+
+def _relogin() -> None:
+    _auto_login()
+    invalidate_token_cache()
+
+def _remember_token(path: str, token: str) -> None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return
+    with _TOKEN_LOCK:
+        _TOKEN_CACHE[path] = ((st.st_mtime_ns, st.st_size), token)
+
 def _load_token(token_override: Optional[str] = None, token_path: Optional[str] = None) -> str:
     """
     Загружает токен UMP.
@@ -36,12 +81,21 @@ def _load_token(token_override: Optional[str] = None, token_path: Optional[str]
 
     path = token_path or UMP_TOKEN_FILE
 
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    if st is not None:
+        cached = _TOKEN_CACHE.get(path)
+        if cached and cached[0] == (st.st_mtime_ns, st.st_size):
+            return cached[1]
+
     # Проверяем существование файла
-    if not os.path.exists(path):
+    if st is None:
         # Авто-логин разрешаем только для стандартного пути и когда заданы креды в env
         if _auto_login and not token_path and UMP_USER and UMP_PASS:
             try:
-                _auto_login()
+                _relogin()
             except Exception as e:
                 raise FileNotFoundError(f"Токен не найден и авторизация не удалась: {e}")
         else:
@@ -58,30 +112,59 @@ def _load_token(token_override: Optional[str] = None, token_path: Optional[str]
     if not token:
         # Токен пустой - пытаемся обновить (только при стандартном пути и автологине)
         if _auto_login and not token_path and UMP_USER and UMP_PASS:
-            _auto_login()
+            _relogin()
             with open(path, "r", encoding="utf-8") as f2:
                 token = f2.read().strip()
         else:
             raise ValueError("Токен пустой и авторизация невозможна")
+    _remember_token(path, token)
     return token
 
-def _get_session() -> requests.Session:
-    global _SESSION
-    if _SESSION is None:
-        _SESSION = requests.Session()
-    return _SESSION
+def _get_session(token: Optional[str] = None, token_path: Optional[str] = None) -> requests.Session:
+    """Сессия аккаунта: свой пул соединений и cookies (см. sessions.py)."""
+    return get_session(token=token, token_path=token_path)
 
 def _auth_headers(token: Optional[str] = None, token_path: Optional[str] = None) -> Dict[str, str]:
+    """Заголовки UMP для токена. Словарь общий — для дополнений делайте копию."""
     t = _load_token(token_override=token, token_path=token_path)
-    return {
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "User-Agent": "UMPProbe/1.3",
-        "auth": t,
-        "token": t,
-        "X-Timezone-Offset": str(UMP_TZ_OFFSET),
-        "Referer": f"{UMP_BASE_URL}/map",
-    }
+    headers = _HEADERS_CACHE.get(t)
+    if headers is None:
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "User-Agent": "UMPProbe/1.3",
+            "auth": t,
+            "token": t,
+            "X-Timezone-Offset": str(UMP_TZ_OFFSET),
+            "Referer": f"{UMP_BASE_URL}/map",
+        }
+        with _TOKEN_LOCK:
+            if len(_HEADERS_CACHE) >= 64:
+                _HEADERS_CACHE.clear()
+            _HEADERS_CACHE[t] = headers
+    return headers
+
+def _guarded(send):
+    """
+    Запрос к UMP через предохранитель: при разомкнутом — CircuitOpenError без сети,
+    иначе результат (таймаут/ошибка соединения/5xx/429 — сбой) учитывается.
+    Любое другое исключение исхода не даёт — слот пробы освобождается.
+    """
+    breaker = get_ump_breaker()
+    breaker.before_call()
+    try:
+        r = send()
+    except requests.RequestException as e:
+        breaker.record_failure(e)
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    if is_failure_status(r.status_code):
+        breaker.record_failure(RuntimeError(f"HTTP {r.status_code}"))
+    else:
+        breaker.record_success()
+    return r
 
 def _as_list(data):
     if isinstance(data, list): return data
@@ -101,89 +184,164 @@ def parse_wkt_point(s: str) -> Optional[Tuple[float,float]]:
     lon, lat = float(m.group(1)), float(m.group(2))
     return (lat, lon)  # возвращаем (lat, lon)
 
-def get_vehicle_id_by_depot_number(
-    depot_number: str,
+def _ump_request(
+    method: str,
+    url: str,
     token: Optional[str] = None,
     token_path: Optional[str] = None,
-) -> Optional[int]:
-    url = f"{UMP_BASE_URL}/api/v1/map/vehicles"
-    s = _get_session()
-    for attempt in range(2):
+    timeout: Optional[float] = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    Запрос к UMP через предохранитель с общей политикой повторов (retry.py):
+    временные сбои повторяются с джиттером в пределах глобального бюджета,
+    на 401 — один перелогин (только для токена из env). Возвращает успешный ответ.
+    """
+    policy = get_ump_retry_policy()
+    policy.on_request()
+    relogged = False
+    attempt = 0
+    while True:
+        # сессия берётся на каждую попытку: после перелогина подхватываются новые cookies
+        send = getattr(_get_session(token=token, token_path=token_path), method.lower())
+        # заголовки (чтение токена) — до предохранителя: нет токена — нет и пробы
+        headers = _auth_headers(token=token, token_path=token_path)
         try:
-            r = s.post(
+            r = _guarded(lambda: send(
                 url,
-                params={"number": str(depot_number)},
-                json={},
-                headers=_auth_headers(token=token, token_path=token_path),
-                timeout=REQUEST_TIMEOUT,
-            )
+                headers=headers,
+                timeout=timeout or REQUEST_TIMEOUT,
+                **kwargs,
+            ))
             r.raise_for_status()
-            break
+            return r
+        except CircuitOpenError:
+            # UMP недоступен — не ждём и не повторяем
+            raise
         except requests.HTTPError as e:
-            if (
-                e.response is not None
-                and e.response.status_code == 401
-                and _auto_login
-                and attempt == 0
-                and token is None
-                and token_path is None
-            ):
-                _auto_login()
+            status = e.response.status_code if e.response is not None else None
+            if status == 401 and _auto_login and not relogged and token is None and token_path is None:
+                _relogin()
+                relogged = True
                 continue
-            raise
-    items = _as_list(r.json())
+            if not is_retryable_status(status):
+                raise
+            delay = policy.backoff(attempt, parse_retry_after(e.response.headers.get("Retry-After")))
+            if delay is None:
+                raise
+        except requests.RequestException:
+            delay = policy.backoff(attempt)
+            if delay is None:
+                raise
+        time.sleep(delay)
+        attempt += 1
+
+def _post_vehicles(
+    params: Optional[Dict[str, str]] = None,
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> List[Dict]:
+    r = _ump_request(
+        "POST",
+        f"{UMP_BASE_URL}/api/v1/map/vehicles",
+        token=token,
+        token_path=token_path,
+        timeout=timeout,
+        params=params,
+        json={},
+    )
+    return [it for it in _as_list(r.json()) if isinstance(it, dict)]
+
+def _item_depot_and_id(it: Dict) -> Tuple[Optional[str], Optional[int]]:
+    dep = it.get("depotNumber") or it.get("depot_number") or it.get("number")
+    vid = it.get("vehicle_id") or it.get("id") or it.get("vehicleId")
+    return (str(dep) if dep is not None else None), (int(vid) if vid is not None else None)
+
+def get_vehicle_id_by_depot_number(
+    depot_number: str,
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Optional[int]:
+    items = _post_vehicles({"number": str(depot_number)}, token=token, token_path=token_path, timeout=timeout)
     for it in items:
-        dep = it.get("depotNumber") or it.get("depot_number") or it.get("number")
-        vid = it.get("vehicle_id") or it.get("id") or it.get("vehicleId")
-        if str(dep) == str(depot_number) and vid is not None:
-            return int(vid)
+        dep, vid = _item_depot_and_id(it)
+        if dep == str(depot_number) and vid is not None:
+            return vid
     if items:
-        vid = items[0].get("vehicle_id") or items[0].get("id") or items[0].get("vehicleId")
+        _, vid = _item_depot_and_id(items[0])
         if vid is not None:
-            return int(vid)
+            return vid
     return None
 
+def fetch_vehicle_listing(
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> List[Dict]:
+    """Полный список ТС, доступных аккаунту (тот же /api/v1/map/vehicles без фильтра)."""
+    return _post_vehicles(None, token=token, token_path=token_path, timeout=timeout)
+
+_FLEET_LOCK = threading.Lock()
+
+def refresh_fleet_index(
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+    force: bool = False,
+) -> int:
+    """
+    Заполняет индекс depot_number -> vehicle_id (+ метаданные) одним запросом списка ТС.
+    Повторно список тянется не чаще раза в UMP_BULK_REFRESH_SEC. Возвращает число записей.
+    """
+    index = get_vehicle_index()
+    if not force and index.listing_age() < UMP_BULK_REFRESH_SEC:
+        return 0
+    with _FLEET_LOCK:
+        # пока ждали блокировку, список мог обновить другой поток
+        if not force and index.listing_age() < UMP_BULK_REFRESH_SEC:
+            return 0
+        items = fetch_vehicle_listing(token=token, token_path=token_path, timeout=timeout)
+        n = index.put_many(_fleet_entries(items))
+    index.save_if_due()
+    return n
+
+def _fleet_entries(items: List[Dict]) -> List[Tuple[str, int, Dict]]:
+    """Список ТС -> записи индекса (depot_number, vehicle_id, скалярные метаданные)."""
+    entries = []
+    for it in items:
+        dep, vid = _item_depot_and_id(it)
+        if dep is None or vid is None:
+            continue
+        meta = {
+            k: v for k, v in it.items()
+            if v is None or isinstance(v, (str, int, float, bool))
+        }
+        entries.append((dep, vid, meta))
+    return entries
+
 def fetch_online_by_vehicle_id(
     vehicle_id: int,
     token: Optional[str] = None,
     token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
 ) -> Dict:
-    url = f"{UMP_BASE_URL}/api/v1/map/online/{vehicle_id}"
-    s = _get_session()
-    last_exc = None
-    for attempt in range(3):
-        try:
-            r = s.get(
-                url,
-                headers=_auth_headers(token=token, token_path=token_path),
-                timeout=REQUEST_TIMEOUT,
-            )
-            r.raise_for_status()
-            data = (
-                r.json()
-                if "application/json" in r.headers.get("Content-Type", "")
-                else {}
-            )
-            break
-        except Exception as e:
-            last_exc = e
-            # если 401 — один раз пробуем перелогиниться
-            if (
-                isinstance(e, requests.HTTPError)
-                and e.response is not None
-                and e.response.status_code == 401
-                and _auto_login
-                and attempt < 2
-                and token is None
-                and token_path is None
-            ):
-                _auto_login()
-                continue
-            if attempt < 2:
-                import time as _t
-                _t.sleep(0.3 * (2 ** attempt))
-                continue
-            raise
+    r = _ump_request(
+        "GET",
+        f"{UMP_BASE_URL}/api/v1/map/online/{vehicle_id}",
+        token=token,
+        token_path=token_path,
+        timeout=timeout,
+    )
+    data = r.json() if "application/json" in r.headers.get("Content-Type", "") else {}
+    return _parse_online(vehicle_id, data)
+
+# полный ответ UMP держим в результатах только при отладке — на весь парк это заметная память
+_KEEP_RAW = LOG_LEVEL == "DEBUG"
+
+def _parse_online(vehicle_id: int, data: Dict) -> Dict:
+    """Ответ /api/v1/map/online/{id} -> {vehicle_id, depot_number, lat, lon, time, raw}."""
     center = data.get("center")
     lat = lon = None
     if isinstance(center, str):
@@ -196,197 +354,334 @@ def fetch_online_by_vehicle_id(
         "depot_number": depot,
         "lat": lat, "lon": lon,
         "time": tstamp,
-        "raw": data
+        "raw": data if _KEEP_RAW else None
     }
 
-# ---------- File cache ----------
-def _cache_path_for(vehicle_id: int) -> str:
-    return os.path.join(CACHE_DIR, f"online_{vehicle_id}.json")
-
-def _load_cached_position(vehicle_id: int) -> Optional[Dict]:
+# ---------- Position cache ----------
+# Память — основной уровень (LRU + TTL), SQLite (CACHE_DIR/positions.sqlite3) — только
+# персистентность между перезапусками: пишется фоном пачками, читается при промахе памяти.
+POSITIONS_DB = os.path.join(CACHE_DIR, "positions.sqlite3")
+# как часто чистить из базы записи, которые уже не пригодятся ни как свежие, ни как stale
+_STORE_VACUUM_INTERVAL_SEC = 3600.0
+_STORE: Optional[PositionStore] = None
+_STORE_LOCK = threading.Lock()
+_STORE_LAST_VACUUM = 0.0
+
+def _retention_sec() -> float:
+    return float(max(CACHE_TTL_SEC, POSITION_STALE_OK_SEC))
+
+def _get_store() -> PositionStore:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                store = PositionStore(POSITIONS_DB)
+                store.import_legacy_files(CACHE_DIR)
+                _STORE = store
+    return _STORE
+
+def _persist_positions(entries: List[Dict]) -> None:
+    global _STORE_LAST_VACUUM
+    store = _get_store()
+    store.upsert_many(entries)
+    now = time.time()
+    if now - _STORE_LAST_VACUUM >= _STORE_VACUUM_INTERVAL_SEC:
+        _STORE_LAST_VACUUM = now
+        store.vacuum(_retention_sec())
+
+_POSITIONS = PositionCache(POSITION_CACHE_MAX, CACHE_TTL_SEC, persist=_persist_positions)
+atexit.register(_POSITIONS.flush)
+
+def position_cache_stats() -> Dict[str, int]:
+    return _POSITIONS.stats()
+
+def _load_cached_position(vehicle_id: int, max_age: Optional[float] = None) -> Optional[Dict]:
+    """Позиция из памяти или базы не старше max_age (по умолчанию CACHE_TTL_SEC)."""
+    max_age = CACHE_TTL_SEC if max_age is None else max_age
+    cached = _POSITIONS.get(vehicle_id, max_age=max_age)
+    if cached:
+        return cached
     try:
-        path = _cache_path_for(vehicle_id)
-        if not os.path.exists(path):
-            return None
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        import time
-        if (time.time() - data.get("ts", 0)) > CACHE_TTL_SEC:
-            return None
-        return data
+        data = _get_store().get(vehicle_id, max_age=max_age)
     except Exception:
         return None
-
-def _save_cached_position(vehicle_id: int, lat: float, lon: float, in_park: bool, park_name: Optional[str], raw_time) -> None:
+    if data:
+        data = CachedPosition.from_mapping(data)
+        _POSITIONS.put(vehicle_id, data, persist=False)
+    return data
+
+def _warm_position_cache(vehicle_ids: List[int]) -> None:
+    """Подгружает в память позиции пакета ТС одним запросом к базе."""
+    missing = [v for v in vehicle_ids if _POSITIONS.get(v, max_age=_retention_sec()) is None]
+    if not missing:
+        return
     try:
-        import time
-        path = _cache_path_for(vehicle_id)
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({
-                "ts": time.time(),
-                "vehicle_id": vehicle_id,
-                "lat": lat,
-                "lon": lon,
-                "in_park": in_park,
-                "park_name": park_name,
-                "time": raw_time,
-            }, f, ensure_ascii=False)
+        rows = _get_store().get_many(missing, max_age=_retention_sec())
     except Exception:
-        pass
+        return
+    for vid, entry in rows.items():
+        _POSITIONS.put(vid, CachedPosition.from_mapping(entry), persist=False)
 
-# ---------- Geometry / Geofencing ----------
-def load_parks(path=PARKS_FILE) -> List[Park]:
-    with open(path, "r", encoding="utf-8") as f:
-        cfg = json.load(f)
-    parks = cfg.get("parks") or []
-    out = []
-    for p in parks:
-        poly = p.get("polygon") or []
-        if len(poly) >= 2 and poly[0] == poly[-1]:
-            poly = poly[:-1]
-        out.append({
-            "name": p.get("name","park"),
-            "polygon": [(float(x), float(y)) for x, y in poly],  # (lon, lat)
-            "tolerance_m": float(p.get("tolerance_m", 0.0)),
-            "address_default": p.get("address_default"),
-            "addresses": p.get("addresses")
-        })
-    return out
+def _save_cached_position(vehicle_id: int, lat: float, lon: float, in_park: bool, park_name: Optional[str], raw_time) -> None:
+    _POSITIONS.put(vehicle_id, CachedPosition(
+        ts=time.time(),
+        vehicle_id=vehicle_id,
+        lat=lat,
+        lon=lon,
+        in_park=in_park,
+        park_name=park_name,
+        time=raw_time,
+    ))
 
+# ---------- Geometry / Geofencing ----------
+# Реализация — в geofence.py (там же пакетные функции для всего парка ТС).
 def meters_per_degree(lat_deg: float) -> Tuple[float,float]:
-    lat_m = 111_132.0
-    lon_m = 111_320.0 * math.cos(math.radians(lat_deg))
-    return lat_m, lon_m
+    return geofence.meters_per_degree(lat_deg)
 
 def point_in_polygon(lon: float, lat: float, polygon: List[Tuple[float,float]]) -> bool:
-    inside = False
-    n = len(polygon)
-    if n < 3: return False
-    for i in range(n):
-        x1, y1 = polygon[i]
-        x2, y2 = polygon[(i+1) % n]
-        cond = ((y1 > lat) != (y2 > lat)) and (lon < (x2 - x1) * (lat - y1) / (y2 - y1 + 1e-15) + x1)
-        if cond:
-            inside = not inside
-    return inside
+    return geofence.point_in_polygon(lon, lat, polygon)
 
 def point_in_polygon_with_tolerance(lon: float, lat: float, polygon: List[Tuple[float,float]], tol_m: float) -> bool:
-    if point_in_polygon(lon, lat, polygon):
-        return True
-    if tol_m <= 0:
-        return False
-    lons = [p[0] for p in polygon]; lats = [p[1] for p in polygon]
-    lat_m, lon_m = meters_per_degree(lat)
-    eps_lon = tol_m / max(lon_m, 1e-9)
-    eps_lat = tol_m / lat_m
-    in_bbox = (min(lons)-eps_lon <= lon <= max(lons)+eps_lon) and (min(lats)-eps_lat <= lat <= max(lats)+eps_lat)
-    if not in_bbox:
-        return False
-    for i in range(len(polygon)):
-        x1, y1 = polygon[i]
-        x2, y2 = polygon[(i+1) % len(polygon)]
-        dx = x2 - x1; dy = y2 - y1
-        if dx == dy == 0: 
-            continue
-        t = max(0.0, min(1.0, ((lon - x1)*dx + (lat - y1)*dy) / (dx*dx + dy*dy)))
-        proj_x = x1 + t*dx; proj_y = y1 + t*dy
-        d_lon = (lon - proj_x) * lon_m
-        d_lat = (lat - proj_y) * lat_m
-        dist_m = (d_lon*d_lon + d_lat*d_lat)**0.5
-        if dist_m <= tol_m:
-            return True
-    return False
+    return geofence.point_in_polygon_with_tolerance(lon, lat, polygon, tol_m)
 
 def distance_to_polygon_m(lon: float, lat: float, polygon: List[Tuple[float,float]]) -> float:
-    lons = [p[0] for p in polygon]; lats = [p[1] for p in polygon]
-    lat_m, lon_m = meters_per_degree(lat)
-    best = float("inf")
-    for i in range(len(polygon)):
-        x1, y1 = polygon[i]
-        x2, y2 = polygon[(i+1) % len(polygon)]
-        dx = x2 - x1; dy = y2 - y1
-        if dx == dy == 0:
-            continue
-        t = max(0.0, min(1.0, ((lon - x1)*dx + (lat - y1)*dy) / (dx*dx + dy*dy)))
-        proj_x = x1 + t*dx; proj_y = y1 + t*dy
-        d_lon = (lon - proj_x) * lon_m
-        d_lat = (lat - proj_y) * lat_m
-        dist_m = (d_lon*d_lon + d_lat*d_lat)**0.5
-        if dist_m < best:
-            best = dist_m
-    if point_in_polygon(lon, lat, polygon):
-        return 0.0
-    return best
-
-def locate_park(lon: float, lat: float, parks: List[Dict]) -> Optional[str]:
+    return geofence.distance_to_polygon_m(lon, lat, polygon)
+
+def locate_park(lon: float, lat: float, parks: Optional[List[Dict]] = None) -> Optional[str]:
+    """
+    Парк, в полигон которого (с tolerance_m) попала точка. Без parks — по реестру
+    парков с его сеткой: проверяются только парки рядом с точкой.
+    """
+    if parks is None:
+        registry = get_park_registry()
+        return geofence.classify_point(lon, lat, registry.geometries(), 0.0, grid=registry.grid())
     for p in parks:
         if point_in_polygon_with_tolerance(lon, lat, p["polygon"], p["tolerance_m"]):
             return p["name"]
     return None
 
+def classify_point(
+    lon: float,
+    lat: float,
+    geometries: List[ParkGeometry],
+    grace_m: Optional[float] = None,
+    grid: Optional[ParkGrid] = None,
+) -> Optional[str]:
+    """
+    Парк, в котором находится точка (с учётом tolerance_m), либо — анти-флап —
+    первый парк, до границы которого не больше grace_m (по умолчанию ANTI_FLAP_GRACE_M).
+    grid — сетка реестра по тем же geometries (ParkRegistry.grid()).
+    """
+    grace = ANTI_FLAP_GRACE_M if grace_m is None else grace_m
+    return geofence.classify_point(lon, lat, geometries, grace, grid=grid)
+
+def classify_points(
+    lons: List[float],
+    lats: List[float],
+    geometries: List[ParkGeometry],
+    grace_m: Optional[float] = None,
+    grid: Optional[ParkGrid] = None,
+) -> List[Optional[str]]:
+    """classify_point для массива точек за один проход по паркам."""
+    grace = ANTI_FLAP_GRACE_M if grace_m is None else grace_m
+    return geofence.classify_points(lons, lats, geometries, grace, grid=grid)
+
 # ---------- Orchestrator ----------
-def get_position_and_check(
-    depot_number: str,
+# Одновременные запросы одного и того же ТС (несколько диспетчеров прислали один список)
+# выполняются в UMP один раз, остальные потоки получают тот же результат.
+# Ключ включает аккаунт: ответы и ошибки (401, истёкшая сессия) одного аккаунта
+# не должны доставаться другому.
+_RESOLVE_FLIGHT = SingleFlight()
+_ONLINE_FLIGHT = SingleFlight()
+
+def _fetch_online_shared(
+    vehicle_id: int,
     token: Optional[str] = None,
     token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
 ) -> Dict:
-    vid = get_vehicle_id_by_depot_number(depot_number, token=token, token_path=token_path)
+    return _ONLINE_FLIGHT.do(
+        (account_key(token, token_path), int(vehicle_id)),
+        lambda: fetch_online_by_vehicle_id(vehicle_id, token=token, token_path=token_path, timeout=timeout),
+    )
+
+def _resolve_vehicle_id(
+    depot_number: str,
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Tuple[Optional[int], bool]:
+    """
+    depot_number -> vehicle_id: сначала индекс, затем запрос в UMP.
+    Возвращает (vehicle_id, взят_из_индекса).
+    """
+    index = get_vehicle_index()
+    vid = index.get(depot_number)
+    if vid is not None:
+        return vid, True
+    vid = _RESOLVE_FLIGHT.do(
+        (account_key(token, token_path), str(depot_number)),
+        lambda: get_vehicle_id_by_depot_number(depot_number, token=token, token_path=token_path, timeout=timeout),
+    )
+    if vid is not None:
+        index.put(depot_number, vid)
+        index.save_if_due()
+    return vid, False
+
+def _is_stale_index_hit(pos: Dict, depot_number: str) -> bool:
+    dep = pos.get("depot_number")
+    return dep is not None and str(dep) != str(depot_number)
+
+def _result_from_cache(depot_number: str, vid: int, cached: Dict) -> VehicleStatus:
+    return VehicleStatus(
+        ok=True,
+        depot_number=str(depot_number),
+        vehicle_id=vid,
+        lat=cached.get("lat"), lon=cached.get("lon"),
+        time=cached.get("time"),
+        in_park=bool(cached.get("in_park")),
+        park_name=cached.get("park_name"),
+    )
+
+def _cached_fallback(depot_number: str, vid: int, error: BaseException) -> Optional[VehicleStatus]:
+    """
+    Позиция из кэша, когда UMP не ответил. При разомкнутом предохранителе годится
+    и устаревшая (в пределах хранения базы) — с пометкой "stale".
+    """
+    max_age = _retention_sec() if isinstance(error, CircuitOpenError) else None
+    cached = _load_cached_position(vid, max_age=max_age)
+    if not cached:
+        return None
+    res = _result_from_cache(depot_number, vid, cached)
+    age = time.time() - cached.get("ts", 0)
+    if age > CACHE_TTL_SEC:
+        res["stale"] = True
+        res["age_sec"] = int(age)
+    return res
+
+# Фоновое обновление устаревших позиций (stale-while-revalidate)
+_REVALIDATE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ump-revalidate")
+_REVALIDATING: set = set()
+_REVALIDATING_LOCK = threading.Lock()
+
+def _schedule_revalidate(
+    depot_number: str,
+    vid: int,
+    token: Optional[str],
+    token_path: Optional[str],
+    timeout: Optional[float],
+) -> None:
+    with _REVALIDATING_LOCK:
+        if vid in _REVALIDATING:
+            return
+        _REVALIDATING.add(vid)
+
+    def job() -> None:
+        try:
+            get_position_and_check(depot_number, token=token, token_path=token_path, timeout=timeout, stale_ok=0)
+        except Exception:
+            pass
+        finally:
+            with _REVALIDATING_LOCK:
+                _REVALIDATING.discard(vid)
+
+    try:
+        _REVALIDATE_POOL.submit(job)
+    except RuntimeError:
+        # пул уже остановлен (завершение процесса)
+        with _REVALIDATING_LOCK:
+            _REVALIDATING.discard(vid)
+
+_Pending = Tuple[int, Dict]
+
+def _fetch_position(
+    depot_number: str,
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+    stale_ok: Optional[float] = None,
+) -> Tuple[Optional[Dict], Optional[_Pending]]:
+    """
+    Сетевая часть get_position_and_check без геофенсинга.
+    Возвращает (готовый_результат, None) — из кэша или с ошибкой — либо
+    (None, (vehicle_id, pos)), если свежую точку ещё нужно отнести к парку.
+    """
+    vid, from_index = _resolve_vehicle_id(depot_number, token=token, token_path=token_path, timeout=timeout)
     if vid is None:
-        return {"ok": False, "depot_number": depot_number, "error": "vehicle_id_not_found"}
+        return VehicleStatus(ok=False, depot_number=depot_number, error="vehicle_id_not_found"), None
+    # свежая позиция из памяти — без запроса в UMP
+    fresh = _POSITIONS.get(vid)
+    if fresh:
+        return _result_from_cache(depot_number, vid, fresh), None
+    stale_window = POSITION_STALE_OK_SEC if stale_ok is None else stale_ok
+    if stale_window > CACHE_TTL_SEC:
+        stale = _POSITIONS.get(vid, max_age=stale_window)
+        if stale:
+            _schedule_revalidate(depot_number, vid, token, token_path, timeout)
+            res = _result_from_cache(depot_number, vid, stale)
+            res["stale"] = True
+            res["age_sec"] = int(time.time() - stale.get("ts", 0))
+            return res, None
     try:
-        pos = fetch_online_by_vehicle_id(vid, token=token, token_path=token_path)
+        try:
+            pos = _fetch_online_shared(vid, token=token, token_path=token_path, timeout=timeout)
+            stale_hit = from_index and _is_stale_index_hit(pos, depot_number)
+        except requests.HTTPError as e:
+            if not (from_index and e.response is not None and e.response.status_code == 404):
+                raise
+            stale_hit = True
+        if stale_hit:
+            # vehicle_id из индекса устарел (ТС не найдено/переоформлено) — разрешаем заново
+            get_vehicle_index().invalidate(depot_number)
+            vid, _ = _resolve_vehicle_id(depot_number, token=token, token_path=token_path, timeout=timeout)
+            if vid is None:
+                return VehicleStatus(ok=False, depot_number=depot_number, error="vehicle_id_not_found"), None
+            pos = _fetch_online_shared(vid, token=token, token_path=token_path, timeout=timeout)
     except Exception as e:
-        cached = _load_cached_position(vid)
-        if cached:
-            return {
-                "ok": True,
-                "depot_number": str(depot_number),
-                "vehicle_id": vid,
-                "lat": cached.get("lat"), "lon": cached.get("lon"),
-                "time": cached.get("time"),
-                "in_park": bool(cached.get("in_park")),
-                "park_name": cached.get("park_name")
-            }
+        res = _cached_fallback(depot_number, vid, e)
+        if res:
+            return res, None
         raise
-    lat, lon = pos["lat"], pos["lon"]
-    if lat is None or lon is None:
+    if pos["lat"] is None or pos["lon"] is None:
         cached = _load_cached_position(vid)
         if cached:
-            return {
-                "ok": True,
-                "depot_number": str(depot_number),
-                "vehicle_id": vid,
-                "lat": cached.get("lat"), "lon": cached.get("lon"),
-                "time": cached.get("time"),
-                "in_park": bool(cached.get("in_park")),
-                "park_name": cached.get("park_name")
-            }
-        return {"ok": False, "depot_number": depot_number, "vehicle_id": vid, "error": "no_coords", "raw": pos["raw"]}
-    parks = load_parks(PARKS_FILE)
-    park_name = locate_park(lon, lat, parks) if parks else None
-
-    # анти-флап возле границы
-    if not park_name and parks and ANTI_FLAP_GRACE_M > 0:
-        try:
-            for p in parks:
-                d = distance_to_polygon_m(lon, lat, p["polygon"])
-                if d <= ANTI_FLAP_GRACE_M:
-                    park_name = p["name"]
-                    break
-        except Exception:
-            pass
+            return _result_from_cache(depot_number, vid, cached), None
+        return VehicleStatus(ok=False, depot_number=depot_number, vehicle_id=vid, error="no_coords", raw=pos.get("raw")), None
+    return None, (vid, pos)
 
+def _finalize_position(depot_number: str, vid: int, pos: Dict, park_name: Optional[str]) -> VehicleStatus:
+    lat, lon = pos["lat"], pos["lon"]
     _save_cached_position(vid, lat, lon, park_name is not None, park_name, pos.get("time"))
-    return {
-        "ok": True,
-        "depot_number": str(depot_number),
-        "vehicle_id": vid,
-        "lat": lat, "lon": lon,
-        "time": pos.get("time"),
-        "in_park": park_name is not None,
-        "park_name": park_name
-    }
+    return VehicleStatus(
+        ok=True,
+        depot_number=str(depot_number),
+        vehicle_id=vid,
+        lat=lat, lon=lon,
+        time=pos.get("time"),
+        in_park=park_name is not None,
+        park_name=park_name,
+    )
+
+def get_position_and_check(
+    depot_number: str,
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+    stale_ok: Optional[float] = None,
+) -> Dict:
+    """
+    Позиция ТС и попадание в парк.
+    stale_ok — сколько секунд допустимо отдавать устаревшую позицию из кэша сразу
+    (с пометкой "stale": True), обновляя её в фоне; None -> POSITION_STALE_OK_SEC.
+    """
+    touch_hot([depot_number], token_path)
+    res, pending = _fetch_position(depot_number, token=token, token_path=token_path, timeout=timeout, stale_ok=stale_ok)
+    if pending is None:
+        return res
+    vid, pos = pending
+    registry = get_park_registry()
+    park_name = classify_point(pos["lon"], pos["lat"], registry.geometries(), grid=registry.grid())
+    return _finalize_position(depot_number, vid, pos, park_name)
 
 def _normalize_token(tok: str) -> str:
     return tok.strip()
@@ -453,30 +748,86 @@ def parse_depots_from_args(args: List[str]) -> Tuple[List[str], List[Dict]]:
 
     return valid, invalid
 
+def _batch_error(dep: str, e: Exception) -> VehicleStatus:
+    if isinstance(e, CircuitOpenError):
+        return VehicleStatus(ok=False, depot_number=str(dep), error="ump_unavailable", detail=str(e))
+    if isinstance(e, requests.HTTPError):
+        return VehicleStatus(
+            ok=False,
+            depot_number=str(dep),
+            error="http_error",
+            status=getattr(e.response, "status_code", None),
+            detail=(getattr(e.response, "text", "") or "")[:400],
+        )
+    return VehicleStatus(
+        ok=False,
+        depot_number=str(dep),
+        error="exception",
+        detail=str(e),
+    )
+
 def batch_get_positions(
     depot_numbers: List[str],
     token: Optional[str] = None,
     token_path: Optional[str] = None,
+    max_workers: Optional[int] = None,
+    call_timeout: Optional[float] = None,
+    stale_ok: Optional[float] = None,
 ) -> List[Dict]:
-    results: List[Dict] = []
-    for dep in depot_numbers:
+    """
+    Позиции для списка ТС. Запросы идут параллельно (не более max_workers одновременно,
+    по умолчанию UMP_BATCH_CONCURRENCY), каждый HTTP-вызов ограничен call_timeout.
+    Порядок результатов совпадает с порядком depot_numbers; ошибки по отдельному ТС
+    не прерывают пакет, а возвращаются как {"ok": False, ...}.
+    stale_ok — как в get_position_and_check.
+    """
+    workers = UMP_BATCH_CONCURRENCY if max_workers is None else max(1, int(max_workers))
+    timeout = call_timeout or UMP_CALL_TIMEOUT
+    touch_hot(depot_numbers, token_path)
+
+    index = get_vehicle_index()
+    if UMP_BULK_RESOLVE and depot_numbers:
+        if any(index.get(dep) is None for dep in depot_numbers):
+            try:
+                refresh_fleet_index(token=token, token_path=token_path, timeout=timeout)
+            except Exception:
+                # не критично: неизвестные ТС разрешатся поштучно
+                pass
+    known_vids = [v for v in (index.get(dep) for dep in depot_numbers) if v is not None]
+    if known_vids:
+        _warm_position_cache(known_vids)
+
+    def one(dep: str) -> Tuple[Optional[Dict], Optional[_Pending]]:
         try:
-            results.append(get_position_and_check(dep, token=token, token_path=token_path))
-        except requests.HTTPError as e:
-            results.append({
-                "ok": False,
-                "depot_number": str(dep),
-                "error": "http_error",
-                "status": getattr(e.response, "status_code", None),
-                "detail": (getattr(e.response, "text", "") or "")[:400],
-            })
+            return _fetch_position(dep, token=token, token_path=token_path, timeout=timeout, stale_ok=stale_ok)
         except Exception as e:
-            results.append({
-                "ok": False,
-                "depot_number": str(dep),
-                "error": "exception",
-                "detail": str(e),
-            })
+            return _batch_error(dep, e), None
+
+    try:
+        if workers <= 1 or len(depot_numbers) <= 1:
+            fetched = [one(dep) for dep in depot_numbers]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(workers, len(depot_numbers)),
+                thread_name_prefix="ump-batch",
+            ) as pool:
+                fetched = list(pool.map(one, depot_numbers))
+    finally:
+        get_vehicle_index().flush()
+
+    # геофенсинг всех полученных точек одним пакетом
+    pending = [(i, p) for i, (_, p) in enumerate(fetched) if p is not None]
+    results = [res for res, _ in fetched]
+    if pending:
+        registry = get_park_registry()
+        names = classify_points(
+            [pos["lon"] for _, (_, pos) in pending],
+            [pos["lat"] for _, (_, pos) in pending],
+            registry.geometries(),
+            grid=registry.grid(),
+        )
+        for (i, (vid, pos)), park_name in zip(pending, names):
+            results[i] = _finalize_position(depot_numbers[i], vid, pos, park_name)
     return results
 
 if __name__ == "__main__":
@@ -487,7 +838,7 @@ if __name__ == "__main__":
         depot = args[0]
     try:
         out = get_position_and_check(depot)
-        print(json.dumps(out, ensure_ascii=False, indent=2))
+        print(json.dumps(out.to_dict(), ensure_ascii=False, indent=2))
     except requests.HTTPError as e:
         print("HTTP error:", e.response.status_code, e.response.text[:400])
     except Exception as e:
@@ -501,5 +852,5 @@ if __name__ == "__main__":
     if invalids:
         out.extend(invalids)
     if batch:
-        out.extend(batch)
+        out.extend(r.to_dict() for r in batch)
     print(json.dumps(out, ensure_ascii=False, indent=2))
@@ -0,0 +1,70 @@
+# park_grid.py
+"""
+Пространственный индекс парков: равномерная сетка по lon/lat.
+Каждый парк заносится во все ячейки, которые пересекает его bbox, расширенный
+на max(tolerance_m, margin_m) — с тем же запасом, что и в ParkGeometry.near_bbox.
+Поэтому для точки достаточно проверить парки из её ячейки: остальные
+заведомо не проходят префильтр near_bbox ни при проверке полигона, ни при
+анти-флапе с grace_m <= margin_m.
+"""
+import math
+from typing import Dict, List, Sequence, Tuple
+
+# ~1.1 км по широте; у депо bbox — сотни метров, так что парк занимает 1-4 ячейки
+DEFAULT_CELL_DEG = 0.01
+# защита от гигантских полигонов: больше ячеек на парк не заводим
+_MAX_CELLS_PER_PARK = 10_000
+
+
+class ParkGrid:
+    def __init__(self, geometries: Sequence, margin_m: float = 0.0, cell_deg: float = DEFAULT_CELL_DEG):
+        self.geometries = list(geometries)
+        self.margin_m = float(margin_m)
+        self.cell_deg = float(cell_deg)
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        # парки, которые не поместились в лимит ячеек, проверяются всегда
+        self._always: List[int] = []
+        for i, g in enumerate(self.geometries):
+            self._insert(i, g)
+
+    def _cell(self, lon: float, lat: float) -> Tuple[int, int]:
+        return math.floor(lon / self.cell_deg), math.floor(lat / self.cell_deg)
+
+    def _insert(self, i: int, g) -> None:
+        margin = max(g.tolerance_m, self.margin_m)
+        eps_lat = 1.5 * margin / g.lat_m
+        eps_lon = 1.5 * margin / max(g.lon_m, 1e-9)
+        minx, miny, maxx, maxy = g.bbox
+        cx0, cy0 = self._cell(minx - eps_lon, miny - eps_lat)
+        cx1, cy1 = self._cell(maxx + eps_lon, maxy + eps_lat)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > _MAX_CELLS_PER_PARK:
+            self._always.append(i)
+            return
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self._cells.setdefault((cx, cy), []).append(i)
+
+    def candidate_ids(self, lon: float, lat: float) -> List[int]:
+        ids = self._cells.get(self._cell(lon, lat), [])
+        if self._always:
+            ids = sorted(set(ids) | set(self._always))
+        return ids
+
+    def candidates(self, lon: float, lat: float) -> List:
+        """Парки рядом с точкой — в исходном порядке (важно: побеждает первый подходящий)."""
+        return [self.geometries[i] for i in self.candidate_ids(lon, lat)]
+
+    def candidates_for_points(self, lons: Sequence[float], lats: Sequence[float]) -> Dict[int, List[int]]:
+        """{индекс парка: [индексы точек рядом с ним]} для пакетной проверки."""
+        out: Dict[int, List[int]] = {}
+        for j, (lon, lat) in enumerate(zip(lons, lats)):
+            for i in self.candidate_ids(lon, lat):
+                out.setdefault(i, []).append(j)
+        return out
+
+    def covers(self, grace_m: float) -> bool:
+        """Можно ли отбирать кандидатов по сетке для анти-флапа с таким grace_m."""
+        return grace_m <= self.margin_m
+
+    def __len__(self) -> int:
+        return len(self.geometries)
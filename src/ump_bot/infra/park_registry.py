@@ -0,0 +1,154 @@
+# park_registry.py
+"""
+Реестр парков: parks.json читается один раз на процесс и перечитывается только
+при изменении файла (mtime). Для каждого парка заранее считается геометрия
+(bbox, рёбра полигона, метров в градусе) — её используют геофенсинг и рендер —
+и строится сетка ParkGrid для быстрого поиска парков рядом с точкой.
+"""
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from ..config import ANTI_FLAP_GRACE_M, PARKS_FILE
+from ..domain.park import Park
+from .park_grid import ParkGrid
+
+# как часто (сек) проверять mtime файла парков
+_RELOAD_CHECK_INTERVAL_SEC = 2.0
+
+
+def load_parks(path=PARKS_FILE) -> List[Park]:
+    with open(path, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    parks = cfg.get("parks") or []
+    out = []
+    for p in parks:
+        poly = p.get("polygon") or []
+        if len(poly) >= 2 and poly[0] == poly[-1]:
+            poly = poly[:-1]
+        out.append({
+            "name": p.get("name","park"),
+            "polygon": [(float(x), float(y)) for x, y in poly],  # (lon, lat)
+            "tolerance_m": float(p.get("tolerance_m", 0.0)),
+            "address_default": p.get("address_default"),
+            "addresses": p.get("addresses")
+        })
+    return out
+
+
+@dataclass(frozen=True)
+class ParkGeometry:
+    name: str
+    polygon: Tuple[Tuple[float, float], ...]  # (lon, lat)
+    tolerance_m: float
+    bbox: Tuple[float, float, float, float]  # (minlon, minlat, maxlon, maxlat)
+    # рёбра (x1, y1, dx, dy) — для расстояний до границы без повторных вычислений
+    edges: Tuple[Tuple[float, float, float, float], ...]
+    # метров в градусе; lon_m — минимальный по широтам bbox (консервативно для префильтра)
+    lat_m: float
+    lon_m: float
+
+    def near_bbox(self, lon: float, lat: float, margin_m: float = 0.0) -> bool:
+        """Точка в bbox, расширенном на margin_m (с запасом) — быстрый префильтр."""
+        eps_lat = 1.5 * margin_m / self.lat_m
+        eps_lon = 1.5 * margin_m / max(self.lon_m, 1e-9)
+        minx, miny, maxx, maxy = self.bbox
+        return (minx - eps_lon <= lon <= maxx + eps_lon) and (miny - eps_lat <= lat <= maxy + eps_lat)
+
+
+def build_geometry(park: Park) -> ParkGeometry:
+    poly = tuple((float(x), float(y)) for x, y in park.get("polygon") or [])
+    if poly:
+        xs = [p[0] for p in poly]
+        ys = [p[1] for p in poly]
+        bbox = (min(xs), min(ys), max(xs), max(ys))
+    else:
+        bbox = (0.0, 0.0, 0.0, 0.0)
+    edges = []
+    n = len(poly)
+    for i in range(n):
+        x1, y1 = poly[i]
+        x2, y2 = poly[(i + 1) % n]
+        edges.append((x1, y1, x2 - x1, y2 - y1))
+    far_lat = max(abs(bbox[1]), abs(bbox[3]))
+    return ParkGeometry(
+        name=park.get("name", "park"),
+        polygon=poly,
+        tolerance_m=float(park.get("tolerance_m", 0.0)),
+        bbox=bbox,
+        edges=tuple(edges),
+        lat_m=111_132.0,
+        lon_m=111_320.0 * math.cos(math.radians(min(far_lat, 89.9))),
+    )
+
+
+class ParkRegistry:
+    def __init__(self, path: str = PARKS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._parks: List[Park] = []
+        self._by_name: Dict[str, Park] = {}
+        self._geometries: List[ParkGeometry] = []
+        self._grid = ParkGrid([])
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if self._mtime is not None and (now - self._checked_at) < _RELOAD_CHECK_INTERVAL_SEC:
+            return
+        with self._lock:
+            if self._mtime is not None and (now - self._checked_at) < _RELOAD_CHECK_INTERVAL_SEC:
+                return
+            st = os.stat(self.path)
+            key = (st.st_mtime_ns, st.st_size)
+            self._checked_at = now
+            if key == self._mtime:
+                return
+            parks = load_parks(self.path)
+            self._by_name = {p["name"]: p for p in parks}
+            geometries = [build_geometry(p) for p in parks]
+            self._grid = ParkGrid(geometries, margin_m=ANTI_FLAP_GRACE_M)
+            self._geometries = geometries
+            self._parks = parks
+            self._mtime = key
+
+    def parks(self) -> List[Park]:
+        """Список парков (общий для всех вызывающих — не изменять)."""
+        self._maybe_reload()
+        return self._parks
+
+    def geometries(self) -> List[ParkGeometry]:
+        self._maybe_reload()
+        return self._geometries
+
+    def grid(self) -> ParkGrid:
+        """Сетка по geometries() — передаётся в classify_point(s) вместе с ними."""
+        self._maybe_reload()
+        return self._grid
+
+    def get(self, name: str) -> Optional[Park]:
+        self._maybe_reload()
+        return self._by_name.get(name)
+
+
+_REGISTRY: Optional[ParkRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_park_registry() -> ParkRegistry:
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                _REGISTRY = ParkRegistry()
+    return _REGISTRY
+
+
+def get_parks() -> List[Park]:
+    """Парки из PARKS_FILE через процессный реестр."""
+    return get_park_registry().parks()
@@ -0,0 +1,108 @@
+# position_cache.py
+"""
+In-process LRU-кэш последних позиций ТС (vehicle_id -> запись).
+
+Свежие записи (моложе TTL) отдаются без обращения к UMP и к диску. Диск —
+только слой персистентности: изменённые записи сбрасываются пачкой фоновым
+потоком (write-behind) через переданную функцию persist.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+class PositionCache:
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_sec: float,
+        persist: Optional[Callable[[List[Dict]], None]] = None,
+        flush_interval_sec: float = 5.0,
+    ):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_sec = ttl_sec
+        self._persist = persist
+        self._flush_interval = flush_interval_sec
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[int, Dict]" = OrderedDict()
+        self._dirty: Dict[int, Dict] = {}
+        self._writer: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, vehicle_id: int, max_age: Optional[float] = None) -> Optional[Dict]:
+        """Запись не старше max_age (по умолчанию TTL) или None."""
+        limit = self.ttl_sec if max_age is None else max_age
+        vid = int(vehicle_id)
+        with self._lock:
+            entry = self._items.get(vid)
+            if entry is None or (time.time() - entry.get("ts", 0)) > limit:
+                self.misses += 1
+                return None
+            self._items.move_to_end(vid)
+            self.hits += 1
+            return entry
+
+    def age(self, vehicle_id: int) -> Optional[float]:
+        """Возраст записи в секундах (None — нет в памяти); счётчики hits/misses не трогает."""
+        with self._lock:
+            entry = self._items.get(int(vehicle_id))
+            return None if entry is None else time.time() - entry.get("ts", 0)
+
+    def put(self, vehicle_id: int, entry: Dict, persist: bool = True) -> None:
+        vid = int(vehicle_id)
+        with self._lock:
+            self._items[vid] = entry
+            self._items.move_to_end(vid)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+            if persist and self._persist is not None:
+                self._dirty[vid] = entry
+        if persist and self._persist is not None:
+            self._ensure_writer()
+
+    def flush(self) -> None:
+        """Синхронно сбрасывает накопленные изменения в persist."""
+        with self._lock:
+            if not self._dirty:
+                return
+            batch = list(self._dirty.values())
+            self._dirty.clear()
+        try:
+            self._persist(batch)
+        except Exception:
+            pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._dirty.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pending_writes": len(self._dirty),
+            }
+
+    def _ensure_writer(self) -> None:
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is not None:
+                return
+            self._writer = threading.Thread(target=self._writer_loop, name="position-cache-writer", daemon=True)
+            self._writer.start()
+
+    def _writer_loop(self) -> None:
+        while True:
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            self.flush()
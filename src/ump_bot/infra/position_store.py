@@ -0,0 +1,132 @@
+# position_store.py
+"""
+Персистентное хранилище последних позиций ТС: один файл SQLite (WAL) вместо
+online_<vehicle_id>.json на каждое ТС. Запись — пачкой (upsert), чтение —
+одним запросом на весь список ТС, устаревшие строки удаляются по TTL.
+"""
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    vehicle_id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    lat REAL,
+    lon REAL,
+    in_park INTEGER,
+    park_name TEXT,
+    time TEXT
+);
+CREATE INDEX IF NOT EXISTS positions_ts ON positions(ts);
+"""
+_COLUMNS = ("vehicle_id", "ts", "lat", "lon", "in_park", "park_name", "time")
+# SQLite ограничивает число параметров в запросе
+_CHUNK = 500
+
+
+def _row_to_entry(row) -> Dict:
+    entry = dict(zip(_COLUMNS, row))
+    entry["in_park"] = bool(entry["in_park"])
+    try:
+        entry["time"] = json.loads(entry["time"]) if entry["time"] is not None else None
+    except Exception:
+        pass
+    return entry
+
+
+class PositionStore:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def upsert_many(self, entries: Iterable[Dict]) -> int:
+        rows = [
+            (
+                int(e["vehicle_id"]),
+                float(e.get("ts") or time.time()),
+                e.get("lat"),
+                e.get("lon"),
+                int(bool(e.get("in_park"))),
+                e.get("park_name"),
+                json.dumps(e.get("time"), ensure_ascii=False),
+            )
+            for e in entries
+        ]
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO positions (vehicle_id, ts, lat, lon, in_park, park_name, time) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(vehicle_id) DO UPDATE SET ts=excluded.ts, lat=excluded.lat, "
+                    "lon=excluded.lon, in_park=excluded.in_park, park_name=excluded.park_name, "
+                    "time=excluded.time WHERE excluded.ts >= positions.ts",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def get_many(self, vehicle_ids: Iterable[int], max_age: Optional[float] = None) -> Dict[int, Dict]:
+        """Записи для списка ТС (не старше max_age) одним запросом на каждые _CHUNK id."""
+        ids: List[int] = sorted({int(v) for v in vehicle_ids})
+        min_ts = (time.time() - max_age) if max_age is not None else float("-inf")
+        out: Dict[int, Dict] = {}
+        with self._lock:
+            for i in range(0, len(ids), _CHUNK):
+                chunk = ids[i:i + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                cur = self._conn.execute(
+                    f"SELECT {', '.join(_COLUMNS)} FROM positions WHERE vehicle_id IN ({marks}) AND ts >= ?",
+                    (*chunk, min_ts),
+                )
+                for row in cur.fetchall():
+                    out[int(row[0])] = _row_to_entry(row)
+        return out
+
+    def get(self, vehicle_id: int, max_age: Optional[float] = None) -> Optional[Dict]:
+        return self.get_many([vehicle_id], max_age=max_age).get(int(vehicle_id))
+
+    def vacuum(self, max_age: float) -> int:
+        """Удаляет записи старше max_age секунд, возвращает их число."""
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM positions WHERE ts < ?", (time.time() - max_age,))
+            return cur.rowcount or 0
+
+    def import_legacy_files(self, cache_dir: str) -> int:
+        """Переносит старые online_<id>.json в базу и удаляет их."""
+        files = glob.glob(os.path.join(cache_dir, "online_*.json"))
+        entries = []
+        for path in files:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict) and data.get("vehicle_id") is not None:
+                    entries.append(data)
+            except Exception:
+                pass
+        self.upsert_many(entries)
+        for path in files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(entries)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,10 +1,14 @@
 # render_map.py
-import os, re, json, math, io, time
-from typing import List, Tuple, Dict, Optional
-import requests
+import asyncio
+import os, re, json, math
+from typing import AsyncIterator, List, Tuple, Dict, Optional
 from dotenv import load_dotenv
 from PIL import Image, ImageDraw, ImageFont
 
+from ..config import MAP_AUTO_ZOOM
+from .base_layers import base_layer_key, get_base_layer_cache
+from .tiles import fetch_tiles, provider_cache_id
+
 
 def _normalize_token(tok: str) -> str:
     return tok.strip()
@@ -143,77 +147,347 @@ def _tile_canvas_is_too_big(
         return True
     return False
 
-def _fetch_tile(session: requests.Session, provider: str, z: int, x: int, y: int, cache_dir: str) -> Image.Image:
-    _ensure_dir(cache_dir)
-    local = os.path.join(cache_dir, f"{provider.replace('://','_').replace('/','_')}_{z}_{x}_{y}.png")
-    if os.path.exists(local):
-        try:
-            # Важно: Image.open держит файловый дескриптор до закрытия объекта.
-            # При частом рендере это может накопить FD/память, поэтому делаем copy().
-            with Image.open(local) as im:
-                return im.convert("RGBA").copy()
-        except Exception:
-            pass
-    url = provider.replace("{z}", str(z)).replace("{x}", str(x)).replace("{y}", str(y))
-    resp = session.get(url, timeout=15)
-    resp.raise_for_status()
-    img = Image.open(io.BytesIO(resp.content)).convert("RGBA")
-    try:
-        img.save(local)
-    except Exception:
-        pass
-    return img
-
-def _stitch_tiles(bbox: Tuple[float,float,float,float], zoom: int, provider: str, cache_dir: str, headers: Dict[str,str], tiles_per_sec: float, debug: bool=False) -> Tuple[Image.Image, Tuple[int,int,int,int]]:
+def _stitch_tiles(bbox: Tuple[float,float,float,float], zoom: int, provider: str, cache_dir: str, headers: Dict[str,str], tiles_per_sec: float, debug: bool=False, cache_id: Optional[str]=None) -> Tuple[Image.Image, Tuple[int,int,int,int], int]:
+    """Склейка тайлов bbox; возвращает (картинка, диапазон тайлов, число незагруженных тайлов)."""
     minx, miny, maxx, maxy = _tile_xy_ranges(bbox, zoom)
     w = (maxx - minx + 1) * 256
     h = (maxy - miny + 1) * 256
     base = Image.new("RGBA", (w, h), (255, 255, 255, 255))
-    sess = requests.Session()
-    if headers:
-        sess.headers.update(headers)
-    last_ts = 0.0
-    min_interval = 1.0 / max(tiles_per_sec, 0.1)
+    coords = [(tx, ty) for tx in range(minx, maxx + 1) for ty in range(miny, maxy + 1)]
+    tiles = fetch_tiles(provider, zoom, coords, cache_dir, headers, tiles_per_sec, debug, cache_id)
     fetched = 0
-    for tx in range(minx, maxx + 1):
-        for ty in range(miny, maxy + 1):
-            try:
-                # мягкий rate limit
-                now = time.monotonic()
-                sleep_for = last_ts + min_interval - now
-                if sleep_for > 0:
-                    time.sleep(sleep_for)
-                tile = _fetch_tile(sess, provider, zoom, tx, ty, cache_dir)
-                pos = ((tx - minx) * 256, (ty - miny) * 256)
-                if tile.mode == "RGBA":
-                    base.paste(tile, pos, tile)
-                else:
-                    base.paste(tile.convert("RGBA"), pos)
-                last_ts = time.monotonic()
-                fetched += 1
-            except Exception:
-                # оставим серую заглушку
-                if debug:
-                    try:
-                        url_dbg = provider.replace("{z}", str(zoom)).replace("{x}", str(tx)).replace("{y}", str(ty))
-                        print("tile_fetch_failed:", url_dbg)
-                    except Exception:
-                        pass
+    for (tx, ty), tile in tiles.items():
+        if tile is None:
+            # оставим фон-заглушку
+            continue
+        pos = ((tx - minx) * 256, (ty - miny) * 256)
+        if tile.mode == "RGBA":
+            base.paste(tile, pos, tile)
+        else:
+            base.paste(tile.convert("RGBA"), pos)
+        fetched += 1
     if debug:
         print(f"tiles_fetched={fetched}, grid_size={(maxx-minx+1)}x{(maxy-miny+1)}")
-    return base.convert("RGB"), (minx, miny, maxx, maxy)
+    return base.convert("RGB"), (minx, miny, maxx, maxy), len(coords) - fetched
+
+
+def _fit_zoom(bbox: Tuple[float, float, float, float], width: int, height: int, pad: int, max_zoom: int) -> int:
+    """Наибольший zoom (не выше max_zoom), при котором bbox с отступами pad помещается в width×height."""
+    minlon, minlat, maxlon, maxlat = bbox
+    avail_w, avail_h = max(1, width - 2 * pad), max(1, height - 2 * pad)
+    for z in range(max_zoom, -1, -1):
+        x1, y1 = _lonlat_to_mercator_xy(minlon, maxlat, z)
+        x2, y2 = _lonlat_to_mercator_xy(maxlon, minlat, z)
+        if abs(x2 - x1) <= avail_w and abs(y2 - y1) <= avail_h:
+            return z
+    return 0
+
+
+def _centered_window(bbox: Tuple[float, float, float, float], zoom: int, width: int, height: int) -> Tuple[int, int, int, int]:
+    """Пиксельное окно (left, top, width, height) уровня zoom с центром в центре bbox."""
+    minlon, minlat, maxlon, maxlat = bbox
+    x1, y1 = _lonlat_to_mercator_xy(minlon, maxlat, zoom)
+    x2, y2 = _lonlat_to_mercator_xy(maxlon, minlat, zoom)
+    left = int(round((x1 + x2) / 2.0 - width / 2.0))
+    top = int(round((y1 + y2) / 2.0 - height / 2.0))
+    return left, top, width, height
 
-def _project_on_tileimg(lon: float, lat: float, zoom: int, tile_range: Tuple[int,int,int,int]) -> Tuple[int,int]:
-    px, py = _lonlat_to_mercator_xy(lon, lat, zoom)
-    minx, miny, _, _ = tile_range
-    return int(px - minx * 256), int(py - miny * 256)
 
+def _stitch_window(window: Tuple[int, int, int, int], zoom: int, provider: str, cache_dir: str, headers: Dict[str,str], tiles_per_sec: float, debug: bool=False, cache_id: Optional[str]=None) -> Tuple[Image.Image, int]:
+    """
+    Склейка только пиксельного окна уровня zoom: тайлы вклеиваются сразу в холст
+    итогового размера, без промежуточного холста и resize.
+    Возвращает (картинка, число незагруженных тайлов).
+    """
+    left, top, width, height = window
+    n = 2 ** zoom
+    miny = max(0, top // 256)
+    maxy = min(n - 1, (top + height - 1) // 256)
+    placements = [
+        (tx, ty)
+        for tx in range(left // 256, (left + width - 1) // 256 + 1)
+        for ty in range(miny, maxy + 1)
+    ]
+    # по x карта замкнута: тайл за антимеридианом — это tx mod 2^zoom
+    coords = list(dict.fromkeys((tx % n, ty) for tx, ty in placements))
+    tiles = fetch_tiles(provider, zoom, coords, cache_dir, headers, tiles_per_sec, debug, cache_id)
+    img = Image.new("RGB", (width, height), (255, 255, 255))
+    fetched = 0
+    for tx, ty in placements:
+        tile = tiles.get((tx % n, ty))
+        if tile is None:
+            # оставим фон-заглушку
+            continue
+        img.paste(tile, (tx * 256 - left, ty * 256 - top), tile if tile.mode == "RGBA" else None)
+        fetched += 1
+    if debug:
+        print(f"tiles_fetched={fetched}/{len(placements)}, zoom={zoom}, window={width}x{height}")
+    return img, len(placements) - fetched
 
 def _ensure_dir(path: str):
     if path and not os.path.exists(path):
         os.makedirs(path, exist_ok=True)
 
 
+def _tile_request_params(
+    tile_provider: str,
+    tile_user_agent: str,
+    tile_referer: str,
+    tile_apikey: str,
+) -> Tuple[str, Dict[str, str]]:
+    """URL провайдера (с ключом) и заголовки тайлов; ключ/UA/Referer по умолчанию — из окружения."""
+    provider_url = tile_provider
+    env_key = os.getenv("MAPTILER_API_KEY", "")
+    env_ua = os.getenv("MAP_USER_AGENT", "")
+    env_ref = os.getenv("MAP_REFERER", "")
+    if not tile_apikey:
+        tile_apikey = env_key
+    if not tile_user_agent and env_ua:
+        tile_user_agent = env_ua
+    if not tile_referer and env_ref:
+        tile_referer = env_ref
+    if "{apikey}" in provider_url:
+        provider_url = provider_url.replace("{apikey}", tile_apikey)
+    headers = {}
+    if tile_user_agent:
+        headers["User-Agent"] = tile_user_agent
+    if tile_referer:
+        headers["Referer"] = tile_referer
+    return provider_url, headers
+
+
+def _tile_guard_limits() -> Tuple[int, int, int]:
+    try:
+        max_tiles = int(os.getenv("MAP_MAX_TILES", "225"))
+    except Exception:
+        max_tiles = 225
+    try:
+        max_side_px = int(os.getenv("MAP_MAX_TILE_CANVAS_SIDE_PX", "4096"))
+    except Exception:
+        max_side_px = 4096
+    try:
+        max_pixels = int(os.getenv("MAP_MAX_TILE_CANVAS_PIXELS", str(4096 * 4096)))
+    except Exception:
+        max_pixels = 4096 * 4096
+    return max_tiles, max_side_px, max_pixels
+
+
+def _load_font(font_path: str) -> Optional[ImageFont.ImageFont]:
+    if font_path:
+        try:
+            return ImageFont.truetype(font_path, size=16)
+        except Exception:
+            return None
+    return None
+
+
+def _tile_projector(meta: Dict):
+    """
+    project(lon, lat) -> (x, y) на подложке из тайлов по её параметрам:
+    zoom и левый верхний угол — "origin" (пиксели уровня zoom, окно авто-zoom)
+    или "tile_range" (склейка тайлов), плюс масштаб до итогового размера.
+    """
+    zoom = int(meta["zoom"])
+    if "origin" in meta:
+        ox, oy = meta["origin"]
+    else:
+        ox, oy = meta["tile_range"][0] * 256, meta["tile_range"][1] * 256
+    scale_x, scale_y = meta.get("scale", (1.0, 1.0))
+
+    def project(lon: float, lat: float) -> Tuple[int, int]:
+        px, py = _lonlat_to_mercator_xy(lon, lat, zoom)
+        # масштаб до итогового размера
+        return int((px - ox) * scale_x), int((py - oy) * scale_y)
+
+    return project
+
+
+def prepare_park_canvas(
+    park: Dict,
+    size: str = "1200x800",
+    use_real_map: bool = True,
+    zoom: int = 17,
+    tile_provider: str = "https://tile.openstreetmap.org/{z}/{x}/{y}.png",
+    tile_cache: str = ".tile_cache",
+    tile_user_agent: str = "UMPBot/1.0 (+contact: set UA via --ua)",
+    tile_referer: str = "",
+    tile_apikey: str = "",
+    tile_rate_tps: float = 5.0,
+    background: str = "#ffffff",
+    fill_color: str = "#f1f3f5",
+    outline_color: str = "#495057",
+    text_color: str = "#212529",
+    font_path: str = "",
+    debug: bool = False,
+    auto_zoom: Optional[bool] = None,
+) -> Dict:
+    """
+    Подложка карты парка без ТС: тайлы (или однотонный фон), контур парка, заголовок.
+    Не зависит от позиций ТС — её можно готовить, пока позиции ещё запрашиваются.
+    Подложка из тайлов берётся из кэша (base_layers); возвращается её копия.
+    auto_zoom (по умолчанию MAP_AUTO_ZOOM): zoom подбирается так, чтобы парк поместился
+    в size (zoom — верхняя граница), и из тайлов вырезается только нужное окно.
+    Возвращает {"park_name", "img", "draw", "project"}; project(lon, lat) -> (x, y) на img.
+    """
+    park_name = park["name"]
+    polygon = park["polygon"]  # list[(lon,lat)]
+    bbox = _lonlat_bbox(polygon)
+    width, height = _parse_size(size)
+    pad = max(int(min(width, height) * 0.05), 30)
+    font = _load_font(font_path)
+    if auto_zoom is None:
+        auto_zoom = MAP_AUTO_ZOOM
+
+    # фон: либо реальные тайлы, либо однотонный
+    use_real_map_for_park = False
+    if use_real_map and auto_zoom:
+        # окно авто-zoom не больше итогового размера — защита от большого холста не нужна
+        use_real_map_for_park = True
+    elif use_real_map:
+        # Safety: защита от слишком большого холста тайлов (OOM/FD storm).
+        max_tiles, max_side_px, max_pixels = _tile_guard_limits()
+        if _tile_canvas_is_too_big(
+            bbox,
+            zoom,
+            max_tiles=max_tiles,
+            max_side_px=max_side_px,
+            max_pixels=max_pixels,
+        ):
+            if debug:
+                tiles_x, tiles_y, cw, ch = _tile_grid_metrics(bbox, zoom)
+                print(
+                    f"tile_canvas_guard: fallback_to_simple_bg park={park_name}, "
+                    f"zoom={zoom}, tiles={tiles_x}x{tiles_y}, canvas={cw}x{ch}"
+                )
+        else:
+            use_real_map_for_park = True
+
+    if use_real_map_for_park:
+        # Подложка из тайлов не зависит от ТС: берём готовую из кэша, ТС рисуются поверх копии.
+        cache = get_base_layer_cache()
+        provider_id = provider_cache_id(tile_provider)
+        key = base_layer_key(
+            park=park_name, polygon=polygon, zoom=zoom, size=[width, height],
+            provider=provider_id, auto_zoom=bool(auto_zoom),
+            style=[outline_color, text_color, font_path],
+        )
+        layer = cache.get(key)
+        if layer is None:
+            provider_url, headers = _tile_request_params(tile_provider, tile_user_agent, tile_referer, tile_apikey)
+            if auto_zoom:
+                fit_zoom = _fit_zoom(bbox, width, height, pad, zoom)
+                window = _centered_window(bbox, fit_zoom, width, height)
+                img, missing = _stitch_window(
+                    window, fit_zoom, provider_url, tile_cache, headers, tile_rate_tps, debug, cache_id=provider_id
+                )
+                meta = {"zoom": fit_zoom, "origin": [window[0], window[1]]}
+            else:
+                tile_img, tile_range, missing = _stitch_tiles(
+                    bbox, zoom, provider_url, tile_cache, headers, tile_rate_tps, debug, cache_id=provider_id
+                )
+                if debug and tile_img.getbbox() is None:
+                    print("tile_canvas_empty: fallback to simple background")
+                img = tile_img.resize((width, height), Image.LANCZOS)
+                meta = {
+                    "zoom": zoom,
+                    "tile_range": list(tile_range),
+                    "scale": [width / float(tile_img.width), height / float(tile_img.height)],
+                }
+            project = _tile_projector(meta)
+            draw = ImageDraw.Draw(img)
+            # обведем полигон легкой линией сверху карты для ориентира
+            poly_xy = [project(x, y) for (x, y) in polygon]
+            if len(poly_xy) >= 3:
+                draw.line(poly_xy + [poly_xy[0]], fill=outline_color, width=2)
+            _draw_label_box(draw, (10, 10), f"Парк: {park_name}", text_color, font)
+            # неполную подложку (часть тайлов не скачалась) не кэшируем — в следующий раз догрузим
+            if not missing:
+                cache.put(key, img, meta)
+        else:
+            img, meta = layer
+            project = _tile_projector(meta)
+            draw = ImageDraw.Draw(img)
+            if debug:
+                print(f"base_layer_cache_hit: park={park_name}")
+        return {"park_name": park_name, "img": img, "draw": draw, "project": project}
+
+    img = Image.new("RGB", (width, height), background)
+    draw = ImageDraw.Draw(img)
+
+    def project(lon: float, lat: float) -> Tuple[int, int]:
+        return _project(lon, lat, bbox, (width, height), pad)
+
+    poly_xy = [project(x, y) for (x, y) in polygon]
+    if len(poly_xy) >= 3:
+        draw.polygon(poly_xy, fill=fill_color, outline=outline_color)
+
+    # заголовок с полупрозрачным фоном
+    title_text = f"Парк: {park_name}"
+    _draw_label_box(draw, (10, 10), title_text, text_color, font)
+    return {"park_name": park_name, "img": img, "draw": draw, "project": project}
+
+
+def draw_park_vehicles(
+    canvas: Dict,
+    vehicles: List[Dict],
+    out_dir: str = "out",
+    vehicle_fill: str = "#fa5252",
+    vehicle_outline: str = "#c92a2a",
+    text_color: str = "#212529",
+    point_radius: int = 6,
+    font_path: str = "",
+    debug: bool = False,
+    color_map: Optional[Dict[str, Tuple[str, str]]] = None,
+) -> str:
+    """Наносит ТС на подложку из prepare_park_canvas и сохраняет PNG; возвращает путь."""
+    draw = canvas["draw"]
+    project = canvas["project"]
+    font = _load_font(font_path)
+    for v in vehicles:
+        lon = v.get("lon")
+        lat = v.get("lat")
+        dep = str(v.get("depot_number"))
+        if lon is None or lat is None:
+            continue
+        cx, cy = project(lon, lat)
+        r = point_radius
+        # Определяем цвет точки на основе color_map
+        fill_col = vehicle_fill
+        outline_col = vehicle_outline
+        if color_map and dep in color_map:
+            fill_col, outline_col = color_map[dep]
+            if debug:
+                print(f"[DEBUG] ТС {dep}: цвет {fill_col} (из color_map)")
+        elif debug and color_map:
+            print(f"[DEBUG] ТС {dep}: цвет по умолчанию {fill_col} (нет в color_map, ключи: {list(color_map.keys())[:5]})")
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=fill_col, outline=outline_col)
+        # подпись с фоновой коробкой
+        tx, ty = cx + r + 6, cy - r - 14
+        _draw_label_box(draw, (tx, ty), dep, text_color, font)
+
+    _ensure_dir(out_dir)
+    safe_name = re.sub(r"[^0-9A-Za-zА-Яа-я_\-]+", "_", canvas["park_name"])
+    out_path = os.path.join(out_dir, f"park_{safe_name}.png")
+    canvas["img"].save(out_path)
+    return out_path
+
+
+# параметры prepare_park_canvas / draw_park_vehicles — для раздачи общих kwargs рендера
+_CANVAS_ARGS = (
+    "size", "use_real_map", "zoom", "tile_provider", "tile_cache", "tile_user_agent",
+    "tile_referer", "tile_apikey", "tile_rate_tps", "background", "fill_color",
+    "outline_color", "text_color", "font_path", "debug", "auto_zoom",
+)
+_DRAW_ARGS = (
+    "out_dir", "vehicle_fill", "vehicle_outline", "text_color", "point_radius",
+    "font_path", "debug", "color_map",
+)
+
+
+def _pick(kwargs: Dict, names: Tuple[str, ...]) -> Dict:
+    return {k: kwargs[k] for k in names if k in kwargs}
+
+
 def render_parks_with_vehicles(
     depot_numbers: List[str],
     out_dir: str = "out",
@@ -239,10 +513,17 @@ def render_parks_with_vehicles(
     color_map: Optional[Dict[str, Tuple[str, str]]] = None,
     auth_token: Optional[str] = None,
     auth_token_path: Optional[str] = None,
+    results: Optional[List[Dict]] = None,
+    auto_zoom: Optional[bool] = None,
 ) -> List[str]:
+    """
+    Рендер PNG по паркам. results — уже полученные позиции (batch_get_positions);
+    если не переданы, позиции depot_numbers запрашиваются здесь.
+    """
     # Ленивая зависимость: не тянем весь конфиг/pydantic при импорте модуля,
     # чтобы вспомогательные функции (tile guard) были тестируемы/используемы отдельно.
-    from .otbivka import load_parks, batch_get_positions
+    from .otbivka import batch_get_positions
+    from .park_registry import get_park_registry
 
     # Отладка color_map
     if debug:
@@ -258,18 +539,17 @@ def render_parks_with_vehicles(
         load_dotenv()
     except Exception:
         pass
-    parks = load_parks()
-    # ключ: park_name -> park dict
-    park_by_name: Dict[str, Dict] = {p["name"]: p for p in parks}
-
-    results = batch_get_positions(
-        depot_numbers,
-        token=auth_token,
-        token_path=auth_token_path,
-    )
+    parks_registry = get_park_registry()
+
+    if results is None:
+        results = batch_get_positions(
+            depot_numbers,
+            token=auth_token,
+            token_path=auth_token_path,
+        )
     if debug:
         try:
-            print(json.dumps({"debug_results": results}, ensure_ascii=False)[:800])
+            print(json.dumps({"debug_results": [dict(r) for r in results]}, ensure_ascii=False)[:800])
         except Exception:
             pass
     # сгруппировать ТС, которые в парке
@@ -286,157 +566,94 @@ def render_parks_with_vehicles(
     out_files: List[str] = []
     _ensure_dir(out_dir)
 
-    # загрузим шрифт, если указан; иначе fallback на default
-    font = None
-    if font_path:
-        try:
-            font = ImageFont.truetype(font_path, size=16)
-        except Exception:
-            font = None
-
-    width, height = _parse_size(size)
-    pad = max(int(min(width, height) * 0.05), 30)
-
     if debug:
         print("parks_found:", list(in_park_by_name.keys()))
 
+    opts = dict(
+        out_dir=out_dir, size=size, use_real_map=use_real_map, zoom=zoom,
+        tile_provider=tile_provider, tile_cache=tile_cache, tile_user_agent=tile_user_agent,
+        tile_referer=tile_referer, tile_apikey=tile_apikey, tile_rate_tps=tile_rate_tps,
+        background=background, fill_color=fill_color, outline_color=outline_color,
+        vehicle_fill=vehicle_fill, vehicle_outline=vehicle_outline, text_color=text_color,
+        point_radius=point_radius, font_path=font_path, debug=debug, color_map=color_map,
+        auto_zoom=auto_zoom,
+    )
     for park_name, vehicles in in_park_by_name.items():
         # фильтр по имени парка, если указан
         if park_filter and park_name != park_filter:
             if debug:
                 print(f"skipping_park (filter={park_filter}):", park_name)
             continue
-        park = park_by_name.get(park_name)
+        park = parks_registry.get(park_name)
         if not park:
             if debug:
                 print("park_not_in_config:", park_name)
             continue
-        polygon = park["polygon"]  # list[(lon,lat)]
-        bbox = _lonlat_bbox(polygon)
+        canvas = prepare_park_canvas(park, **_pick(opts, _CANVAS_ARGS))
+        out_files.append(draw_park_vehicles(canvas, vehicles, **_pick(opts, _DRAW_ARGS)))
 
-        # фон: либо реальные тайлы, либо однотонный
-        if use_real_map:
-            # Safety: защита от слишком большого холста тайлов (OOM/FD storm).
-            try:
-                max_tiles = int(os.getenv("MAP_MAX_TILES", "225"))
-            except Exception:
-                max_tiles = 225
-            try:
-                max_side_px = int(os.getenv("MAP_MAX_TILE_CANVAS_SIDE_PX", "4096"))
-            except Exception:
-                max_side_px = 4096
-            try:
-                max_pixels = int(os.getenv("MAP_MAX_TILE_CANVAS_PIXELS", str(4096 * 4096)))
-            except Exception:
-                max_pixels = 4096 * 4096
-
-            if _tile_canvas_is_too_big(
-                bbox,
-                zoom,
-                max_tiles=max_tiles,
-                max_side_px=max_side_px,
-                max_pixels=max_pixels,
-            ):
-                if debug:
-                    tiles_x, tiles_y, cw, ch = _tile_grid_metrics(bbox, zoom)
-                    print(
-                        f"tile_canvas_guard: fallback_to_simple_bg park={park_name}, "
-                        f"zoom={zoom}, tiles={tiles_x}x{tiles_y}, canvas={cw}x{ch}"
-                    )
-                img = Image.new("RGB", (width, height), background)
-                draw = ImageDraw.Draw(img)
-                poly_xy = [_project(x, y, bbox, (width, height), pad) for (x, y) in polygon]
-                if len(poly_xy) >= 3:
-                    draw.polygon(poly_xy, fill=fill_color, outline=outline_color)
-                # Дальше используем обычный путь рисования точек (use_real_map=False для этого парка)
-                use_real_map_for_park = False
-            else:
-                use_real_map_for_park = True
+    return out_files
 
-        else:
-            use_real_map_for_park = False
-
-        if use_real_map_for_park:
-            provider_url = tile_provider
-            # подхватываем ключ/UA/Referer из окружения, если не переданы явно
-            env_key = os.getenv("MAPTILER_API_KEY", "")
-            env_ua = os.getenv("MAP_USER_AGENT", "")
-            env_ref = os.getenv("MAP_REFERER", "")
-            if not tile_apikey:
-                tile_apikey = env_key
-            if not tile_user_agent and env_ua:
-                tile_user_agent = env_ua
-            if not tile_referer and env_ref:
-                tile_referer = env_ref
-            if "{apikey}" in provider_url:
-                provider_url = provider_url.replace("{apikey}", tile_apikey)
-            headers = {}
-            if tile_user_agent:
-                headers["User-Agent"] = tile_user_agent
-            if tile_referer:
-                headers["Referer"] = tile_referer
-            tile_img, tile_range = _stitch_tiles(bbox, zoom, provider_url, tile_cache, headers, tile_rate_tps, debug)
-            if debug and tile_img.getbbox() is None:
-                print("tile_canvas_empty: fallback to simple background")
-            img = tile_img.resize((width, height), Image.LANCZOS)
-            draw = ImageDraw.Draw(img)
-            # обведем полигон легкой линией сверху карты для ориентира
-            poly_xy = []
-            scale_x = width / float(tile_img.width)
-            scale_y = height / float(tile_img.height)
-            for (x, y) in polygon:
-                px, py = _project_on_tileimg(x, y, zoom, tile_range)
-                # масштаб до итогового размера
-                sx = int(px * scale_x)
-                sy = int(py * scale_y)
-                poly_xy.append((sx, sy))
-            if len(poly_xy) >= 3:
-                draw.line(poly_xy + [poly_xy[0]], fill=outline_color, width=2)
-        else:
-            img = Image.new("RGB", (width, height), background)
-            draw = ImageDraw.Draw(img)
-            poly_xy = [_project(x, y, bbox, (width, height), pad) for (x, y) in polygon]
-            if len(poly_xy) >= 3:
-                draw.polygon(poly_xy, fill=fill_color, outline=outline_color)
-
-        # заголовок с полупрозрачным фоном
-        title_text = f"Парк: {park_name}"
-        _draw_label_box(draw, (10, 10), title_text, text_color, font)
-
-        # ТС
-        for v in vehicles:
-            lon = v.get("lon")
-            lat = v.get("lat")
-            dep = str(v.get("depot_number"))
-            if lon is None or lat is None:
+
+async def render_parks_streaming(
+    results: AsyncIterator[Dict],
+    park_filter: Optional[str] = None,
+    **opts,
+) -> Tuple[List[str], List[Dict]]:
+    """
+    Рендер по потоку результатов (ump_client.stream_positions): подложка парка
+    (тайлы) начинает готовиться в потоке, как только пришло первое ТС этого парка,
+    пока позиции остальных ещё запрашиваются. ТС наносятся, когда поток закончился.
+    opts — параметры prepare_park_canvas/draw_park_vehicles.
+    Возвращает (пути PNG в порядке появления парков, все полученные результаты).
+    """
+    from .park_registry import get_park_registry
+
+    try:
+        load_dotenv()
+    except Exception:
+        pass
+    registry = get_park_registry()
+    debug = opts.get("debug", False)
+
+    canvases: Dict[str, asyncio.Future] = {}
+    in_park_by_name: Dict[str, List[Dict]] = {}
+    collected: List[Dict] = []
+    try:
+        async for r in results:
+            collected.append(r)
+            park_name = r.get("park_name") if r.get("ok") and r.get("in_park") else None
+            if not park_name:
+                if debug:
+                    print("skip_item:", r)
                 continue
-            if use_real_map_for_park:
-                px, py = _project_on_tileimg(lon, lat, zoom, tile_range)
-                cx = int(px * scale_x)
-                cy = int(py * scale_y)
-            else:
-                cx, cy = _project(lon, lat, bbox, (width, height), pad)
-            r = point_radius
-            # Определяем цвет точки на основе color_map
-            fill_col = vehicle_fill
-            outline_col = vehicle_outline
-            if color_map and dep in color_map:
-                fill_col, outline_col = color_map[dep]
+            if park_filter and park_name != park_filter:
+                continue
+            park = registry.get(park_name)
+            if not park:
                 if debug:
-                    print(f"[DEBUG] ТС {dep}: цвет {fill_col} (из color_map)")
-            elif debug and color_map:
-                print(f"[DEBUG] ТС {dep}: цвет по умолчанию {fill_col} (нет в color_map, ключи: {list(color_map.keys())[:5]})")
-            draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=fill_col, outline=outline_col)
-            # подпись с фоновой коробкой
-            tx, ty = cx + r + 6, cy - r - 14
-            _draw_label_box(draw, (tx, ty), dep, text_color, font)
-
-        safe_name = re.sub(r"[^0-9A-Za-zА-Яа-я_\-]+", "_", park_name)
-        out_path = os.path.join(out_dir, f"park_{safe_name}.png")
-        img.save(out_path)
-        out_files.append(out_path)
-
-    return out_files
+                    print("park_not_in_config:", park_name)
+                continue
+            in_park_by_name.setdefault(park_name, []).append(r)
+            if park_name not in canvases:
+                canvases[park_name] = asyncio.ensure_future(
+                    asyncio.to_thread(prepare_park_canvas, park, **_pick(opts, _CANVAS_ARGS))
+                )
+
+        out_files: List[str] = []
+        for park_name, fut in canvases.items():
+            canvas = await fut
+            out_files.append(await asyncio.to_thread(
+                draw_park_vehicles, canvas, in_park_by_name[park_name], **_pick(opts, _DRAW_ARGS)
+            ))
+    finally:
+        # ошибка потока или одной из подложек: остальные отменяем и забираем их
+        # исключения (иначе "exception was never retrieved")
+        for fut in canvases.values():
+            fut.cancel()
+        if canvases:
+            await asyncio.gather(*canvases.values(), return_exceptions=True)
+    return out_files, collected
 
 
 def _measure_text(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.ImageFont) -> Tuple[int, int]:
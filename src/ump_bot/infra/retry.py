@@ -0,0 +1,134 @@
+# retry.py
+"""
+Общая политика повторов запросов к UMP.
+
+- повторяются только временные сбои: таймауты, ошибки соединения, 5xx, 429;
+  остальные 4xx (404, 400, ...) — окончательный ответ, повтор не поможет;
+- пауза — «полный джиттер»: случайная в [0, min(max_delay, base * 2**attempt)],
+  чтобы одновременно упавшие запросы разных пользователей не повторялись хором;
+- Retry-After из ответа (секунды или HTTP-дата) соблюдается; если сервер просит
+  ждать дольше max_delay — не повторяем;
+- глобальный бюджет: повторов не больше ratio от числа запросов за окно
+  (плюс небольшой минимум в секунду, чтобы единичные запросы тоже могли повториться).
+  При частичном отказе UMP повторы не умножают нагрузку.
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from ..config import (
+    UMP_RETRY_ATTEMPTS,
+    UMP_RETRY_BASE_SEC,
+    UMP_RETRY_BUDGET_RATIO,
+    UMP_RETRY_MAX_SEC,
+    UMP_RETRY_MIN_PER_SEC,
+)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After: число секунд или HTTP-дата -> секунды ожидания (None — не задан/не разобран)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt is None:
+        return None
+    return max(0.0, dt.timestamp() - time.time())
+
+
+def is_retryable_status(status_code: Optional[int]) -> bool:
+    return status_code is not None and (status_code >= 500 or status_code == 429)
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = UMP_RETRY_BUDGET_RATIO, min_per_sec: float = UMP_RETRY_MIN_PER_SEC, window_sec: int = 10):
+        self.ratio = float(ratio)
+        self.min_per_sec = float(min_per_sec)
+        self.window_sec = max(1, int(window_sec))
+        self._lock = threading.Lock()
+        # секунда -> [запросов, повторов]
+        self._buckets: Dict[int, list] = {}
+        self.requests = 0
+        self.retries = 0
+        self.denied = 0
+
+    def _prune(self, now_s: int) -> None:
+        for s in [s for s in self._buckets if s <= now_s - self.window_sec]:
+            del self._buckets[s]
+
+    def record_request(self) -> None:
+        now_s = int(time.monotonic())
+        with self._lock:
+            self._prune(now_s)
+            self._buckets.setdefault(now_s, [0, 0])[0] += 1
+            self.requests += 1
+
+    def try_spend(self) -> bool:
+        """Можно ли сделать ещё один повтор (и учесть его)."""
+        now_s = int(time.monotonic())
+        with self._lock:
+            self._prune(now_s)
+            reqs = sum(b[0] for b in self._buckets.values())
+            retries = sum(b[1] for b in self._buckets.values())
+            if retries >= self.min_per_sec * self.window_sec + self.ratio * reqs:
+                self.denied += 1
+                return False
+            self._buckets.setdefault(now_s, [0, 0])[1] += 1
+            self.retries += 1
+            return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "retries": self.retries, "denied": self.denied}
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = UMP_RETRY_ATTEMPTS,
+        base_delay: float = UMP_RETRY_BASE_SEC,
+        max_delay: float = UMP_RETRY_MAX_SEC,
+        budget: Optional[RetryBudget] = None,
+    ):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.budget = budget if budget is not None else RetryBudget()
+
+    def on_request(self) -> None:
+        """Вызывается один раз на логический запрос (до первой попытки)."""
+        self.budget.record_request()
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Пауза перед повтором после неудачной попытки attempt (с 0)
+        или None, если повторять нельзя (попытки/бюджет исчерпаны, Retry-After слишком велик).
+        """
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if retry_after is not None and retry_after > self.max_delay:
+            return None
+        if not self.budget.try_spend():
+            return None
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def stats(self) -> Dict[str, int]:
+        return self.budget.stats()
+
+
+_UMP_RETRY = RetryPolicy()
+
+
+def get_ump_retry_policy() -> RetryPolicy:
+    return _UMP_RETRY
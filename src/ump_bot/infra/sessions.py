@@ -0,0 +1,185 @@
+# sessions.py
+"""
+HTTP-сессии UMP (requests) по аккаунтам.
+
+У каждого аккаунта — своя requests.Session: собственный пул соединений
+(не меньше параллелизма пакетных запросов) и собственные cookies, загруженные
+из файла аккаунта (USER_COOKIES_DIR/<user_id>_cookies.txt, для аккаунта из env —
+UMP_COOKIES). Пользователи не делят один пул и не видят cookies друг друга.
+
+Аккаунт определяется путём к файлу токена (или самим токеном, если он передан
+явно). Cookies перечитываются, когда файл меняется (после повторного логина).
+Сессии без запросов дольше UMP_SESSION_IDLE_SEC вытесняются; одновременно
+держится не больше UMP_SESSION_MAX сессий (давно неиспользуемые — первыми).
+Вытесненная сессия не закрывается явно (ею ещё может пользоваться запрос
+в другом потоке) — её соединения закрываются сборщиком мусора.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.cookiejar import MozillaCookieJar
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..config import (
+    UMP_BATCH_CONCURRENCY,
+    UMP_COOKIES_FILE,
+    UMP_SESSION_IDLE_SEC,
+    UMP_SESSION_MAX,
+    USER_COOKIES_DIR,
+)
+
+_USER_TOKEN_RE = re.compile(r"^(.+)_token\.txt$")
+
+
+def account_key(token: Optional[str] = None, token_path: Optional[str] = None) -> str:
+    """Ключ аккаунта: явный токен (по хэшу), путь к токену или аккаунт из env."""
+    if token:
+        return "token:" + hashlib.sha256(token.strip().encode("utf-8")).hexdigest()[:16]
+    if token_path:
+        return "path:" + os.path.abspath(token_path)
+    return "env"
+
+
+def cookies_path_for(token: Optional[str] = None, token_path: Optional[str] = None) -> Optional[str]:
+    """Файл cookies аккаунта; для явно переданного токена cookies не используются."""
+    if token:
+        return None
+    if not token_path:
+        return UMP_COOKIES_FILE
+    m = _USER_TOKEN_RE.match(os.path.basename(token_path))
+    if not m:
+        return None
+    return os.path.join(USER_COOKIES_DIR, f"{m.group(1)}_cookies.txt")
+
+
+def _file_sig(path: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _load_cookies(session: requests.Session, path: Optional[str]) -> None:
+    session.cookies.clear()
+    if not path or not os.path.exists(path):
+        return
+    jar = MozillaCookieJar(path)
+    try:
+        jar.load(ignore_discard=True, ignore_expires=True)
+    except Exception:
+        return
+    for cookie in jar:
+        session.cookies.set_cookie(cookie)
+
+
+class _Entry:
+    __slots__ = ("session", "cookies_path", "cookies_sig", "last_used")
+
+    def __init__(self, session: requests.Session, cookies_path: Optional[str]):
+        self.session = session
+        self.cookies_path = cookies_path
+        self.cookies_sig = _file_sig(cookies_path)
+        self.last_used = time.monotonic()
+
+
+class SessionManager:
+    def __init__(
+        self,
+        max_sessions: int = UMP_SESSION_MAX,
+        idle_sec: float = UMP_SESSION_IDLE_SEC,
+        pool_maxsize: int = max(10, UMP_BATCH_CONCURRENCY),
+    ):
+        self.max_sessions = max(1, int(max_sessions))
+        self.idle_sec = float(idle_sec)
+        self.pool_maxsize = max(1, int(pool_maxsize))
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.created = 0
+        self.evicted = 0
+        self.cookie_reloads = 0
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        # пул не меньше параллелизма пакетных запросов, иначе потоки ждут друг друга
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, token: Optional[str] = None, token_path: Optional[str] = None) -> requests.Session:
+        key = account_key(token, token_path)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._items.get(key)
+            if entry is None:
+                path = cookies_path_for(token, token_path)
+                entry = _Entry(self._new_session(), path)
+                _load_cookies(entry.session, path)
+                self._items[key] = entry
+                self.created += 1
+                while len(self._items) > self.max_sessions:
+                    # вытесненную сессию не закрываем: ею может пользоваться запрос
+                    # в другом потоке; соединения закроются, когда она станет не нужна (GC)
+                    self._items.popitem(last=False)
+                    self.evicted += 1
+            else:
+                sig = _file_sig(entry.cookies_path)
+                if sig != entry.cookies_sig:
+                    # файл cookies перезаписан (новый логин) — берём свежие
+                    _load_cookies(entry.session, entry.cookies_path)
+                    entry.cookies_sig = sig
+                    self.cookie_reloads += 1
+            entry.last_used = now
+            self._items.move_to_end(key)
+            return entry.session
+
+    def _evict_idle(self, now: float) -> None:
+        # как и при LRU — только отпускаем ссылку, без close()
+        stale = [k for k, e in self._items.items() if now - e.last_used > self.idle_sec]
+        for k in stale:
+            del self._items[k]
+            self.evicted += 1
+
+    def invalidate(self, token: Optional[str] = None, token_path: Optional[str] = None) -> None:
+        """Закрыть сессию аккаунта (например, после выхода пользователя)."""
+        with self._lock:
+            entry = self._items.pop(account_key(token, token_path), None)
+        if entry is not None:
+            entry.session.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            entries = list(self._items.values())
+            self._items.clear()
+        for entry in entries:
+            entry.session.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "created": self.created,
+                "evicted": self.evicted,
+                "cookie_reloads": self.cookie_reloads,
+            }
+
+
+_MANAGER = SessionManager()
+
+
+def get_session_manager() -> SessionManager:
+    return _MANAGER
+
+
+def get_session(token: Optional[str] = None, token_path: Optional[str] = None) -> requests.Session:
+    return _MANAGER.get(token=token, token_path=token_path)
@@ -0,0 +1,435 @@
+# tiles.py
+"""
+Загрузка тайлов карты для render_map.
+
+Тайлы из кэша на диске отдаются сразу и лимитом не ограничиваются. Недостающие
+скачиваются параллельно (до MAP_TILE_WORKERS потоков на процесс) через общий
+token bucket провайдера: все рендеры вместе укладываются в MAP_TPS запросов
+в секунду, а не каждый рендер по отдельности. Сетка 15×15 тайлов упирается
+в квоту провайдера, а не в последовательное ожидание ответов.
+
+Декодированные тайлы держатся в памяти (LRU с лимитом MAP_TILE_MEM_CACHE_MB),
+общем для всех рендеров: повторный рендер того же парка не декодирует PNG.
+На диске — TileStore: шардирование z/x/y, без секретов в путях, лимит размера.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from ..config import CACHE_DIR, MAP_TILE_CACHE_MAX_MB, MAP_TILE_MEM_CACHE_MB, MAP_TILE_WORKERS, MAP_TPS
+
+TileXY = Tuple[int, int]
+
+
+class TokenBucket:
+    """
+    Потокобезопасный token bucket: rate токенов в секунду, запас не больше burst.
+    acquire() резервирует токен и ждёт своей очереди вне блокировки.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self._lock = threading.Lock()
+        self.rate = max(0.1, float(rate))
+        self.burst = max(1.0, float(burst if burst is not None else self.rate))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self.acquired = 0
+        self.waited_sec = 0.0
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self.rate = max(0.1, float(rate))
+            self.burst = max(1.0, self.rate)
+            self._tokens = min(self._tokens, self.burst)
+
+    def acquire(self) -> float:
+        """Взять токен (при необходимости подождать); возвращает время ожидания."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.acquired += 1
+            self.waited_sec += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+_LIMITERS: Dict[str, TokenBucket] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_tile_limiter(provider: str, rate: Optional[float] = None) -> TokenBucket:
+    """Общий на процесс лимитер хоста провайдера (квота у провайдера — на хост)."""
+    host = urlsplit(provider).netloc or provider
+    rate = MAP_TPS if rate is None else rate
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(host)
+        if limiter is None:
+            limiter = _LIMITERS[host] = TokenBucket(rate)
+    if limiter.rate != max(0.1, float(rate)):
+        limiter.set_rate(rate)
+    return limiter
+
+
+class DecodedTileCache:
+    """
+    LRU декодированных тайлов (RGBA) с лимитом по байтам пикселей.
+    Картинки общие для всех рендеров — их можно только читать (paste), не изменять.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Tuple[str, int, int, int], Image.Image]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(img: Image.Image) -> int:
+        return img.width * img.height * len(img.getbands())
+
+    def get(self, key: Tuple[str, int, int, int]) -> Optional[Image.Image]:
+        with self._lock:
+            img = self._items.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return img
+
+    def put(self, key: Tuple[str, int, int, int], img: Image.Image) -> None:
+        size = self._size(img)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= self._size(old)
+            self._items[key] = img
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.bytes -= self._size(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_MEMORY = DecodedTileCache(MAP_TILE_MEM_CACHE_MB * 1024 * 1024)
+
+
+def get_tile_memory_cache() -> DecodedTileCache:
+    return _MEMORY
+
+
+_POOL = ThreadPoolExecutor(max_workers=MAP_TILE_WORKERS, thread_name_prefix="tile-fetch")
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+_STATS = {"disk_hits": 0, "downloads": 0, "failures": 0}
+_STATS_LOCK = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAP_TILE_WORKERS)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _SESSION = session
+    return _SESSION
+
+
+def _count(key: str, n: int = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[key] += n
+
+
+def tile_stats() -> Dict[str, int]:
+    with _STATS_LOCK:
+        return dict(_STATS)
+
+
+def tile_url(provider: str, z: int, x: int, y: int) -> str:
+    return provider.replace("{z}", str(z)).replace("{x}", str(x)).replace("{y}", str(y))
+
+
+_SECRET_PARAM_RE = re.compile(r"([?&](?:key|apikey|api_key|access_token|token)=)[^&]*", re.IGNORECASE)
+
+
+def provider_cache_id(provider: str) -> str:
+    """Шаблон провайдера без значений ключей API — для ключей кэша (секрет не попадает в имена/ключи)."""
+    return _SECRET_PARAM_RE.sub(r"\1", provider)
+
+
+# файлы старого плоского кэша (URL провайдера с ключом API в имени)
+_LEGACY_TILE_RE = re.compile(r"^https?_.+_\d+_\d+_\d+\.png$")
+_LEGACY_PURGED: set = set()
+
+
+def purge_legacy_tiles(directory: str) -> int:
+    """
+    Удаляет тайлы старого плоского кэша из directory (без подкаталогов):
+    в их именах — URL провайдера с подставленным ключом API. Возвращает число файлов.
+    """
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        if not _LEGACY_TILE_RE.match(name):
+            continue
+        try:
+            os.remove(os.path.join(directory, name))
+            removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def _purge_legacy_once(directory: str) -> None:
+    key = os.path.abspath(directory)
+    with _STORES_LOCK:
+        if key in _LEGACY_PURGED:
+            return
+        _LEGACY_PURGED.add(key)
+    purge_legacy_tiles(directory)
+
+
+class TileStore:
+    """
+    Тайлы на диске: <root>/<провайдер>/<z>/<x>/<y>.png, где каталог провайдера —
+    хост + хэш шаблона без ключей API (смена MAPTILER_API_KEY кэш не сбрасывает,
+    ключ не попадает в имена файлов). Запись атомарная (tmp + os.replace).
+    Размер ограничен max_bytes: при превышении удаляются давно не читанные тайлы
+    (atime обновляется при чтении явно — не зависим от noatime).
+    """
+
+    _TMP_MAX_AGE_SEC = 3600
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        self._bytes: Optional[int] = None
+        self.evicted = 0
+
+    @staticmethod
+    def _provider_dir(provider_id: str) -> str:
+        host = re.sub(r"[^0-9A-Za-z.\-]+", "_", urlsplit(provider_id).netloc or "tiles")
+        digest = hashlib.sha256(provider_id.encode("utf-8")).hexdigest()[:12]
+        return f"{host}_{digest}"
+
+    def path(self, provider_id: str, z: int, x: int, y: int) -> str:
+        return os.path.join(self.root, self._provider_dir(provider_id), str(z), str(x), f"{y}.png")
+
+    def load(self, provider_id: str, z: int, x: int, y: int) -> Optional[Image.Image]:
+        local = self.path(provider_id, z, x, y)
+        try:
+            # Важно: Image.open держит файловый дескриптор до закрытия объекта.
+            # При частом рендере это может накопить FD/память, поэтому делаем copy().
+            with Image.open(local) as im:
+                img = im.convert("RGBA").copy()
+        except Exception:
+            return None
+        try:
+            os.utime(local, (time.time(), os.stat(local).st_mtime))
+        except OSError:
+            pass
+        return img
+
+    def save(self, provider_id: str, z: int, x: int, y: int, data: bytes) -> None:
+        local = self.path(provider_id, z, x, y)
+        tmp = f"{local}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            try:
+                old = os.path.getsize(local)
+            except OSError:
+                old = 0
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, local)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        if not self.max_bytes:
+            return
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_locked(evict=False)
+            else:
+                self._bytes += len(data) - old
+            if self._bytes > self.max_bytes:
+                self._bytes = self._scan_locked(evict=True)
+
+    def _scan_locked(self, evict: bool) -> int:
+        """Обход каталога: убирает старый плоский кэш и брошенные tmp; при evict — вытесняет по atime."""
+        now = time.time()
+        files: List[Tuple[float, int, str]] = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                full = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(full)
+                    if name.endswith(".tmp"):
+                        if now - st.st_mtime > self._TMP_MAX_AGE_SEC:
+                            os.remove(full)
+                        continue
+                    if dirpath == self.root and _LEGACY_TILE_RE.match(name):
+                        os.remove(full)
+                        continue
+                except OSError:
+                    continue
+                if name.endswith(".png"):
+                    files.append((st.st_atime, st.st_size, full))
+        total = sum(size for _, size, _ in files)
+        if evict and total > self.max_bytes:
+            # с запасом до 90% лимита, чтобы не обходить каталог на каждой записи
+            target = int(self.max_bytes * 0.9)
+            files.sort()
+            for _, size, full in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(full)
+                except OSError:
+                    continue
+                total -= size
+                self.evicted += 1
+        return total
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        with self._lock:
+            return {"bytes": self._bytes, "max_bytes": self.max_bytes, "evicted": self.evicted}
+
+
+_STORES: Dict[str, TileStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_tile_store(root: str) -> TileStore:
+    """Общий на процесс TileStore каталога root (лимит — MAP_TILE_CACHE_MAX_MB)."""
+    key = os.path.abspath(root)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = _STORES[key] = TileStore(root, MAP_TILE_CACHE_MAX_MB * 1024 * 1024)
+    # старые плоские тайлы с ключом API в имени: и в самом каталоге, и в CACHE_DIR,
+    # куда их раньше писал services/map
+    _purge_legacy_once(root)
+    _purge_legacy_once(CACHE_DIR)
+    return store
+
+
+def download_tile(
+    provider: str,
+    provider_id: str,
+    z: int,
+    x: int,
+    y: int,
+    cache_dir: str,
+    headers: Optional[Dict[str, str]] = None,
+    limiter: Optional[TokenBucket] = None,
+) -> Image.Image:
+    if limiter is not None:
+        limiter.acquire()
+    resp = _get_session().get(tile_url(provider, z, x, y), headers=headers or None, timeout=15)
+    resp.raise_for_status()
+    img = Image.open(io.BytesIO(resp.content)).convert("RGBA")
+    # на диск — байты ответа как есть (без перекодирования), только если это картинка
+    get_tile_store(cache_dir).save(provider_id, z, x, y, resp.content)
+    return img
+
+
+def fetch_tiles(
+    provider: str,
+    zoom: int,
+    coords: Iterable[TileXY],
+    cache_dir: str,
+    headers: Optional[Dict[str, str]] = None,
+    tiles_per_sec: Optional[float] = None,
+    debug: bool = False,
+    cache_id: Optional[str] = None,
+) -> Dict[TileXY, Optional[Image.Image]]:
+    """
+    Тайлы (x, y) уровня zoom: из памяти или с диска — сразу, остальные — параллельно
+    через общий лимитер. Не загрузившийся тайл — None (рендер оставит на его месте фон).
+    Возвращаемые картинки общие (кэш в памяти) — их нельзя изменять.
+    cache_id — идентификатор провайдера без секретов (по умолчанию provider без ключей в query).
+    """
+    memory = get_tile_memory_cache()
+    store = get_tile_store(cache_dir)
+    provider_id = cache_id or provider_cache_id(provider)
+    out: Dict[TileXY, Optional[Image.Image]] = {}
+    misses: List[TileXY] = []
+    disk_hits = 0
+    for xy in coords:
+        key = (provider_id, zoom, xy[0], xy[1])
+        img = memory.get(key)
+        if img is None:
+            img = store.load(provider_id, zoom, xy[0], xy[1])
+            if img is None:
+                misses.append(xy)
+                continue
+            disk_hits += 1
+            memory.put(key, img)
+        out[xy] = img
+    _count("disk_hits", disk_hits)
+    if not misses:
+        return out
+    limiter = get_tile_limiter(provider, tiles_per_sec)
+    futures = {
+        xy: _POOL.submit(download_tile, provider, provider_id, zoom, xy[0], xy[1], cache_dir, headers, limiter)
+        for xy in misses
+    }
+    for xy, fut in futures.items():
+        try:
+            out[xy] = fut.result()
+            memory.put((provider_id, zoom, xy[0], xy[1]), out[xy])
+            _count("downloads")
+        except Exception:
+            out[xy] = None
+            _count("failures")
+            if debug:
+                print("tile_fetch_failed:", tile_url(provider, zoom, xy[0], xy[1]))
+    return out
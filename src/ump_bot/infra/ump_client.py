@@ -0,0 +1,578 @@
+# ump_client.py
+"""
+Асинхронный клиент UMP на httpx — для обработчиков бота, работающих в event loop.
+
+Один httpx.AsyncClient на event loop: keep-alive соединения переиспользуются
+между запросами, их число ограничено UMP_MAX_CONNECTIONS (все запросы идут на
+один хост UMP, так что это и есть лимит на хост). Сотни ТС можно запрашивать
+через await без потоков: ожидание ответа не занимает поток executor-а.
+
+Семантика та же, что у синхронного otbivka: индекс ТС, кэш позиций,
+stale-while-revalidate, геофенсинг, повторы и перелогин по 401.
+"""
+import asyncio
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from . import otbivka as otb
+from ..domain.vehicle import VehicleStatus
+from .circuit_breaker import get_ump_breaker, is_failure_status
+from .hot_vehicles import touch_hot
+from .sessions import account_key
+from .retry import get_ump_retry_policy, is_retryable_status, parse_retry_after
+from .singleflight import AsyncSingleFlight
+from .vehicle_index import get_vehicle_index
+from ..config import (
+    CACHE_TTL_SEC,
+    POSITION_STALE_OK_SEC,
+    REQUEST_TIMEOUT,
+    UMP_BASE_URL,
+    UMP_BULK_REFRESH_SEC,
+    UMP_BULK_RESOLVE,
+    UMP_CALL_TIMEOUT,
+    UMP_KEEPALIVE_SEC,
+    UMP_MAX_CONNECTIONS,
+)
+
+_Pending = Tuple[int, Dict]
+
+
+def _batch_error(dep: str, e: Exception) -> VehicleStatus:
+    if isinstance(e, httpx.HTTPStatusError):
+        return VehicleStatus(
+            ok=False,
+            depot_number=str(dep),
+            error="http_error",
+            status=e.response.status_code,
+            detail=(e.response.text or "")[:400],
+        )
+    return otb._batch_error(dep, e)
+
+
+class _SessionRefresh:
+    """
+    Обновление сессии по 401 внутри пакета: refresh (синхронный, в потоке)
+    вызывается не больше одного раза, конкурентные 401 ждут его результат.
+    refresh возвращает новый путь токена или None (обновить не удалось).
+    """
+
+    def __init__(self, token_path: Optional[str], refresh: Optional[Callable[[], Optional[str]]]):
+        self.token_path = token_path
+        self._refresh = refresh
+        self._lock = asyncio.Lock()
+        self._attempted = False
+        self._renewed = False
+
+    async def renew(self) -> bool:
+        if self._refresh is None:
+            return False
+        async with self._lock:
+            if not self._attempted:
+                self._attempted = True
+                new_path = await asyncio.to_thread(self._refresh)
+                if new_path:
+                    self.token_path = new_path
+                    self._renewed = True
+            return self._renewed
+
+
+class AsyncUMPClient:
+    def __init__(
+        self,
+        base_url: str = UMP_BASE_URL,
+        max_connections: int = UMP_MAX_CONNECTIONS,
+        keepalive_sec: float = UMP_KEEPALIVE_SEC,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.max_connections = max(1, int(max_connections))
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=keepalive_sec,
+            ),
+            # ожидание свободного соединения не ограничиваем: очередь задаёт семафор пакета
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, pool=None),
+            # как requests в otbivka: редиректы UMP (3xx) проходим, а не считаем ошибкой
+            follow_redirects=True,
+            transport=transport,
+        )
+        # клиент общий для всех аккаунтов: cookies из ответов не сохраняем и не отправляем
+        self._client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.loop = asyncio.get_running_loop()
+        self._online_flight = AsyncSingleFlight()
+        self._resolve_flight = AsyncSingleFlight()
+        self._fleet_lock = asyncio.Lock()
+        self._revalidating: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await self._client.aclose()
+
+    # ---------- HTTP ----------
+    @staticmethod
+    async def _auth_headers(token: Optional[str], token_path: Optional[str]) -> Dict[str, str]:
+        """
+        otbivka._auth_headers без блокировки loop: токен из файла может
+        потребовать чтения файла или синхронного перелогина — это в потоке.
+        """
+        if token:
+            return otb._auth_headers(token=token)
+        return await asyncio.to_thread(otb._auth_headers, token=token, token_path=token_path)
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        *,
+        token: Optional[str],
+        token_path: Optional[str],
+        timeout: Optional[float],
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        Запрос через предохранитель UMP с общей политикой повторов (как
+        otbivka._ump_request): временные сбои — повтор с джиттером в пределах
+        бюджета, 401 — один перелогин (только для токена из env).
+        """
+        breaker = get_ump_breaker()
+        policy = get_ump_retry_policy()
+        policy.on_request()
+        relogged = False
+        attempt = 0
+        while True:
+            # заголовки (чтение токена) — до предохранителя: нет токена — нет и пробы
+            headers = await self._auth_headers(token, token_path)
+            breaker.before_call()
+            try:
+                r = await self._client.request(
+                    method,
+                    url,
+                    headers=headers,
+                    timeout=httpx.Timeout(timeout or REQUEST_TIMEOUT, pool=None),
+                    **kwargs,
+                )
+            except httpx.TransportError as e:
+                breaker.record_failure(e)
+                delay = policy.backoff(attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                # отмена или ошибка не сети — исхода нет, слот пробы half_open освобождаем
+                breaker.release()
+                raise
+            else:
+                if is_failure_status(r.status_code):
+                    breaker.record_failure(RuntimeError(f"HTTP {r.status_code}"))
+                else:
+                    breaker.record_success()
+                if r.status_code == 401 and otb._auto_login and not relogged and token is None and token_path is None:
+                    # логин — синхронный и редкий, выносим в поток
+                    await asyncio.to_thread(otb._relogin)
+                    relogged = True
+                    continue
+                if not is_retryable_status(r.status_code):
+                    r.raise_for_status()
+                    return r
+                delay = policy.backoff(attempt, parse_retry_after(r.headers.get("Retry-After")))
+                if delay is None:
+                    r.raise_for_status()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def post_vehicles(
+        self,
+        params: Optional[Dict[str, str]] = None,
+        token: Optional[str] = None,
+        token_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> List[Dict]:
+        r = await self._send(
+            "POST", "/api/v1/map/vehicles",
+            token=token, token_path=token_path, timeout=timeout,
+            params=params, json={},
+        )
+        return [it for it in otb._as_list(r.json()) if isinstance(it, dict)]
+
+    async def get_vehicle_id_by_depot_number(
+        self,
+        depot_number: str,
+        token: Optional[str] = None,
+        token_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Optional[int]:
+        items = await self.post_vehicles({"number": str(depot_number)}, token=token, token_path=token_path, timeout=timeout)
+        for it in items:
+            dep, vid = otb._item_depot_and_id(it)
+            if dep == str(depot_number) and vid is not None:
+                return vid
+        if items:
+            _, vid = otb._item_depot_and_id(items[0])
+            if vid is not None:
+                return vid
+        return None
+
+    async def refresh_fleet_index(
+        self,
+        token: Optional[str] = None,
+        token_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        force: bool = False,
+    ) -> int:
+        """Как otbivka.refresh_fleet_index: индекс ТС одним запросом списка."""
+        index = get_vehicle_index()
+        if not force and index.listing_age() < UMP_BULK_REFRESH_SEC:
+            return 0
+        async with self._fleet_lock:
+            if not force and index.listing_age() < UMP_BULK_REFRESH_SEC:
+                return 0
+            items = await self.post_vehicles(None, token=token, token_path=token_path, timeout=timeout)
+            n = index.put_many(otb._fleet_entries(items))
+        # запись файла индекса — не в event loop
+        await asyncio.to_thread(index.save_if_due)
+        return n
+
+    async def fetch_online_by_vehicle_id(
+        self,
+        vehicle_id: int,
+        token: Optional[str] = None,
+        token_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict:
+        r = await self._send(
+            "GET", f"/api/v1/map/online/{vehicle_id}",
+            token=token, token_path=token_path, timeout=timeout,
+        )
+        data = r.json() if "application/json" in r.headers.get("Content-Type", "") else {}
+        return otb._parse_online(vehicle_id, data)
+
+    # ---------- Orchestrator ----------
+    async def _fetch_online_shared(self, vid: int, token, token_path, timeout) -> Dict:
+        # ключ — аккаунт + ТС: ответ/401 одного аккаунта не достаётся другому
+        return await self._online_flight.do(
+            (account_key(token, token_path), int(vid)),
+            lambda: self.fetch_online_by_vehicle_id(vid, token=token, token_path=token_path, timeout=timeout),
+        )
+
+    async def _resolve_vehicle_id(self, depot_number: str, token, token_path, timeout) -> Tuple[Optional[int], bool]:
+        index = get_vehicle_index()
+        vid = index.get(depot_number)
+        if vid is not None:
+            return vid, True
+        vid = await self._resolve_flight.do(
+            (account_key(token, token_path), str(depot_number)),
+            lambda: self.get_vehicle_id_by_depot_number(depot_number, token=token, token_path=token_path, timeout=timeout),
+        )
+        if vid is not None:
+            index.put(depot_number, vid)
+            await asyncio.to_thread(index.save_if_due)
+        return vid, False
+
+    def _schedule_revalidate(self, depot_number: str, vid: int, token, token_path, timeout) -> None:
+        if vid in self._revalidating:
+            return
+        self._revalidating.add(vid)
+
+        async def job() -> None:
+            try:
+                await self.get_position_and_check(depot_number, token=token, token_path=token_path, timeout=timeout, stale_ok=0)
+            except Exception:
+                pass
+            finally:
+                self._revalidating.discard(vid)
+
+        task = asyncio.ensure_future(job())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch_position(
+        self,
+        depot_number: str,
+        token: Optional[str] = None,
+        token_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        stale_ok: Optional[float] = None,
+        refresh: bool = False,
+    ) -> Tuple[Optional[Dict], Optional[_Pending]]:
+        """Асинхронный otbivka._fetch_position; refresh=True — в UMP даже при свежем кэше."""
+        vid, from_index = await self._resolve_vehicle_id(depot_number, token, token_path, timeout)
+        if vid is None:
+            return VehicleStatus(ok=False, depot_number=depot_number, error="vehicle_id_not_found"), None
+        fresh = None if refresh else otb._POSITIONS.get(vid)
+        if fresh:
+            return otb._result_from_cache(depot_number, vid, fresh), None
+        stale_window = POSITION_STALE_OK_SEC if stale_ok is None else stale_ok
+        if not refresh and stale_window > CACHE_TTL_SEC:
+            stale = otb._POSITIONS.get(vid, max_age=stale_window)
+            if stale:
+                self._schedule_revalidate(depot_number, vid, token, token_path, timeout)
+                res = otb._result_from_cache(depot_number, vid, stale)
+                res["stale"] = True
+                res["age_sec"] = int(otb.time.time() - stale.get("ts", 0))
+                return res, None
+        try:
+            try:
+                pos = await self._fetch_online_shared(vid, token, token_path, timeout)
+                stale_hit = from_index and otb._is_stale_index_hit(pos, depot_number)
+            except httpx.HTTPStatusError as e:
+                if not (from_index and e.response.status_code == 404):
+                    raise
+                stale_hit = True
+            if stale_hit:
+                get_vehicle_index().invalidate(depot_number)
+                vid, _ = await self._resolve_vehicle_id(depot_number, token, token_path, timeout)
+                if vid is None:
+                    return VehicleStatus(ok=False, depot_number=depot_number, error="vehicle_id_not_found"), None
+                pos = await self._fetch_online_shared(vid, token, token_path, timeout)
+        except Exception as e:
+            # резервная позиция может читаться из базы — не блокируем event loop
+            res = await asyncio.to_thread(otb._cached_fallback, depot_number, vid, e)
+            if res:
+                return res, None
+            raise
+        if pos["lat"] is None or pos["lon"] is None:
+            cached = await asyncio.to_thread(otb._load_cached_position, vid)
+            if cached:
+                return otb._result_from_cache(depot_number, vid, cached), None
+            return VehicleStatus(ok=False, depot_number=depot_number, vehicle_id=vid, error="no_coords", raw=pos.get("raw")), None
+        return None, (vid, pos)
+
+    async def get_position_and_check(
+        self,
+        depot_number: str,
+        token: Optional[str] = None,
+        token_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        stale_ok: Optional[float] = None,
+    ) -> Dict:
+        res, pending = await self._fetch_position(depot_number, token, token_path, timeout, stale_ok)
+        if pending is None:
+            return res
+        vid, pos = pending
+        registry = otb.get_park_registry()
+        park_name = otb.classify_point(pos["lon"], pos["lat"], registry.geometries(), grid=registry.grid())
+        return otb._finalize_position(depot_number, vid, pos, park_name)
+
+    async def _fetch_position_reauth(
+        self, depot_number: str, token, session: _SessionRefresh, timeout, stale_ok, refresh: bool = False
+    ) -> Tuple[Optional[Dict], Optional[_Pending]]:
+        """_fetch_position с одним повтором после обновления сессии по 401."""
+        try:
+            return await self._fetch_position(depot_number, token, session.token_path, timeout, stale_ok, refresh)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 401 or not await session.renew():
+                raise
+        return await self._fetch_position(depot_number, token, session.token_path, timeout, stale_ok, refresh)
+
+    async def _prepare_batch(
+        self, depot_numbers: List[str], token, token_path, timeout, refresh: bool
+    ):
+        """Общая подготовка пакета: массовое разрешение depot -> vid и прогрев кэша позиций."""
+        index = get_vehicle_index()
+        if UMP_BULK_RESOLVE and depot_numbers:
+            if any(index.get(dep) is None for dep in depot_numbers):
+                try:
+                    await self.refresh_fleet_index(token=token, token_path=token_path, timeout=timeout)
+                except Exception:
+                    pass
+        known_vids = [v for v in (index.get(dep) for dep in depot_numbers) if v is not None]
+        if known_vids and not refresh:
+            await asyncio.to_thread(otb._warm_position_cache, known_vids)
+        return index
+
+    async def batch_get_positions(
+        self,
+        depot_numbers: List[str],
+        token: Optional[str] = None,
+        token_path: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        call_timeout: Optional[float] = None,
+        stale_ok: Optional[float] = None,
+        refresh: bool = False,
+        reauth: Optional[Callable[[], Optional[str]]] = None,
+    ) -> List[Dict]:
+        """
+        Асинхронный otbivka.batch_get_positions: не более max_concurrency
+        (по умолчанию UMP_MAX_CONNECTIONS) запросов одновременно, порядок сохраняется,
+        ошибки по отдельному ТС возвращаются как {"ok": False, ...}.
+        refresh=True — запросить позиции в UMP, не глядя на кэш (фоновый опрос).
+        reauth — обновление сессии пользователя при 401 (см. _SessionRefresh).
+        """
+        limit = self.max_connections if max_concurrency is None else max(1, int(max_concurrency))
+        timeout = call_timeout or UMP_CALL_TIMEOUT
+        index = await self._prepare_batch(depot_numbers, token, token_path, timeout, refresh)
+        sem = asyncio.Semaphore(limit)
+        session = _SessionRefresh(token_path, reauth)
+
+        async def one(dep: str) -> Tuple[Optional[Dict], Optional[_Pending]]:
+            async with sem:
+                try:
+                    return await self._fetch_position_reauth(dep, token, session, timeout, stale_ok, refresh)
+                except Exception as e:
+                    return _batch_error(dep, e), None
+
+        try:
+            fetched = await asyncio.gather(*(one(dep) for dep in depot_numbers))
+        finally:
+            await asyncio.to_thread(index.flush)
+
+        pending = [(i, p) for i, (_, p) in enumerate(fetched) if p is not None]
+        results = [res for res, _ in fetched]
+        if pending:
+            registry = otb.get_park_registry()
+            names = otb.classify_points(
+                [pos["lon"] for _, (_, pos) in pending],
+                [pos["lat"] for _, (_, pos) in pending],
+                registry.geometries(),
+                grid=registry.grid(),
+            )
+            for (i, (vid, pos)), park_name in zip(pending, names):
+                results[i] = otb._finalize_position(depot_numbers[i], vid, pos, park_name)
+        return results
+
+    async def stream_positions(
+        self,
+        depot_numbers: List[str],
+        token: Optional[str] = None,
+        token_path: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        call_timeout: Optional[float] = None,
+        stale_ok: Optional[float] = None,
+        reauth: Optional[Callable[[], Optional[str]]] = None,
+    ) -> AsyncIterator[Dict]:
+        """
+        Как batch_get_positions, но результаты (с park_name) отдаются по мере готовности,
+        а не после самого медленного ТС. Порядок — порядок завершения запросов.
+        Если потребитель прекратил итерацию, незавершённые запросы отменяются.
+        """
+        limit = self.max_connections if max_concurrency is None else max(1, int(max_concurrency))
+        timeout = call_timeout or UMP_CALL_TIMEOUT
+        index = await self._prepare_batch(depot_numbers, token, token_path, timeout, False)
+        sem = asyncio.Semaphore(limit)
+        session = _SessionRefresh(token_path, reauth)
+        registry = otb.get_park_registry()
+
+        async def one(dep: str) -> Dict:
+            async with sem:
+                try:
+                    res, pending = await self._fetch_position_reauth(dep, token, session, timeout, stale_ok)
+                except Exception as e:
+                    return _batch_error(dep, e)
+            if pending is None:
+                return res
+            vid, pos = pending
+            park_name = otb.classify_point(pos["lon"], pos["lat"], registry.geometries(), grid=registry.grid())
+            return otb._finalize_position(dep, vid, pos, park_name)
+
+        tasks = [asyncio.ensure_future(one(dep)) for dep in depot_numbers]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.to_thread(index.flush)
+
+
+_CLIENT: Optional[AsyncUMPClient] = None
+
+
+def _discard_client(client: AsyncUMPClient) -> None:
+    """
+    Закрывает клиент чужого event loop: закрыть пул можно только в его loop.
+    Работающий loop — aclose() туда; остановленный — прогоняем aclose() в нём
+    из отдельного потока; закрытый — сокеты уже не закрыть через loop, просто
+    отпускаем клиент (их закроет сборщик мусора).
+    """
+    old_loop = client.loop
+    if old_loop.is_closed():
+        client._tasks.clear()
+        return
+    if old_loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.aclose(), old_loop)
+        return
+    closer = threading.Thread(
+        target=old_loop.run_until_complete, args=(client.aclose(),), name="ump-client-close", daemon=True
+    )
+    closer.start()
+    closer.join(timeout=5)
+
+
+def get_ump_client() -> AsyncUMPClient:
+    """Клиент текущего event loop (соединения httpx привязаны к loop)."""
+    global _CLIENT
+    loop = asyncio.get_running_loop()
+    if _CLIENT is None or _CLIENT.loop is not loop:
+        old, _CLIENT = _CLIENT, AsyncUMPClient()
+        if old is not None:
+            _discard_client(old)
+    return _CLIENT
+
+
+async def close_ump_client() -> None:
+    global _CLIENT
+    client, _CLIENT = _CLIENT, None
+    if client is not None and client.loop is asyncio.get_running_loop():
+        await client.aclose()
+
+
+async def get_position_and_check(
+    depot_number: str,
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+    stale_ok: Optional[float] = None,
+) -> Dict:
+    touch_hot([depot_number], token_path)
+    return await get_ump_client().get_position_and_check(
+        depot_number, token=token, token_path=token_path, timeout=timeout, stale_ok=stale_ok
+    )
+
+
+async def batch_get_positions(
+    depot_numbers: List[str],
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+    call_timeout: Optional[float] = None,
+    stale_ok: Optional[float] = None,
+    reauth: Optional[Callable[[], Optional[str]]] = None,
+) -> List[Dict]:
+    touch_hot(depot_numbers, token_path)
+    return await get_ump_client().batch_get_positions(
+        depot_numbers,
+        token=token,
+        token_path=token_path,
+        max_concurrency=max_concurrency,
+        call_timeout=call_timeout,
+        stale_ok=stale_ok,
+        reauth=reauth,
+    )
+
+
+async def stream_positions(
+    depot_numbers: List[str],
+    token: Optional[str] = None,
+    token_path: Optional[str] = None,
+    max_concurrency: Optional[int] = None,
+    call_timeout: Optional[float] = None,
+    stale_ok: Optional[float] = None,
+    reauth: Optional[Callable[[], Optional[str]]] = None,
+) -> AsyncIterator[Dict]:
+    touch_hot(depot_numbers, token_path)
+    async for res in get_ump_client().stream_positions(
+        depot_numbers,
+        token=token,
+        token_path=token_path,
+        max_concurrency=max_concurrency,
+        call_timeout=call_timeout,
+        stale_ok=stale_ok,
+        reauth=reauth,
+    ):
+        yield res
@@ -0,0 +1,144 @@
+# vehicle_index.py
+"""
+Персистентный индекс depot_number -> vehicle_id.
+
+Соответствие гаражного номера и vehicle_id в UMP практически не меняется,
+поэтому держим его в памяти и сохраняем в CACHE_DIR/vehicle_index.json:
+известные ТС не требуют запроса /api/v1/map/vehicles?number=...
+Изменения только помечают индекс «грязным»: файл пишет вызывающий код
+(save_if_due/flush — из рабочего потока, а не из event loop) и atexit.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from ..config import CACHE_DIR, VEHICLE_INDEX_TTL_SEC
+
+INDEX_FILE = os.path.join(CACHE_DIR, "vehicle_index.json")
+# не пишем файл чаще, чем раз в N секунд; остаток сбрасывается через flush()
+_SAVE_INTERVAL_SEC = 5.0
+
+
+class VehicleIndex:
+    def __init__(self, path: str = INDEX_FILE, ttl_sec: float = VEHICLE_INDEX_TTL_SEC):
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        # сериализует запись файла: снимок и os.replace идут в одном порядке
+        self._write_lock = threading.Lock()
+        self._items: Dict[str, Dict] = {}
+        self._dirty = False
+        self._last_save = 0.0
+        self._listing_ts = 0.0
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            items = data.get("items") if isinstance(data, dict) else None
+            listing_ts = float(data.get("listing_ts") or 0.0)
+        except Exception:
+            items = None
+            listing_ts = 0.0
+        with self._lock:
+            self._listing_ts = listing_ts
+            self._items = {
+                str(dep): it
+                for dep, it in (items or {}).items()
+                if isinstance(it, dict) and it.get("vehicle_id") is not None
+            }
+            self._dirty = False
+
+    def get(self, depot_number: str) -> Optional[int]:
+        dep = str(depot_number)
+        with self._lock:
+            it = self._items.get(dep)
+            if not it:
+                return None
+            if (time.time() - it.get("ts", 0)) > self.ttl_sec:
+                self._items.pop(dep, None)
+                self._dirty = True
+                return None
+            return int(it["vehicle_id"])
+
+    def put(self, depot_number: str, vehicle_id: int) -> None:
+        with self._lock:
+            self._items[str(depot_number)] = {"vehicle_id": int(vehicle_id), "ts": time.time()}
+            self._dirty = True
+
+    def put_many(self, entries: Iterable[Tuple[str, int, Optional[Dict]]]) -> int:
+        """Массовое обновление из списка ТС: (depot_number, vehicle_id, meta)."""
+        now = time.time()
+        n = 0
+        with self._lock:
+            for dep, vid, meta in entries:
+                it = {"vehicle_id": int(vid), "ts": now}
+                if meta:
+                    it["meta"] = meta
+                self._items[str(dep)] = it
+                n += 1
+            self._listing_ts = now
+            self._dirty = True
+        return n
+
+    def meta(self, depot_number: str) -> Optional[Dict]:
+        with self._lock:
+            it = self._items.get(str(depot_number))
+            return dict(it["meta"]) if it and it.get("meta") else None
+
+    def listing_age(self) -> float:
+        """Сколько секунд назад индекс обновлялся полным списком ТС."""
+        return time.time() - self._listing_ts
+
+    def invalidate(self, depot_number: str) -> None:
+        with self._lock:
+            if self._items.pop(str(depot_number), None) is None:
+                return
+            self._dirty = True
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def save_if_due(self) -> None:
+        """flush(), если с прошлой записи прошло не меньше _SAVE_INTERVAL_SEC."""
+        if (time.time() - self._last_save) >= _SAVE_INTERVAL_SEC:
+            self.flush()
+
+    def flush(self) -> None:
+        """Сохраняет индекс на диск (атомарно), если были изменения."""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = dict(self._items)
+                listing_ts = self._listing_ts
+                self._dirty = False
+                self._last_save = time.time()
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"version": 1, "listing_ts": listing_ts, "items": snapshot}, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+
+
+_INDEX: Optional[VehicleIndex] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_vehicle_index() -> VehicleIndex:
+    """Процессный индекс (загружается с диска при первом обращении)."""
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                _INDEX = VehicleIndex()
+                atexit.register(_INDEX.flush)
+    return _INDEX
@@ -14,7 +14,9 @@ from ..config import (
     USER_CREDS_DIR,
     USER_META_DIR,
 )
+from ..infra.jwt_claims import token_expiry
 from ..infra.login_token import login_with_credentials
+from ..infra.otbivka import invalidate_token_cache
 from ..utils.logging import log_print
 from ..services.access_control import is_allowed
 
@@ -91,6 +93,12 @@ def _user_cookies_path(user_id: int) -> Path:
     return Path(USER_COOKIES_DIR) / f"{user_id}_cookies.txt"
 
 
+def token_expires_at(user_id: int) -> Optional[float]:
+    """Когда истекает сохранённый токен пользователя (unix time) или None, если срок неизвестен."""
+    tok = _load_saved_token(user_id)
+    return token_expiry(tok) if tok else None
+
+
 def _load_saved_token(user_id: int) -> Optional[str]:
     token_file = _user_token_path(user_id)
     if token_file.exists():
@@ -121,6 +129,7 @@ def _save_user_session(user_id: int, username: str, password: Optional[str], tok
         Path(token_path).write_text(token, encoding="utf-8")
     except Exception as e:
         log_print(logger, f"Не удалось записать токен в {token_path}: {e}", "ERROR")
+    invalidate_token_cache(token_path)
 
 
 def _try_autologin(user_id: int) -> Optional[str]:
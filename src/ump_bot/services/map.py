@@ -5,13 +5,12 @@ import os
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
-import requests
 from telegram import InputFile, Update
 from telegram.error import NetworkError, TimedOut
 
-from ..config import CACHE_DIR
-from ..infra.otbivka import get_position_and_check
-from ..infra.render_map import render_parks_with_vehicles
+from ..config import MAP_CACHE_DIR
+from ..infra.render_map import render_parks_streaming
+from ..infra.ump_client import stream_positions
 from ..services import auth
 from ..utils.logging import log_print
 from .vehicles import build_color_map_from_sections, deduplicate_numbers
@@ -29,7 +28,7 @@ async def render_map_with_numbers(
     out_dir: str = "out",
     max_image_size: int = 10 * 1024 * 1024,
     tile_provider: str = "",
-    tile_cache: str = CACHE_DIR,
+    tile_cache: str = MAP_CACHE_DIR,
     tile_user_agent: str = "",
     tile_referer: str = "",
     tile_apikey: str = "",
@@ -66,38 +65,19 @@ async def render_map_with_numbers(
             log_print(logger, f"  {cat}: {nums[:3]}... (всего {len(nums)})")
 
     try:
-        sample_results = []
-        for dep in depot_numbers[:5]:
-            try:
-                result = await asyncio.to_thread(get_position_and_check, dep, token_path=token_path)
-                sample_results.append(result)
-                log_print(
-                    logger,
-                    f"ТС {dep}: ok={result.get('ok')}, park={result.get('park_name')}, in_park={result.get('in_park')}",
-                )
-            except requests.HTTPError as e:
-                if e.response is not None and e.response.status_code == 401:
-                    # пробуем обновить токен по сохранённым учётным данным
-                    new_path = auth.refresh_session(update.effective_user.id)
-                    if new_path:
-                        token_path = new_path
-                        try:
-                            result = await asyncio.to_thread(get_position_and_check, dep, token_path=token_path)
-                            sample_results.append(result)
-                            continue
-                        except Exception:
-                            pass
-                    await update.message.reply_text("❌ Сессия UMP истекла. Введите /login для повторной авторизации.")
-                    return
-                log_print(logger, f"HTTP error проверки ТС {dep}: {e}", "ERROR")
-            except Exception as e:
-                log_print(logger, f"Ошибка проверки ТС {dep}: {e}", "ERROR")
-
+        user_id = update.effective_user.id
+        # Позиции запрашиваются один раз, потоком: подложки парков готовятся,
+        # пока идут запросы по остальным ТС. При 401 сессия обновляется внутри пакета.
+        stream = stream_positions(
+            depot_numbers,
+            token_path=token_path,
+            reauth=lambda: auth.refresh_session(user_id),
+        )
         # Ограничиваем параллельный рендер карт, чтобы не "забить" CPU/пулы потоков и не зависать на апдейтах.
         async with _MAP_RENDER_SEM:
-            files = await asyncio.to_thread(
-                render_parks_with_vehicles,
-                depot_numbers=depot_numbers,
+            files, results = await render_parks_streaming(
+                stream,
+                park_filter=selected_park,
                 out_dir=out_dir,
                 size="1200x800",
                 use_real_map=True,
@@ -108,18 +88,25 @@ async def render_map_with_numbers(
                 tile_referer=tile_referer,
                 tile_apikey=tile_apikey,
                 tile_rate_tps=tile_rate_tps,
-                park_filter=selected_park,
                 color_map=color_map,
                 debug=True,
-                auth_token_path=token_path,
+            )
+
+        for r in results[:5]:
+            log_print(
+                logger,
+                f"ТС {r.get('depot_number')}: ok={r.get('ok')}, park={r.get('park_name')}, in_park={r.get('in_park')}",
             )
 
         if not files:
+            if any(r.get("status") == 401 for r in results):
+                await update.message.reply_text("❌ Сессия UMP истекла. Введите /login для повторной авторизации.")
+                return
             debug_info = f"Обработано ТС: {len(depot_numbers)}\n"
             debug_info += f"Парк: {selected_park or 'все'}\n"
-            if sample_results:
+            if results:
                 debug_info += "\nПримеры:\n"
-                for r in sample_results:
+                for r in results[:5]:
                     if r.get("ok"):
                         status = "✅ в парке" if r.get("in_park") else "❌ вне парка"
                         debug_info += f"  {r.get('depot_number')}: {status} ({r.get('park_name') or '—'})\n"
@@ -0,0 +1,202 @@
+"""
+Фоновое обновление токенов UMP (включается TOKEN_REFRESH_ENABLED).
+
+Раз в TOKEN_REFRESH_INTERVAL_SEC проверяются сроки (поле exp JWT) токенов
+пользователей из USER_TOKEN_DIR и токена из env. Токен, который истечёт в
+ближайшие TOKEN_REFRESH_LEAD_SEC (или уже истёк), обновляется повторным логином
+по сохранённым учётным данным — запросы пользователей не ждут логина на 401.
+Срок из файла читается заново, только когда файл изменился. После неудачного
+логина аккаунт пропускается несколько циклов, чтобы не долбить UMP; так же —
+после логина, если новый токен сам истекает в пределах TOKEN_REFRESH_LEAD_SEC.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ..config import (
+    TOKEN_REFRESH_ENABLED,
+    TOKEN_REFRESH_INTERVAL_SEC,
+    TOKEN_REFRESH_LEAD_SEC,
+    UMP_PASS,
+    UMP_TOKEN_FILE,
+    UMP_USER,
+    USER_TOKEN_DIR,
+)
+from ..infra import otbivka
+from ..infra.jwt_claims import token_expiry
+from . import auth
+
+logger = logging.getLogger("ump_bot")
+
+_USER_TOKEN_RE = re.compile(r"^(\d+)_token\.txt$")
+# сколько циклов пропускать аккаунт после неудачного логина
+_FAILURE_BACKOFF_CYCLES = 5
+# не чаще одного перелогина аккаунта за столько циклов, если UMP выдаёт токены
+# короче TOKEN_REFRESH_LEAD_SEC (иначе логин шёл бы каждый цикл)
+_MIN_RELOGIN_CYCLES = 5
+
+# (user_id или None для токена из env, путь к файлу токена, exp)
+_Due = Tuple[Optional[int], str, float]
+
+
+class TokenRefresher:
+    def __init__(
+        self,
+        interval_sec: float = TOKEN_REFRESH_INTERVAL_SEC,
+        lead_sec: float = TOKEN_REFRESH_LEAD_SEC,
+    ):
+        self.interval_sec = max(1.0, float(interval_sec))
+        self.lead_sec = max(0.0, float(lead_sec))
+        self._lock = threading.Lock()
+        # путь -> ((st_mtime_ns, st_size), exp)
+        self._expiry: Dict[str, Tuple[Tuple[int, int], Optional[float]]] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.cycles = 0
+        self.refreshed = 0
+        self.failures = 0
+
+    def _file_expiry(self, path: str) -> Optional[float]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        sig = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._expiry.get(path)
+        if cached and cached[0] == sig:
+            return cached[1]
+        try:
+            exp = token_expiry(Path(path).read_text(encoding="utf-8").strip())
+        except OSError:
+            return None
+        with self._lock:
+            self._expiry[path] = (sig, exp)
+        return exp
+
+    def _accounts(self) -> List[Tuple[Optional[int], str]]:
+        accounts: List[Tuple[Optional[int], str]] = []
+        try:
+            names = os.listdir(USER_TOKEN_DIR)
+        except OSError:
+            names = []
+        for name in names:
+            m = _USER_TOKEN_RE.match(name)
+            if m:
+                accounts.append((int(m.group(1)), os.path.join(USER_TOKEN_DIR, name)))
+        if otbivka._auto_login and UMP_USER and UMP_PASS:
+            accounts.append((None, UMP_TOKEN_FILE))
+        return accounts
+
+    def due(self, now: Optional[float] = None) -> List[_Due]:
+        """Токены, которые истекают в пределах lead_sec, — ближайшие первыми."""
+        now = time.time() if now is None else now
+        out: List[_Due] = []
+        for user_id, path in self._accounts():
+            if self._retry_at.get(path, 0.0) > now:
+                continue
+            exp = self._file_expiry(path)
+            if exp is None or exp - now > self.lead_sec:
+                continue
+            out.append((user_id, path, exp))
+        out.sort(key=lambda d: d[2])
+        return out
+
+    def _next_attempt_after_refresh(self, path: str, now: float) -> Optional[float]:
+        """
+        Когда снова можно перелогинить аккаунт после успешного логина: None — без
+        ограничений (новый токен живёт дольше lead_sec). Короткий токен — не раньше
+        середины его срока и не раньше чем через _MIN_RELOGIN_CYCLES циклов.
+        """
+        exp = self._file_expiry(path)
+        if exp is not None and exp - now > self.lead_sec:
+            return None
+        earliest = now + self.interval_sec * _MIN_RELOGIN_CYCLES
+        if exp is None:
+            return earliest
+        return max(earliest, now + (exp - now) / 2)
+
+    @staticmethod
+    def _refresh(user_id: Optional[int]) -> bool:
+        if user_id is None:
+            otbivka._relogin()
+            return True
+        if not auth._load_user_creds(user_id):
+            return False
+        return auth.refresh_session(user_id) is not None
+
+    async def refresh_once(self) -> int:
+        """Один цикл проверки; возвращает число обновлённых токенов."""
+        ok = 0
+        for user_id, path, exp in self.due():
+            try:
+                refreshed = await asyncio.to_thread(self._refresh, user_id)
+            except Exception as e:
+                logger.warning("Фоновое обновление токена %s: %s", path, e)
+                refreshed = False
+            if refreshed:
+                ok += 1
+                now = time.time()
+                retry_at = self._next_attempt_after_refresh(path, now)
+                if retry_at is None:
+                    self._retry_at.pop(path, None)
+                else:
+                    self._retry_at[path] = retry_at
+                    logger.warning(
+                        "Новый токен %s истекает в пределах %.0f с — следующий логин не раньше чем через %.0f с",
+                        path, self.lead_sec, retry_at - now,
+                    )
+            else:
+                self.failures += 1
+                self._retry_at[path] = time.time() + self.interval_sec * _FAILURE_BACKOFF_CYCLES
+        self.cycles += 1
+        self.refreshed += ok
+        return ok
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning("Фоновое обновление токенов: ошибка цикла: %s", e)
+            await asyncio.sleep(self.interval_sec)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": TOKEN_REFRESH_ENABLED,
+            "running": self._task is not None and not self._task.done(),
+            "cycles": self.cycles,
+            "refreshed": self.refreshed,
+            "failures": self.failures,
+        }
+
+
+_REFRESHER = TokenRefresher()
+
+
+def get_token_refresher() -> TokenRefresher:
+    return _REFRESHER
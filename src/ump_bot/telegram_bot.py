@@ -12,12 +12,17 @@ from telegram.ext import (
 )
 from telegram.request import HTTPXRequest
 
-from .config import LOG_LEVEL
+from .config import HOT_POLL_ENABLED, LOG_LEVEL, TOKEN_REFRESH_ENABLED
 from .infra.login_token import login_with_credentials
 from .infra.otbivka import get_position_and_check
+from .infra.hot_vehicles import get_hot_poller
+from .infra.sessions import get_session_manager
+from .infra.ump_client import close_ump_client
+from .infra.vehicle_index import get_vehicle_index
 from .infra.render_map import render_parks_with_vehicles
 from .services import auth
 from .services.settings import BOT_TOKEN
+from .services.token_refresh import get_token_refresher
 from .handlers import start as start_handlers
 from .handlers import map as map_handlers
 from .handlers import status as status_handlers
@@ -73,6 +78,9 @@ def main() -> None:
         log_print(logger, "TELEGRAM_BOT_TOKEN не установлен в .env", "ERROR")
         return
 
+    # индекс depot_number -> vehicle_id поднимаем с диска заранее, а не на первом /map
+    log_print(logger, f"Индекс ТС загружен: {len(get_vehicle_index())} записей")
+
     # Telegram API: увеличиваем таймауты (особенно write_timeout для upload фото),
     # иначе на медленном канале отправка изображений может падать с "Timed out".
     connect_timeout = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "10"))
@@ -86,11 +94,28 @@ def main() -> None:
         pool_timeout=pool_timeout,
     )
 
+    async def _on_startup(app: Application) -> None:
+        # JobQueue требует extra-зависимость (APScheduler) — опрос идёт отдельной asyncio-задачей
+        if HOT_POLL_ENABLED:
+            get_hot_poller().start()
+            log_print(logger, "Фоновый опрос горячих ТС включён")
+        if TOKEN_REFRESH_ENABLED:
+            get_token_refresher().start()
+
+    async def _on_shutdown(app: Application) -> None:
+        await get_hot_poller().stop()
+        await get_token_refresher().stop()
+        # закрываем keep-alive соединения асинхронного клиента UMP и сессий аккаунтов
+        await close_ump_client()
+        get_session_manager().close_all()
+
     application = (
         Application.builder()
         .token(BOT_TOKEN)
         .request(request)
         .concurrent_updates(8)
+        .post_init(_on_startup)
+        .post_shutdown(_on_shutdown)
         .build()
     )
 
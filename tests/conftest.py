@@ -0,0 +1,69 @@
+"""Общие фикстуры тестов клиента UMP (синхронного и асинхронного)"""
+
+import pytest
+
+from src.ump_bot.infra import otbivka
+
+
+@pytest.fixture(autouse=True)
+def no_auto_login(monkeypatch):
+    """Отключаем авто-логин, чтобы тесты не лезли в сеть."""
+    monkeypatch.setattr(otbivka, "_auto_login", None)
+
+
+@pytest.fixture(autouse=True)
+def closed_breaker():
+    """Предохранитель UMP общий на процесс — каждый тест начинает с замкнутого."""
+    from src.ump_bot.infra.circuit_breaker import get_ump_breaker
+
+    get_ump_breaker().reset()
+    yield
+    get_ump_breaker().reset()
+
+
+@pytest.fixture(autouse=True)
+def fresh_retry_budget(monkeypatch):
+    """Бюджет повторов тоже общий — изолируем тесты друг от друга."""
+    from src.ump_bot.infra.retry import RetryBudget, get_ump_retry_policy
+
+    monkeypatch.setattr(get_ump_retry_policy(), "budget", RetryBudget())
+
+
+class FakeRegistry:
+    """Реестр без парков: геофенсинг ничего не находит."""
+
+    def geometries(self):
+        return []
+
+    def grid(self):
+        from src.ump_bot.infra.park_grid import ParkGrid
+
+        return ParkGrid([])
+
+
+@pytest.fixture
+def fake_registry(monkeypatch):
+    registry = FakeRegistry()
+    monkeypatch.setattr(otbivka, "get_park_registry", lambda: registry)
+    return registry
+
+
+@pytest.fixture
+def fake_ump(monkeypatch, tmp_path, fake_registry):
+    """
+    Асинхронный клиент без диска и файла токена: индекс ТС во временном каталоге,
+    позиции только в памяти, заголовки с фиксированным токеном.
+    Возвращает индекс; отдельные заглушки тест может переопределить.
+    """
+    from src.ump_bot.infra import ump_client
+    from src.ump_bot.infra.vehicle_index import VehicleIndex
+
+    index = VehicleIndex(path=str(tmp_path / "idx.json"), ttl_sec=3600)
+    monkeypatch.setattr(ump_client, "get_vehicle_index", lambda: index)
+    monkeypatch.setattr(otbivka, "_warm_position_cache", lambda vids: None)
+    monkeypatch.setattr(otbivka, "_load_cached_position", lambda vid, max_age=None: None)
+    monkeypatch.setattr(otbivka, "_auth_headers", lambda **kw: {"auth": "t"})
+    monkeypatch.setattr(otbivka._POSITIONS, "_persist", None)
+    otbivka._POSITIONS.clear()
+    yield index
+    otbivka._POSITIONS.clear()
@@ -44,6 +44,10 @@ def reset_state(monkeypatch, tmp_path):
     yield
 
 
+def run(coro):
+    return asyncio.run(coro)
+
+
 def test_token_file_valid(tmp_path):
     ok_file = tmp_path / "tok.txt"
     ok_file.write_text("abc", encoding="utf-8")
@@ -104,42 +108,140 @@ async def test_login_flow_saves_token(monkeypatch, tmp_path):
     assert "UMP-аккаунт подключен" in update_pass.message.replies[-1]
 
 
-@pytest.mark.asyncio
-async def test_render_map_uses_token_path(monkeypatch, tmp_path):
-    called = {}
-
-    async def fake_reply_text(self, text, **kwargs):
-        self.replies.append(text)
-
-    DummyMessage.reply_text = fake_reply_text
+def test_render_map_fetches_positions_once_with_token_path(monkeypatch, tmp_path):
+    called = {"stream": 0}
 
-    def fake_get_position(dep, token_path=None, **kwargs):
+    async def fake_stream_positions(depot_numbers, token_path=None, reauth=None, **kwargs):
+        called["stream"] += 1
         called["token_path"] = token_path
-        return {"ok": True, "depot_number": dep, "in_park": True, "park_name": "X"}
+        called["reauth"] = reauth
+        for dep in depot_numbers:
+            yield {"ok": True, "depot_number": dep, "in_park": False, "park_name": None}
 
-    def fake_render_parks_with_vehicles(depot_numbers, auth_token_path=None, **kwargs):
-        called["render_token_path"] = auth_token_path
-        return []
+    async def fake_render_parks_streaming(results, park_filter=None, **kwargs):
+        return [], [r async for r in results]
 
-    monkeypatch.setattr(telegram_bot, "get_position_and_check", fake_get_position)
-    monkeypatch.setattr(telegram_bot, "render_parks_with_vehicles", fake_render_parks_with_vehicles)
+    monkeypatch.setattr(map_service, "stream_positions", fake_stream_positions)
+    monkeypatch.setattr(map_service, "render_parks_streaming", fake_render_parks_streaming)
+    monkeypatch.setattr(auth, "refresh_session", lambda user_id: f"renewed-{user_id}")
 
-    user_id = 7
     token_path = tmp_path / "tok.txt"
     token_path.write_text("tok", encoding="utf-8")
 
-    update = DummyUpdate(user_id=user_id, text="")
-    await map_service.render_map_with_numbers(
-        logger=telegram_bot.logger,
-        update=update,
-        depot_numbers=["1234"],
-        selected_park=None,
-        sections=None,
-        token_path=str(token_path),
+    update = DummyUpdate(user_id=7, text="")
+    run(
+        map_service.render_map_with_numbers(
+            logger=telegram_bot.logger,
+            update=update,
+            depot_numbers=["1234", "5678"],
+            selected_park=None,
+            sections=None,
+            token_path=str(token_path),
+        )
     )
 
+    assert called["stream"] == 1  # без отдельных «пробных» запросов
     assert called["token_path"] == str(token_path)
-    assert called["render_token_path"] == str(token_path)
-    assert any("Нет ТС" in r for r in update.message.replies)
+    assert called["reauth"]() == "renewed-7"
+    assert any("Нет ТС" in r and "1234: ❌ вне парка" in r for r in update.message.replies)
+
+
+def test_render_map_reports_expired_session(monkeypatch, tmp_path):
+    async def fake_stream_positions(depot_numbers, **kwargs):
+        for dep in depot_numbers:
+            yield {"ok": False, "depot_number": dep, "error": "http_error", "status": 401}
+
+    async def fake_render_parks_streaming(results, park_filter=None, **kwargs):
+        return [], [r async for r in results]
+
+    monkeypatch.setattr(map_service, "stream_positions", fake_stream_positions)
+    monkeypatch.setattr(map_service, "render_parks_streaming", fake_render_parks_streaming)
+
+    update = DummyUpdate(user_id=7, text="")
+    run(
+        map_service.render_map_with_numbers(
+            logger=telegram_bot.logger,
+            update=update,
+            depot_numbers=["1234"],
+            selected_park=None,
+            token_path=str(tmp_path / "tok.txt"),
+        )
+    )
+
+    assert "Сессия UMP истекла" in update.message.replies[-1]
+
+
+def _jwt(payload):
+    import base64
+    import json
+
+    body = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+    return f"eyJhbGciOiJIUzI1NiJ9.{body}.sig"
+
 
+def test_token_refresher_renews_tokens_before_expiry(monkeypatch, tmp_path):
+    import time
 
+    from src.ump_bot.infra.jwt_claims import token_expiry
+    from src.ump_bot.services import token_refresh
+
+    now = time.time()
+    assert token_expiry(_jwt({"userId": 1, "exp": 1700000000})) == 1700000000.0
+    assert token_expiry(_jwt({"userId": 1})) is None
+    assert token_expiry("invalid") is None
+
+    token_dir = Path(auth.USER_TOKEN_DIR)
+    (token_dir / "1_token.txt").write_text(_jwt({"exp": now + 60}), encoding="utf-8")  # скоро истечёт
+    (token_dir / "2_token.txt").write_text(_jwt({"exp": now + 86400}), encoding="utf-8")
+    (token_dir / "3_token.txt").write_text(_jwt({"exp": now - 10}), encoding="utf-8")  # истёк, кредов нет
+    monkeypatch.setattr(token_refresh, "USER_TOKEN_DIR", str(token_dir))
+    monkeypatch.setattr(token_refresh.otbivka, "_auto_login", None)
+    monkeypatch.setattr(auth, "_load_user_creds", lambda uid: {"username": "u", "password": "p"} if uid != 3 else None)
+
+    refreshed = []
+
+    def fake_refresh(user_id):
+        refreshed.append(user_id)
+        (token_dir / f"{user_id}_token.txt").write_text(_jwt({"exp": time.time() + 3600, "n": 2}), encoding="utf-8")
+        return str(token_dir / f"{user_id}_token.txt")
+
+    monkeypatch.setattr(auth, "refresh_session", fake_refresh)
+
+    refresher = token_refresh.TokenRefresher(interval_sec=60, lead_sec=300)
+    assert [d[0] for d in refresher.due()] == [3, 1]  # ближайший срок первым
+    assert run(refresher.refresh_once()) == 1
+    assert refreshed == [1]
+    # новый токен подхвачен по изменению файла; аккаунт без кредов отложен
+    assert refresher.due() == []
+    assert refresher.stats()["failures"] == 1
+
+
+def test_token_refresher_backs_off_when_new_token_is_short_lived(monkeypatch, tmp_path):
+    import time
+
+    from src.ump_bot.services import token_refresh
+
+    token_dir = Path(auth.USER_TOKEN_DIR)
+    (token_dir / "1_token.txt").write_text(_jwt({"exp": time.time() + 60}), encoding="utf-8")
+    monkeypatch.setattr(token_refresh, "USER_TOKEN_DIR", str(token_dir))
+    monkeypatch.setattr(token_refresh.otbivka, "_auto_login", None)
+    monkeypatch.setattr(auth, "_load_user_creds", lambda uid: {"username": "u", "password": "p"})
+    logins = []
+
+    def fake_refresh(user_id):
+        logins.append(user_id)
+        # сервер снова выдаёт токен, истекающий в пределах lead_sec
+        (token_dir / "1_token.txt").write_text(_jwt({"exp": time.time() + 120, "n": len(logins)}), encoding="utf-8")
+        return str(token_dir / "1_token.txt")
+
+    monkeypatch.setattr(auth, "refresh_session", fake_refresh)
+
+    refresher = token_refresh.TokenRefresher(interval_sec=60, lead_sec=600)
+    for _ in range(4):
+        run(refresher.refresh_once())
+    assert logins == [1]  # не перелогиниваемся каждый цикл
+    assert refresher.stats()["failures"] == 0
+
+    # пауза прошла — токен снова обновляется
+    later = time.time() + 60 * token_refresh._MIN_RELOGIN_CYCLES + 1
+    assert [d[0] for d in refresher.due(now=later)] == [1]
@@ -28,7 +28,7 @@ class DummyUpdate:
 
 
 def run(coro):
-    return asyncio.get_event_loop().run_until_complete(coro)
+    return asyncio.run(coro)
 
 
 def test_map_smoke(monkeypatch):
@@ -59,7 +59,7 @@ def test_status_smoke(monkeypatch):
     async def fake_auth(update):
         return "tok"
 
-    def fake_get_position(dep, token_path=None, **kwargs):
+    async def fake_get_position(dep, token_path=None, **kwargs):
         return {
             "ok": True,
             "depot_number": dep,
@@ -84,7 +84,7 @@ def test_fetch_branch_diagnostics(monkeypatch):
             captured["timeout"] = timeout
             return DummyResponse()
 
-    monkeypatch.setattr(diagnostic, "_session", lambda: DummySession())
+    monkeypatch.setattr(diagnostic, "_session", lambda **kw: DummySession())
     monkeypatch.setattr(diagnostic, "_auth_headers", lambda **kwargs: {"auth": "token"})
 
     monkeypatch.setattr(diagnostic, "UMP_USER_ID", 10, raising=False)
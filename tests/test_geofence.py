@@ -0,0 +1,99 @@
+"""Тесты пакетного геофенсинга: совпадение со скалярными функциями"""
+
+import random
+
+import pytest
+
+from src.ump_bot.infra import geofence
+from src.ump_bot.infra.park_registry import build_geometry
+
+# невыпуклый полигон (буква «П») и прямоугольник рядом
+_POLY_U = [(30.0, 60.0), (30.02, 60.0), (30.02, 60.02), (30.015, 60.02),
+           (30.015, 60.005), (30.005, 60.005), (30.005, 60.02), (30.0, 60.02)]
+_POLY_RECT = [(30.03, 60.0), (30.05, 60.0), (30.05, 60.01), (30.03, 60.01)]
+
+
+def _points(n=3000, seed=7):
+    rnd = random.Random(seed)
+    lons = [rnd.uniform(29.99, 30.06) for _ in range(n)]
+    lats = [rnd.uniform(59.99, 60.03) for _ in range(n)]
+    # точки на границах и вершинах
+    for x, y in _POLY_U + _POLY_RECT:
+        lons.append(x); lats.append(y)
+    return lons, lats
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(geofence, "np", None)
+    elif geofence.np is None:
+        pytest.skip("numpy не установлен")
+    return request.param
+
+
+def test_batch_matches_scalar(backend):
+    lons, lats = _points()
+    for poly in (_POLY_U, _POLY_RECT):
+        assert geofence.points_in_polygon(lons, lats, poly) == [
+            geofence.point_in_polygon(x, y, poly) for x, y in zip(lons, lats)
+        ]
+        assert geofence.points_in_polygon_with_tolerance(lons, lats, poly, 150.0) == [
+            geofence.point_in_polygon_with_tolerance(x, y, poly, 150.0) for x, y in zip(lons, lats)
+        ]
+        assert geofence.distances_to_polygon_m(lons, lats, poly) == [
+            geofence.distance_to_polygon_m(x, y, poly) for x, y in zip(lons, lats)
+        ]
+
+
+def test_classify_points_matches_classify_point(backend):
+    geoms = [
+        build_geometry({"name": "U", "polygon": _POLY_U, "tolerance_m": 50.0}),
+        build_geometry({"name": "R", "polygon": _POLY_RECT, "tolerance_m": 0.0}),
+    ]
+    lons, lats = _points()
+    for grace in (0.0, 120.0):
+        expected = [geofence.classify_point(x, y, geoms, grace) for x, y in zip(lons, lats)]
+        assert geofence.classify_points(lons, lats, geoms, grace) == expected
+        assert {"U", "R", None} <= set(expected)
+    assert geofence.classify_points([], [], geoms) == []
+
+
+def test_grid_candidates_give_same_answers(backend):
+    from src.ump_bot.infra.park_grid import ParkGrid
+
+    # сеть из 60 депо ~300x200 м
+    geoms = []
+    for i in range(60):
+        x0, y0 = 30.0 + (i % 10) * 0.013, 60.0 + (i // 10) * 0.009
+        poly = [(x0, y0), (x0 + 0.005, y0), (x0 + 0.005, y0 + 0.002), (x0, y0 + 0.002)]
+        geoms.append(build_geometry({"name": f"P{i}", "polygon": poly, "tolerance_m": 10.0}))
+    grid = ParkGrid(geoms, margin_m=30.0)
+    rnd = random.Random(3)
+    lons = [rnd.uniform(29.995, 30.135) for _ in range(3000)]
+    lats = [rnd.uniform(59.995, 60.06) for _ in range(3000)]
+
+    assert len(grid.candidates(30.0025, 60.001)) < 5
+    for grace in (0.0, 30.0, 500.0):  # 500 м > margin_m — анти-флап по всем паркам
+        expected = [geofence.classify_point(x, y, geoms, grace) for x, y in zip(lons, lats)]
+        assert any(expected)
+        assert [geofence.classify_point(x, y, geoms, grace, grid=grid) for x, y in zip(lons, lats)] == expected
+        assert geofence.classify_points(lons, lats, geoms, grace, grid=grid) == expected
+
+
+def test_distances_use_precomputed_park_edges(backend):
+    import dataclasses
+
+    g = build_geometry({"name": "U", "polygon": _POLY_U, "tolerance_m": 50.0})
+    lons, lats = _points(n=300)
+    assert [geofence.distance_to_polygon_m(x, y, g.polygon, g.edges) for x, y in zip(lons, lats)] == [
+        geofence.distance_to_polygon_m(x, y, _POLY_U) for x, y in zip(lons, lats)
+    ]
+
+    # снаружи, но в пределах tolerance_m: решают только рёбра геометрии
+    x, y = 30.02 + 20 / g.lon_m, 60.01
+    assert geofence.classify_point(x, y, [g]) == "U"
+    assert geofence.classify_points([x], [y], [g]) == ["U"]
+    bare = dataclasses.replace(g, edges=())
+    assert geofence.classify_point(x, y, [bare]) is None
+    assert geofence.classify_points([x], [y], [bare]) == [None]
@@ -0,0 +1,44 @@
+"""Тесты фонового опроса «горячих» ТС"""
+
+from src.ump_bot.infra import otbivka
+
+
+def test_hot_poller_refreshes_expiring_vehicles_within_budget(monkeypatch, tmp_path):
+    import asyncio
+    import time
+
+    from src.ump_bot.infra import hot_vehicles, ump_client
+    from src.ump_bot.infra.vehicle_index import VehicleIndex
+
+    index = VehicleIndex(path=str(tmp_path / "idx.json"), ttl_sec=3600)
+    for i, dep in enumerate(["1001", "1002", "1003", "1004"]):
+        index.put(dep, 100 + i)
+    monkeypatch.setattr("src.ump_bot.infra.vehicle_index.get_vehicle_index", lambda: index)
+    monkeypatch.setattr(otbivka._POSITIONS, "_persist", None)
+    otbivka._POSITIONS.clear()
+    now = time.time()
+    otbivka._POSITIONS.put(100, {"ts": now - 5}, persist=False)  # свежая — не трогаем
+    otbivka._POSITIONS.put(101, {"ts": now - 100}, persist=False)  # истечёт до следующего цикла
+    otbivka._POSITIONS.put(102, {"ts": now - 110}, persist=False)
+
+    calls = []
+
+    class FakeClient:
+        async def batch_get_positions(self, deps, token_path=None, refresh=False):
+            calls.append((sorted(deps), token_path, refresh))
+            return [{"ok": True, "depot_number": d} for d in deps]
+
+    monkeypatch.setattr(ump_client, "get_ump_client", lambda: FakeClient())
+    monkeypatch.setattr(hot_vehicles, "CACHE_TTL_SEC", 120)
+
+    poller = hot_vehicles.HotVehiclePoller(interval_sec=60, max_per_cycle=3, hot_ttl_sec=3600, max_vehicles=10)
+    poller.touch(["1001", "1002", "1003"], token_path="user-a")
+    poller.touch(["1004", "9999"])  # 9999 не в индексе — тоже разрешится в цикле
+
+    # без позиции — первыми, затем самые старые; в бюджет 3 попадают 9999, 1004 и 1003
+    assert [dep for dep, _ in poller.due()] in (["1004", "9999", "1003"], ["9999", "1004", "1003"])
+
+    assert asyncio.run(poller.poll_once()) == 3
+    assert sorted(calls) == [(["1003"], "user-a", True), (["1004", "9999"], None, True)]
+    assert poller.stats()["refreshed"] == 3
+    otbivka._POSITIONS.clear()
@@ -1,16 +1,11 @@
 """Тесты для функций из otbivka.py"""
 
 import pytest
+import requests
 
 from src.ump_bot.infra import otbivka
 
 
-@pytest.fixture(autouse=True)
-def no_auto_login(monkeypatch):
-    """Отключаем авто-логин, чтобы тесты не лезли в сеть."""
-    monkeypatch.setattr(otbivka, "_auto_login", None)
-
-
 def test_load_token_reads_existing_file(monkeypatch, tmp_path):
     """_load_token должен возвращать содержимое файла токена."""
     token_file = tmp_path / "token.txt"
@@ -69,3 +64,531 @@ def test_load_token_missing_file_raises(tmp_path, monkeypatch):
     with pytest.raises(FileNotFoundError):
         otbivka._load_token()
 
+
+def test_batch_get_positions_keeps_order_and_runs_in_parallel(monkeypatch):
+    """batch_get_positions сохраняет порядок и не выполняет запросы последовательно."""
+    import threading
+    import time
+
+    delays = {"1001": 0.2, "1002": 0.05, "1003": 0.1}
+    active = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def fake_get_position(dep, token=None, token_path=None, timeout=None, **kw):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        time.sleep(delays[dep])
+        with lock:
+            active["now"] -= 1
+        if dep == "1003":
+            raise RuntimeError("boom")
+        return {"ok": True, "depot_number": dep}, None
+
+    monkeypatch.setattr(otbivka, "_fetch_position", fake_get_position)
+
+    results = otbivka.batch_get_positions(["1001", "1002", "1003"], max_workers=3)
+
+    assert [r["depot_number"] for r in results] == ["1001", "1002", "1003"]
+    assert results[2] == {"ok": False, "depot_number": "1003", "error": "exception", "detail": "boom"}
+    assert active["max"] > 1
+
+
+def test_batch_get_positions_respects_max_workers(monkeypatch):
+    import threading
+
+    seen = set()
+
+    def fake_get_position(dep, token=None, token_path=None, timeout=None, **kw):
+        seen.add(threading.get_ident())
+        return {"ok": True, "depot_number": dep, "timeout": timeout}, None
+
+    monkeypatch.setattr(otbivka, "_fetch_position", fake_get_position)
+
+    results = otbivka.batch_get_positions(["1", "2", "3"], max_workers=1, call_timeout=1.5)
+
+    assert seen == {threading.get_ident()}
+    assert all(r["timeout"] == 1.5 for r in results)
+
+
+class _FakeResponse:
+    def __init__(self, status_code=200, payload=None):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.headers = {"Content-Type": "application/json"}
+        self.text = ""
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            import requests
+
+            raise requests.HTTPError(response=self)
+
+    def json(self):
+        return self._payload
+
+
+def test_vehicle_index_persists_and_expires(tmp_path):
+    from src.ump_bot.infra.vehicle_index import VehicleIndex
+
+    path = tmp_path / "vehicle_index.json"
+    index = VehicleIndex(path=str(path), ttl_sec=3600)
+    index.put("6569", 123)
+    index.flush()
+
+    assert VehicleIndex(path=str(path), ttl_sec=3600).get("6569") == 123
+    assert VehicleIndex(path=str(path), ttl_sec=-1).get("6569") is None
+
+    index.invalidate("6569")
+    index.flush()
+    assert VehicleIndex(path=str(path), ttl_sec=3600).get("6569") is None
+
+
+def test_vehicle_index_concurrent_flushes_keep_file_valid(tmp_path):
+    import json
+    import threading
+
+    from src.ump_bot.infra.vehicle_index import VehicleIndex
+
+    path = tmp_path / "vehicle_index.json"
+    index = VehicleIndex(path=str(path), ttl_sec=3600)
+
+    def worker(i):
+        for j in range(20):
+            index.put(str(i * 100 + j), i * 100 + j)
+            index.flush()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    index.flush()
+
+    # последний снимок на диске — полный, временных файлов не осталось
+    assert len(json.loads(path.read_text(encoding="utf-8"))["items"]) == 160
+    assert [p.name for p in tmp_path.iterdir()] == ["vehicle_index.json"]
+
+
+def test_get_position_uses_index_and_reresolves_on_404(monkeypatch, tmp_path, fake_registry):
+    from src.ump_bot.infra.vehicle_index import VehicleIndex
+
+    index = VehicleIndex(path=str(tmp_path / "idx.json"), ttl_sec=3600)
+    index.put("6569", 1)
+    monkeypatch.setattr(otbivka, "get_vehicle_index", lambda: index)
+    monkeypatch.setattr(otbivka, "_auth_headers", lambda **kw: {})
+    monkeypatch.setattr(otbivka, "_save_cached_position", lambda *a, **kw: None)
+
+    calls = []
+
+    class FakeSession:
+        def post(self, url, params=None, **kw):
+            calls.append(("resolve", params["number"]))
+            return _FakeResponse(payload=[{"depotNumber": "6569", "id": 2}])
+
+        def get(self, url, **kw):
+            calls.append(("online", url.rsplit("/", 1)[-1]))
+            if url.endswith("/1"):
+                return _FakeResponse(status_code=404)
+            return _FakeResponse(payload={"center": "POINT(30.1 59.9)", "depotNumber": "6569"})
+
+    monkeypatch.setattr(otbivka, "_get_session", lambda **kw: FakeSession())
+    monkeypatch.setattr("time.sleep", lambda *_: None)
+
+    res = otbivka.get_position_and_check("6569")
+
+    assert res["ok"] and res["vehicle_id"] == 2
+    # 404 не повторяется: сразу переразрешение
+    assert calls == [("online", "1"), ("resolve", "6569"), ("online", "2")]
+    assert index.get("6569") == 2
+
+    calls.clear()
+    otbivka.get_position_and_check("6569")
+    assert calls == [("online", "2")]
+
+
+def test_bulk_resolve_fills_index_with_one_call(monkeypatch, tmp_path):
+    from src.ump_bot.infra.vehicle_index import VehicleIndex
+
+    index = VehicleIndex(path=str(tmp_path / "idx.json"), ttl_sec=3600)
+    monkeypatch.setattr(otbivka, "get_vehicle_index", lambda: index)
+    monkeypatch.setattr(otbivka, "UMP_BULK_RESOLVE", True)
+    monkeypatch.setattr(otbivka, "UMP_BULK_REFRESH_SEC", 3600)
+
+    listing_calls = []
+
+    def fake_post_vehicles(params=None, **kw):
+        listing_calls.append(params)
+        return [{"depotNumber": str(1000 + i), "id": 5000 + i, "model": "ЛиАЗ"} for i in range(300)]
+
+    monkeypatch.setattr(otbivka, "_post_vehicles", fake_post_vehicles)
+    monkeypatch.setattr(otbivka, "_warm_position_cache", lambda vids: None)
+    monkeypatch.setattr(
+        otbivka,
+        "_fetch_position",
+        lambda dep, **kw: ({"ok": True, "depot_number": dep, "vehicle_id": index.get(dep)}, None),
+    )
+
+    deps = [str(1000 + i) for i in range(0, 300, 3)]
+    results = otbivka.batch_get_positions(deps)
+    otbivka.batch_get_positions(deps)
+
+    assert listing_calls == [None]
+    assert [r["vehicle_id"] for r in results] == [5000 + i for i in range(0, 300, 3)]
+    assert index.meta("1003")["model"] == "ЛиАЗ"
+
+
+def test_singleflight_shares_concurrent_calls():
+    import threading
+    import time
+
+    from src.ump_bot.infra.singleflight import SingleFlight
+
+    flight = SingleFlight()
+    calls = []
+    start = threading.Barrier(5)
+    results = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"lat": 1.0}
+
+    def worker():
+        start.wait()
+        results.append(flight.do(42, slow))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [{"lat": 1.0}] * 5
+    assert flight.stats() == {"calls": 1, "shared": 4, "in_flight": 0}
+
+    # после завершения ключ освобождается — следующий вызов идёт заново
+    flight.do(42, slow)
+    assert len(calls) == 2
+
+
+def test_async_singleflight_survives_cancelled_leader():
+    import asyncio
+
+    from src.ump_bot.infra.singleflight import AsyncSingleFlight
+
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"lat": 1.0}
+
+    async def main():
+        leader = asyncio.create_task(flight.do(42, slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do(42, slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # ждущий получает результат общего вызова, а не CancelledError
+        return await follower
+
+    assert asyncio.run(main()) == {"lat": 1.0}
+    assert len(calls) == 1
+    assert flight.stats() == {"calls": 1, "shared": 1, "in_flight": 0}
+
+
+def test_online_singleflight_is_per_account(monkeypatch):
+    import threading
+    import time
+
+    calls = []
+    start = threading.Barrier(4)
+
+    def fetch(vid, token=None, token_path=None, timeout=None):
+        calls.append(token)
+        time.sleep(0.1)
+        if token == "expired":
+            raise requests.HTTPError("401")
+        return {"vehicle_id": vid, "token": token}
+
+    monkeypatch.setattr(otbivka, "fetch_online_by_vehicle_id", fetch)
+    results = {}
+
+    def worker(i, token):
+        start.wait()
+        try:
+            results[i] = otbivka._fetch_online_shared(7, token=token)
+        except requests.HTTPError as e:
+            results[i] = e
+
+    tokens = ["a", "a", "expired", "b"]
+    threads = [threading.Thread(target=worker, args=(i, t)) for i, t in enumerate(tokens)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # один запрос на аккаунт; ошибка чужого аккаунта не достаётся остальным
+    assert sorted(calls) == ["a", "b", "expired"]
+    assert results[0]["token"] == results[1]["token"] == "a"
+    assert isinstance(results[2], requests.HTTPError)
+    assert results[3]["token"] == "b"
+
+
+def test_stale_position_served_immediately_and_revalidated(monkeypatch, fake_registry):
+    import time
+
+    vid = 987654
+    monkeypatch.setattr(otbivka, "_resolve_vehicle_id", lambda *a, **kw: (vid, True))
+    monkeypatch.setattr(otbivka, "CACHE_TTL_SEC", 30)
+    monkeypatch.setattr(otbivka._POSITIONS, "ttl_sec", 30)
+    monkeypatch.setattr(otbivka._POSITIONS, "_persist", None)
+    otbivka._POSITIONS.put(vid, {
+        "ts": time.time() - 60, "vehicle_id": vid, "lat": 59.9, "lon": 30.3,
+        "in_park": False, "park_name": None, "time": "old",
+    }, persist=False)
+
+    fetched = []
+
+    def fake_fetch(v, **kw):
+        fetched.append(v)
+        return {"vehicle_id": v, "depot_number": None, "lat": 59.95, "lon": 30.35, "time": "new", "raw": {}}
+
+    monkeypatch.setattr(otbivka, "fetch_online_by_vehicle_id", fake_fetch)
+
+    res = otbivka.get_position_and_check("6569", stale_ok=300)
+    assert res["stale"] is True and res["time"] == "old" and res["age_sec"] >= 60
+
+    otbivka._REVALIDATE_POOL.submit(lambda: None).result(timeout=5)
+    for _ in range(50):
+        if not otbivka._REVALIDATING:
+            break
+        time.sleep(0.01)
+
+    assert fetched == [vid]
+    res = otbivka.get_position_and_check("6569", stale_ok=300)
+    assert res["time"] == "new" and "stale" not in res
+
+
+def test_load_token_rereads_only_on_mtime_change(monkeypatch, tmp_path):
+    import os
+
+    token_file = tmp_path / "token.txt"
+    token_file.write_text("tok-1", encoding="utf-8")
+    path = str(token_file)
+
+    assert otbivka._load_token(token_path=path) == "tok-1"
+    headers = otbivka._auth_headers(token_path=path)
+    assert headers["auth"] == "tok-1"
+
+    # тот же размер и mtime — файл не перечитывается
+    st = os.stat(path)
+    token_file.write_text("tok-2", encoding="utf-8")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert otbivka._load_token(token_path=path) == "tok-1"
+    assert otbivka._auth_headers(token_path=path) is headers
+
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert otbivka._load_token(token_path=path) == "tok-2"
+
+    otbivka.invalidate_token_cache(path)
+    assert path not in otbivka._TOKEN_CACHE
+
+
+def test_park_registry_caches_and_hot_reloads(monkeypatch, tmp_path):
+    import json
+    import os
+
+    from src.ump_bot.infra import park_registry
+
+    monkeypatch.setattr(park_registry, "_RELOAD_CHECK_INTERVAL_SEC", 0.0)
+    square = [[30.0, 60.0], [30.01, 60.0], [30.01, 60.01], [30.0, 60.01], [30.0, 60.0]]
+    path = tmp_path / "parks.json"
+    path.write_text(json.dumps({"parks": [{"name": "A", "polygon": square, "tolerance_m": 3}]}), encoding="utf-8")
+
+    registry = park_registry.ParkRegistry(str(path))
+    parks = registry.parks()
+    assert [p["name"] for p in parks] == ["A"]
+    assert registry.parks() is parks  # без изменений файл не перечитывается
+
+    g = registry.geometries()[0]
+    assert g.bbox == (30.0, 60.0, 30.01, 60.01)
+    assert len(g.polygon) == len(g.edges) == 4
+    assert otbivka.classify_point(30.005, 60.005, [g]) == "A"
+    assert otbivka.classify_point(30.5, 60.5, [g]) is None
+    # ~4 м от восточной границы: дальше tolerance_m, но в пределах анти-флапа
+    outside = 30.01 + 4 / g.lon_m
+    assert otbivka.classify_point(outside, 60.005, [g], grace_m=0) is None
+    assert otbivka.classify_point(outside, 60.005, [g], grace_m=5) == "A"
+
+    st = os.stat(path)
+    path.write_text(json.dumps({"parks": [{"name": "B", "polygon": square}]}), encoding="utf-8")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert [p["name"] for p in registry.parks()] == ["B"]
+    assert registry.get("B")["tolerance_m"] == 0.0
+
+
+def test_circuit_breaker_opens_fails_fast_and_half_opens(monkeypatch):
+    from src.ump_bot.infra import circuit_breaker as cb
+
+    now = {"t": 1000.0}
+    monkeypatch.setattr(cb.time, "monotonic", lambda: now["t"])
+    breaker = cb.CircuitBreaker("UMP", failure_threshold=3, reset_timeout_sec=30, half_open_max_calls=1)
+
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure(RuntimeError("timeout"))
+    breaker.before_call()
+    breaker.record_success()  # успех обнуляет счётчик
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure(RuntimeError("timeout"))
+    assert breaker.state == cb.OPEN
+    with pytest.raises(cb.CircuitOpenError):
+        breaker.before_call()
+
+    now["t"] += 31
+    assert breaker.state == cb.HALF_OPEN
+    breaker.before_call()  # одна пробная попытка
+    with pytest.raises(cb.CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == cb.OPEN
+
+    now["t"] += 31
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == cb.CLOSED
+    snap = breaker.snapshot()
+    assert snap["trips"] == 2 and snap["rejected"] == 2 and snap["last_error"] == "RuntimeError: timeout"
+
+
+def test_half_open_probe_released_on_non_network_error(monkeypatch):
+    import asyncio
+
+    from src.ump_bot.infra import circuit_breaker as cb
+    from src.ump_bot.infra import ump_client
+
+    breaker = cb.get_ump_breaker()
+    monkeypatch.setattr(breaker, "half_open_max_calls", 1)
+
+    def half_open():
+        breaker.reset()
+        breaker._state = cb.HALF_OPEN
+
+    # проба упала не сетевой ошибкой — слот освобождён, следующая проба проходит
+    half_open()
+    with pytest.raises(ValueError):
+        otbivka._guarded(lambda: (_ for _ in ()).throw(ValueError("bad json")))
+    assert breaker.state == cb.HALF_OPEN
+    breaker.before_call()
+    breaker.release()
+
+    # нет файла токена — проба даже не занимается
+    half_open()
+    with pytest.raises(FileNotFoundError):
+        otbivka._ump_request("GET", "http://ump.test/x", token_path="/nonexistent/token.txt")
+    breaker.before_call()
+    breaker.release()
+
+    # асинхронный клиент: отмена запроса тоже освобождает слот
+    class Hang(ump_client.httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request):
+            await asyncio.sleep(10)
+
+    async def scenario():
+        client = ump_client.AsyncUMPClient(base_url="http://ump.test", transport=Hang())
+        try:
+            task = asyncio.ensure_future(client._send("GET", "/x", token="t", token_path=None, timeout=None))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        finally:
+            await client.aclose()
+
+    half_open()
+    monkeypatch.setattr(otbivka, "_auth_headers", lambda **kw: {})
+    asyncio.run(scenario())
+    assert breaker.state == cb.HALF_OPEN
+    breaker.before_call()
+    breaker.release()
+
+
+def test_open_breaker_serves_cached_position_without_network(monkeypatch):
+    import time
+
+    from src.ump_bot.infra.circuit_breaker import get_ump_breaker
+
+    monkeypatch.setattr(otbivka, "_resolve_vehicle_id", lambda dep, **kw: (42, True))
+    monkeypatch.setattr(otbivka, "_load_cached_position", lambda vid, max_age=None: (
+        {"ts": time.time() - 600, "lat": 59.9, "lon": 30.3, "in_park": True, "park_name": "P"}
+        if max_age and max_age >= 600 else None
+    ))
+    monkeypatch.setattr(otbivka, "_retention_sec", lambda: 3600)
+
+    def no_network(*a, **kw):
+        raise AssertionError("запрос в UMP при разомкнутом предохранителе")
+
+    monkeypatch.setattr(otbivka, "_get_session", lambda **kw: type("S", (), {"get": no_network, "post": no_network})())
+    monkeypatch.setattr(otbivka, "_auth_headers", lambda **kw: {})
+    breaker = get_ump_breaker()
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(RuntimeError("down"))
+
+    res = otbivka.get_position_and_check("6569")
+    assert res["ok"] and res["park_name"] == "P" and res["stale"] and res["age_sec"] >= 600
+
+    monkeypatch.setattr(otbivka, "_load_cached_position", lambda vid, max_age=None: None)
+    [err] = otbivka.batch_get_positions(["6569"])
+    assert err["error"] == "ump_unavailable"
+
+
+def test_retry_policy_jitter_retry_after_and_budget(monkeypatch):
+    from src.ump_bot.infra import retry
+
+    policy = retry.RetryPolicy(max_attempts=3, base_delay=0.3, max_delay=5.0, budget=retry.RetryBudget(ratio=0.1, min_per_sec=0))
+    for _ in range(20):
+        policy.on_request()
+    delays = [policy.backoff(1) for _ in range(2)]
+    assert all(0.0 <= d <= 0.6 for d in delays)
+    assert policy.backoff(0) is None  # 10% от 20 запросов — только 2 повтора
+    assert policy.stats() == {"requests": 20, "retries": 2, "denied": 1}
+
+    policy = retry.RetryPolicy(max_attempts=3, max_delay=5.0, budget=retry.RetryBudget(min_per_sec=10))
+    assert policy.backoff(0, retry_after=2.0) == 2.0
+    assert policy.backoff(0, retry_after=60.0) is None  # ждать дольше max_delay не будем
+    assert policy.backoff(2) is None  # попытки исчерпаны
+
+    assert retry.parse_retry_after("7") == 7.0
+    assert retry.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert retry.parse_retry_after("soon") is None
+
+
+def test_ump_request_retries_only_transient_errors(monkeypatch):
+    monkeypatch.setattr(otbivka, "_auth_headers", lambda **kw: {})
+    sleeps = []
+    monkeypatch.setattr(otbivka.time, "sleep", sleeps.append)
+    responses = []
+
+    class FakeSession:
+        def get(self, url, **kw):
+            return responses.pop(0)
+
+    monkeypatch.setattr(otbivka, "_get_session", lambda **kw: FakeSession())
+
+    busy = _FakeResponse(status_code=503)
+    busy.headers = {"Retry-After": "1"}
+    responses[:] = [busy, _FakeResponse(payload={"center": "POINT(30.1 59.9)"})]
+    pos = otbivka.fetch_online_by_vehicle_id(5)
+    assert pos["lat"] == 59.9 and sleeps == [1.0]
+
+    responses[:] = [_FakeResponse(status_code=404)]
+    with pytest.raises(requests.HTTPError):
+        otbivka.fetch_online_by_vehicle_id(5)
+    assert responses == [] and sleeps == [1.0]
@@ -0,0 +1,73 @@
+"""Тесты для in-memory кэша позиций"""
+
+import time
+
+from src.ump_bot.infra.position_cache import PositionCache
+
+
+def _entry(vid, age=0.0):
+    return {"ts": time.time() - age, "vehicle_id": vid, "lat": 59.9, "lon": 30.3}
+
+
+def test_lru_eviction_and_counters():
+    cache = PositionCache(max_entries=2, ttl_sec=60)
+    cache.put(1, _entry(1))
+    cache.put(2, _entry(2))
+    assert cache.get(1)["vehicle_id"] == 1  # 1 становится самым свежим
+    cache.put(3, _entry(3))  # вытесняется 2
+
+    assert cache.get(2) is None
+    assert cache.get(3) is not None
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 1, "evictions": 1, "pending_writes": 0}
+
+
+def test_ttl_and_max_age():
+    cache = PositionCache(max_entries=10, ttl_sec=30)
+    cache.put(1, _entry(1, age=45))
+
+    assert cache.get(1) is None
+    assert cache.get(1, max_age=60) is not None
+
+
+def test_write_behind_flush_batches_dirty_entries():
+    persisted = []
+    cache = PositionCache(max_entries=10, ttl_sec=30, persist=persisted.append, flush_interval_sec=3600)
+    cache.put(1, _entry(1))
+    cache.put(1, _entry(1))
+    cache.put(2, _entry(2))
+    cache.put(3, _entry(3), persist=False)
+
+    assert persisted == []
+    cache.flush()
+    assert len(persisted) == 1
+    assert sorted(e["vehicle_id"] for e in persisted[0]) == [1, 2]
+    cache.flush()
+    assert len(persisted) == 1
+
+
+def test_position_store_upsert_bulk_read_and_vacuum(tmp_path):
+    import json
+
+    from src.ump_bot.infra.position_store import PositionStore
+
+    legacy = tmp_path / "online_7.json"
+    legacy.write_text(json.dumps(_entry(7)), encoding="utf-8")
+
+    store = PositionStore(str(tmp_path / "positions.sqlite3"))
+    assert store.import_legacy_files(str(tmp_path)) == 1
+    assert not legacy.exists()
+
+    old = dict(_entry(1, age=600), in_park=True, park_name="Парк", time="12:00")
+    store.upsert_many([old, _entry(2)])
+    # более старая запись не затирает новую
+    store.upsert_many([_entry(2, age=900)])
+
+    rows = store.get_many([1, 2, 7, 99])
+    assert sorted(rows) == [1, 2, 7]
+    assert rows[1]["in_park"] is True and rows[1]["time"] == "12:00"
+    assert rows[2]["ts"] > time.time() - 60
+
+    assert sorted(store.get_many([1, 2], max_age=60)) == [2]
+    assert store.vacuum(max_age=300) == 1
+    assert store.get(1) is None
+    store.close()
@@ -1,3 +1,6 @@
+import pytest
+
+from src.ump_bot.infra import otbivka
 from src.ump_bot.infra.render_map import _tile_canvas_is_too_big, _tile_grid_metrics
 
 
@@ -16,3 +19,103 @@ def test_tile_canvas_guard_triggers_for_world_sized_bbox():
     assert _tile_canvas_is_too_big(bbox, zoom=17, max_tiles=225)
 
 
+def test_streaming_render_cancels_other_canvases_when_one_fails(monkeypatch, tmp_path):
+    import asyncio
+    import gc
+    import time
+
+    from src.ump_bot.infra import park_registry, render_map
+
+    parks = {name: {"name": name, "polygon": [(30.0, 60.0), (30.01, 60.0), (30.01, 60.01)]} for name in "ABC"}
+    monkeypatch.setattr(park_registry, "get_park_registry", lambda: parks)
+
+    def prepare(park, **kw):
+        if park["name"] == "A":
+            raise RuntimeError("tiles down")
+        time.sleep(0.05)
+        raise ValueError(f"late failure {park['name']}")
+
+    monkeypatch.setattr(render_map, "prepare_park_canvas", prepare)
+
+    async def stream():
+        for dep, name in (("1", "A"), ("2", "B"), ("3", "C")):
+            yield {"ok": True, "depot_number": dep, "in_park": True, "park_name": name}
+
+    unhandled = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, ctx: unhandled.append(ctx))
+        with pytest.raises(RuntimeError, match="tiles down"):
+            await render_map.render_parks_streaming(stream(), out_dir=str(tmp_path / "out"))
+        await asyncio.sleep(0.1)
+        gc.collect()
+
+    asyncio.run(run())
+    assert unhandled == []
+
+
+def test_stream_positions_yields_as_completed_and_renders_per_park(monkeypatch, tmp_path, fake_ump):
+    import asyncio
+    import json
+    import os
+
+    import httpx
+
+    from src.ump_bot.infra import park_registry, render_map, ump_client
+
+    a = [[30.0, 60.0], [30.01, 60.0], [30.01, 60.01], [30.0, 60.01], [30.0, 60.0]]
+    b = [[31.0, 60.0], [31.01, 60.0], [31.01, 60.01], [31.0, 60.01], [31.0, 60.0]]
+    path = tmp_path / "parks.json"
+    path.write_text(json.dumps({"parks": [{"name": "A", "polygon": a}, {"name": "B", "polygon": b}]}), encoding="utf-8")
+    registry = park_registry.ParkRegistry(str(path))
+
+    for dep, vid in (("1", 11), ("2", 12), ("3", 13)):
+        fake_ump.put(dep, vid)
+    monkeypatch.setattr(otbivka, "get_park_registry", lambda: registry)
+    monkeypatch.setattr(park_registry, "get_park_registry", lambda: registry)
+
+    points = {11: "30.005 60.005", 12: "30.006 60.006", 13: "31.005 60.005"}
+    release = asyncio.Event()
+    prepared = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        vid = int(request.url.path.rsplit("/", 1)[1])
+        if vid == 12:
+            await release.wait()  # самый медленный ТС
+        return httpx.Response(200, json={"center": f"POINT({points[vid]})"})
+
+    real_prepare = render_map.prepare_park_canvas
+
+    def prepare(park, **kw):
+        prepared.append((park["name"], release.is_set()))
+        return real_prepare(park, **kw)
+
+    monkeypatch.setattr(render_map, "prepare_park_canvas", prepare)
+
+    async def run():
+        client = ump_client.AsyncUMPClient(base_url="http://ump.test", transport=httpx.MockTransport(handler))
+        order = []
+
+        async def stream():
+            async for r in client.stream_positions(["1", "2", "3"], token="t"):
+                order.append(r["depot_number"])
+                yield r
+                if len(order) == 2:
+                    await asyncio.sleep(0.05)  # подложки успевают начать готовиться
+                    release.set()
+
+        try:
+            files, results = await render_map.render_parks_streaming(
+                stream(), out_dir=str(tmp_path / "out"), size="200x150", use_real_map=False
+            )
+        finally:
+            await client.aclose()
+        return order, files, results
+
+    order, files, results = asyncio.run(run())
+
+    assert order[-1] == "2"
+    assert sorted(prepared) == [("A", False), ("B", False)]  # до завершения всех запросов
+    assert [os.path.basename(f) for f in files] == ["park_A.png", "park_B.png"]
+    assert all(os.path.exists(f) for f in files)
+    assert {r["depot_number"]: r["park_name"] for r in results} == {"1": "A", "2": "A", "3": "B"}
@@ -0,0 +1,72 @@
+"""Тесты для HTTP-сессий UMP по аккаунтам"""
+
+from http.cookiejar import Cookie, MozillaCookieJar
+
+from src.ump_bot.infra import sessions
+
+
+def _write_cookies(path, value):
+    jar = MozillaCookieJar(str(path))
+    jar.set_cookie(Cookie(
+        0, "sid", value, None, False, "ump.test", True, False, "/", True,
+        False, None, False, None, None, {},
+    ))
+    jar.save(ignore_discard=True, ignore_expires=True)
+
+
+def test_sessions_are_per_account_with_own_cookies(monkeypatch, tmp_path):
+    import os
+
+    cookies_dir = tmp_path / "cookies"
+    cookies_dir.mkdir()
+    monkeypatch.setattr(sessions, "USER_COOKIES_DIR", str(cookies_dir))
+    _write_cookies(cookies_dir / "1_cookies.txt", "one")
+    _write_cookies(cookies_dir / "2_cookies.txt", "two")
+
+    manager = sessions.SessionManager(max_sessions=10, idle_sec=3600, pool_maxsize=16)
+    s1 = manager.get(token_path=str(tmp_path / "tokens" / "1_token.txt"))
+    s2 = manager.get(token_path=str(tmp_path / "tokens" / "2_token.txt"))
+    assert s1 is not s2
+    assert s1.get_adapter("http://ump.test")._pool_maxsize == 16
+    assert s1.cookies.get("sid") == "one" and s2.cookies.get("sid") == "two"
+    assert manager.get(token_path=str(tmp_path / "tokens" / "1_token.txt")) is s1
+    assert manager.get(token="abc").cookies.get("sid") is None  # явный токен — без cookies
+
+    # после нового логина файл cookies перезаписан — сессия подхватывает его
+    path = cookies_dir / "1_cookies.txt"
+    st = os.stat(path)
+    _write_cookies(path, "one-new")
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert manager.get(token_path=str(tmp_path / "tokens" / "1_token.txt")).cookies.get("sid") == "one-new"
+    assert manager.stats()["cookie_reloads"] == 1
+
+
+def test_sessions_evict_idle_and_least_recently_used(monkeypatch, tmp_path):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(sessions.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(sessions, "USER_COOKIES_DIR", str(tmp_path))
+
+    manager = sessions.SessionManager(max_sessions=2, idle_sec=60)
+    a = manager.get(token_path="a_token.txt")
+    manager.get(token_path="b_token.txt")
+    manager.get(token_path="a_token.txt")
+    manager.get(token_path="c_token.txt")  # вытесняет b — давно не использовалась
+    assert manager.stats()["size"] == 2
+    assert manager.get(token_path="a_token.txt") is a
+
+    clock["now"] += 120
+    assert manager.get(token_path="a_token.txt") is not a  # простаивала дольше idle_sec
+    assert manager.stats() == {"size": 1, "created": 4, "evicted": 3, "cookie_reloads": 0}
+
+
+def test_evicted_session_is_not_closed_under_a_running_request(monkeypatch, tmp_path):
+    monkeypatch.setattr(sessions, "USER_COOKIES_DIR", str(tmp_path))
+    manager = sessions.SessionManager(max_sessions=1, idle_sec=3600)
+    in_use = manager.get(token_path="a_token.txt")
+    closed = []
+    monkeypatch.setattr(in_use, "close", lambda: closed.append(True))
+
+    manager.get(token_path="b_token.txt")  # вытесняет a, пока ею, возможно, идёт запрос
+    assert manager.stats()["evicted"] == 1
+    assert closed == []
+    assert manager.get(token_path="a_token.txt") is not in_use
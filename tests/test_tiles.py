@@ -0,0 +1,245 @@
+"""Тесты загрузки тайлов: кэш без лимита, параллельная загрузка, общий лимитер"""
+
+import io
+import os
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from src.ump_bot.infra import tiles
+
+PROVIDER = "https://tiles.test/{z}/{x}/{y}.png"
+
+
+@pytest.fixture(autouse=True)
+def fresh_tile_memory(monkeypatch):
+    memory = tiles.DecodedTileCache(1024 * 1024)
+    monkeypatch.setattr(tiles, "get_tile_memory_cache", lambda: memory)
+    return memory
+
+
+def test_cache_hits_skip_limiter_and_misses_download_concurrently(monkeypatch, tmp_path):
+    cache_dir = str(tmp_path)
+    path = tiles.get_tile_store(cache_dir).path(PROVIDER, 5, 0, 0)
+    os.makedirs(os.path.dirname(path))
+    Image.new("RGBA", (256, 256), (1, 2, 3, 255)).save(path)
+
+    acquired = []
+    limiter = tiles.get_tile_limiter(PROVIDER, 1000)
+    monkeypatch.setattr(limiter, "acquire", lambda: acquired.append(1) or 0.0)
+
+    lock = threading.Lock()
+    active = {"now": 0, "peak": 0}
+
+    def fake_download(provider, provider_id, z, x, y, cache_dir, headers=None, limiter=None):
+        limiter.acquire()
+        with lock:
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+        time.sleep(0.05)
+        with lock:
+            active["now"] -= 1
+        return Image.new("RGBA", (256, 256))
+
+    monkeypatch.setattr(tiles, "download_tile", fake_download)
+    coords = [(x, y) for x in range(3) for y in range(2)]
+    out = tiles.fetch_tiles(PROVIDER, 5, coords, cache_dir, tiles_per_sec=1000)
+
+    assert set(out) == set(coords)
+    assert out[(0, 0)].getpixel((0, 0)) == (1, 2, 3, 255)
+    # тайл из кэша лимитер не трогает
+    assert len(acquired) == len(coords) - 1
+    assert active["peak"] > 1
+
+
+def test_token_bucket_is_shared_per_provider_host():
+    a = tiles.get_tile_limiter("https://shared.test/a/{z}/{x}/{y}.png", 2.0)
+    b = tiles.get_tile_limiter("https://shared.test/b/{z}/{x}/{y}.png", 2.0)
+    assert a is b
+
+    bucket = tiles.TokenBucket(rate=20.0, burst=1)
+    t0 = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    # первый токен из запаса, ещё два — по 1/20 с
+    assert time.monotonic() - t0 >= 0.09
+
+
+def test_park_base_layer_is_cached_and_markers_drawn_on_copy(monkeypatch, tmp_path):
+    from src.ump_bot.infra import base_layers, render_map
+
+    cache = base_layers.BaseLayerCache(max_items=4, disk_dir=str(tmp_path / "bases"), ttl_sec=0)
+    monkeypatch.setattr(render_map, "get_base_layer_cache", lambda: cache)
+    calls = []
+
+    def fake_stitch(bbox, zoom, provider, cache_dir, headers, tps, debug=False, cache_id=None):
+        calls.append(provider)
+        return Image.new("RGB", (512, 512), (200, 220, 240)), (0, 0, 1, 1), 0
+
+    monkeypatch.setattr(render_map, "_stitch_tiles", fake_stitch)
+    # парк у (0, 0): при zoom=1 тайлы 0..1 покрывают его целиком
+    park = {"name": "P", "polygon": [(-10.0, -10.0), (10.0, -10.0), (10.0, 10.0), (-10.0, 10.0)]}
+    opts = dict(size="200x150", zoom=1, tile_provider="https://t.test/{z}/{x}/{y}.png?key={apikey}",
+                tile_apikey="secret", tile_cache=str(tmp_path / "tiles"))
+
+    first = render_map.prepare_park_canvas(park, **opts)
+    render_map.draw_park_vehicles(first, [{"depot_number": 1, "lon": 0.0, "lat": 0.0}], out_dir=str(tmp_path / "out"))
+    second = render_map.prepare_park_canvas(park, **opts)
+
+    assert len(calls) == 1
+    cx, cy = second["project"](0.0, 0.0)
+    # метка первого рендера не попала в кэшированную подложку
+    assert second["img"].getpixel((cx, cy)) == (200, 220, 240)
+    assert first["img"].getpixel((cx, cy)) != (200, 220, 240)
+    assert cache.stats()["hits"] == 1
+
+    # подложка переживает перезапуск (читается с диска), ключ API в ключ кэша не попал
+    cache.clear()
+    render_map.prepare_park_canvas(park, **opts)
+    assert len(calls) == 1 and cache.stats()["disk_hits"] == 1
+    assert tiles.provider_cache_id(opts["tile_provider"]) == "https://t.test/{z}/{x}/{y}.png?key="
+
+
+def test_base_layer_disk_drops_expired_orphans_and_stays_under_cap(tmp_path):
+    from src.ump_bot.infra import base_layers
+
+    disk = tmp_path / "bases"
+    img = Image.new("RGB", (64, 64), (5, 6, 7))
+    probe = base_layers.BaseLayerCache(max_items=1, disk_dir=str(disk), ttl_sec=0, max_disk_bytes=0)
+    probe.put("probe", img, {"zoom": 1})
+    layer_bytes = sum(p.stat().st_size for p in disk.iterdir())
+    for p in disk.iterdir():
+        p.unlink()
+
+    cache = base_layers.BaseLayerCache(max_items=1, disk_dir=str(disk), ttl_sec=3600,
+                                       max_disk_bytes=int(layer_bytes * 2.5))
+    orphan = disk / "orphan.png"
+    orphan.write_bytes(b"half")
+    os.utime(orphan, (1, 1))
+    for i, key in enumerate(("a", "b")):
+        cache.put(key, img, {"zoom": 1})
+        os.utime(disk / f"{key}.png", (1000 + i, 1000 + i))
+
+    # просроченная по meta подложка удаляется при чтении
+    os.utime(disk / "b.json", (1, 1))
+    cache.clear()
+    assert cache.get("b") is None
+    assert not (disk / "b.png").exists() and not (disk / "b.json").exists()
+
+    for key in ("c", "d", "e"):
+        cache.put(key, img, {"zoom": 1})
+    names = sorted(p.name for p in disk.iterdir())
+    # давно не читанная «a» вытеснена, брошенная половина пары убрана
+    assert "a.png" not in names and "orphan.png" not in names
+    assert sum(p.stat().st_size for p in disk.iterdir()) <= layer_bytes * 2.5
+    assert cache.disk_evicted >= 1
+
+
+def test_repeated_fetch_decodes_png_once_and_lru_is_byte_bounded(monkeypatch, tmp_path, fresh_tile_memory):
+    cache_dir = str(tmp_path)
+    coords = [(0, 0), (1, 0)]
+    store = tiles.get_tile_store(cache_dir)
+    for x, y in coords:
+        os.makedirs(os.path.dirname(store.path(PROVIDER, 3, x, y)), exist_ok=True)
+        Image.new("RGBA", (256, 256)).save(store.path(PROVIDER, 3, x, y))
+    decoded = []
+    real_load = store.load
+    monkeypatch.setattr(store, "load", lambda *a: decoded.append(a) or real_load(*a))
+
+    for _ in range(3):
+        out = tiles.fetch_tiles(PROVIDER, 3, coords, cache_dir)
+        assert all(img is not None for img in out.values())
+    assert len(decoded) == 2
+    stats = fresh_tile_memory.stats()
+    assert stats["hits"] == 4 and stats["misses"] == 2
+    assert stats["hit_rate"] == pytest.approx(4 / 6)
+
+    # лимит в байтах: 256*256*4 = 256 КБ на тайл, в 300 КБ помещается один
+    small = tiles.DecodedTileCache(300 * 1024)
+    small.put(("p", 1, 0, 0), Image.new("RGBA", (256, 256)))
+    small.put(("p", 1, 1, 0), Image.new("RGBA", (256, 256)))
+    assert small.get(("p", 1, 0, 0)) is None
+    assert small.get(("p", 1, 1, 0)) is not None
+    assert small.stats()["evictions"] == 1 and small.bytes == 256 * 256 * 4
+
+
+def test_tile_store_is_sharded_secret_free_and_size_bounded(tmp_path):
+    root = tmp_path / "tiles"
+    root.mkdir()
+    legacy = root / "https_t.test_1_2_3.png"
+    legacy.write_bytes(b"old")
+    store = tiles.TileStore(str(root), max_bytes=3000)
+
+    provider_id = tiles.provider_cache_id("https://t.test/{z}/{x}/{y}.png?key=secret")
+    assert tiles.provider_cache_id("https://t.test/{z}/{x}/{y}.png?key=rotated") == provider_id
+    path = store.path(provider_id, 17, 100, 200)
+    assert path.endswith(os.path.join("17", "100", "200.png"))
+    assert "secret" not in path
+
+    buf = io.BytesIO()
+    Image.new("RGBA", (8, 8), (9, 9, 9, 255)).save(buf, format="PNG")
+    data = buf.getvalue() + b"\0" * (1000 - len(buf.getvalue()))
+    for y in range(3):
+        store.save(provider_id, 17, 100, y, data)
+        # разнесём atime: тайл 0 самый давний
+        os.utime(store.path(provider_id, 17, 100, y), (1000 + y, 1000 + y))
+    assert not legacy.exists()  # старый плоский кэш с ключом в имени удалён
+    store.load(provider_id, 17, 100, 0)  # чтение освежает atime тайла 0
+
+    store.save(provider_id, 17, 100, 3, data)
+    assert not os.path.exists(store.path(provider_id, 17, 100, 1))
+    assert os.path.exists(store.path(provider_id, 17, 100, 0))
+    assert store.stats()["bytes"] <= 3000 and store.stats()["evicted"] >= 1
+    assert not [p for p in root.rglob("*.tmp")]
+
+
+def test_auto_zoom_fits_park_and_crops_window_without_resize(monkeypatch, tmp_path):
+    from src.ump_bot.infra import base_layers, render_map
+
+    cache = base_layers.BaseLayerCache(max_items=4, disk_dir=None)
+    monkeypatch.setattr(render_map, "get_base_layer_cache", lambda: cache)
+    requested = []
+
+    def fake_fetch(provider, zoom, coords, cache_dir, headers=None, tps=None, debug=False, cache_id=None):
+        requested.append((zoom, list(coords)))
+        return {xy: Image.new("RGBA", (256, 256), (10, 20, 30, 255)) for xy in coords}
+
+    def no_resize(*a, **kw):
+        raise AssertionError("resize must not be used in auto-zoom mode")
+
+    monkeypatch.setattr(render_map, "fetch_tiles", fake_fetch)
+    monkeypatch.setattr(Image.Image, "resize", no_resize)
+    park = {"name": "P", "polygon": [(30.44, 59.96), (30.46, 59.96), (30.46, 59.97), (30.44, 59.97)]}
+
+    canvas = render_map.prepare_park_canvas(
+        park, size="400x300", zoom=17, tile_cache=str(tmp_path), auto_zoom=True
+    )
+
+    assert canvas["img"].size == (400, 300)
+    zoom, coords = requested[0]
+    assert zoom < 17
+    # только тайлы окна 400×300: не больше 3×3
+    assert len(coords) <= 9
+    for lon, lat in park["polygon"]:
+        x, y = canvas["project"](lon, lat)
+        assert 0 <= x < 400 and 0 <= y < 300
+    # на zoom+1 парк в окно уже не помещается
+    assert render_map._fit_zoom(render_map._lonlat_bbox(park["polygon"]), 400, 300, 30, zoom + 1) == zoom
+
+
+def test_legacy_flat_tiles_with_api_key_are_purged_from_old_cache_dir(monkeypatch, tmp_path):
+    old_cache = tmp_path / "cache"
+    old_cache.mkdir()
+    leaked = old_cache / "https_api.maptiler.com_maps_streets_key=secret_17_1_2.png"
+    leaked.write_bytes(b"old")
+    unrelated = old_cache / "positions.sqlite"
+    unrelated.write_bytes(b"db")
+    monkeypatch.setattr(tiles, "CACHE_DIR", str(old_cache))
+    monkeypatch.setattr(tiles, "_LEGACY_PURGED", set())
+
+    tiles.get_tile_store(str(tmp_path / "tile_cache"))
+
+    assert not leaked.exists()
+    assert unrelated.exists()
@@ -0,0 +1,184 @@
+"""Тесты асинхронного клиента UMP (httpx)"""
+
+import asyncio
+
+import httpx
+
+from src.ump_bot.infra import otbivka, ump_client
+
+
+def _fast_sleep(real_sleep):
+    async def sleep(delay, *a, **kw):
+        return await real_sleep(min(delay, 0.01), *a, **kw)
+
+    return sleep
+
+
+def test_async_client_batch_reuses_pool_and_keeps_order(monkeypatch, fake_ump):
+    index = fake_ump
+    index.put("1001", 11)
+
+    seen = []
+    active = {"now": 0, "max": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.url.path)
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await asyncio.sleep(0.01)
+        active["now"] -= 1
+        if request.url.path == "/api/v1/map/vehicles":
+            number = request.url.params["number"]
+            if number == "1003":
+                return httpx.Response(200, json=[])
+            return httpx.Response(200, json=[{"depotNumber": number, "id": int(number) - 990}])
+        vid = int(request.url.path.rsplit("/", 1)[1])
+        if vid == 15:
+            return httpx.Response(500, text="boom")
+        return httpx.Response(200, json={"center": "POINT(30.1 59.9)", "depotNumber": str(vid + 990)})
+
+    monkeypatch.setattr(asyncio, "sleep", _fast_sleep(asyncio.sleep))
+
+    async def run():
+        client = ump_client.AsyncUMPClient(base_url="http://ump.test", max_connections=4, transport=httpx.MockTransport(handler))
+        try:
+            return await client.batch_get_positions(["1001", "1002", "1003", "1004", "1005"], token="t")
+        finally:
+            await client.aclose()
+
+    results = asyncio.run(run())
+
+    assert [r["depot_number"] for r in results] == ["1001", "1002", "1003", "1004", "1005"]
+    assert results[0]["ok"] and results[0]["vehicle_id"] == 11 and results[0]["lat"] == 59.9
+    assert results[1]["ok"] and results[1]["vehicle_id"] == 12
+    assert results[2] == {"ok": False, "depot_number": "1003", "error": "vehicle_id_not_found"}
+    assert results[3]["ok"] and results[3]["vehicle_id"] == 14
+    assert index.get("1002") == 12
+    assert results[4]["error"] == "http_error" and results[4]["status"] == 500
+    assert seen.count("/api/v1/map/online/15") == 3  # 500 повторяется, как в синхронном клиенте
+    assert 1 < active["max"] <= 4
+
+
+def test_async_client_follows_redirects_and_keys_flights_by_account(monkeypatch):
+    monkeypatch.setattr(otbivka, "_auth_headers", lambda token=None, token_path=None: {"auth": token or ""})
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/old/online/7":
+            return httpx.Response(302, headers={"Location": "/api/v1/map/online/7"})
+        calls.append(request.headers["auth"])
+        await asyncio.sleep(0.02)
+        if request.headers["auth"] == "expired":
+            return httpx.Response(401)
+        return httpx.Response(200, json={"center": "POINT(30.1 59.9)"})
+
+    async def run():
+        client = ump_client.AsyncUMPClient(base_url="http://ump.test", transport=httpx.MockTransport(handler))
+        try:
+            r = await client._send("GET", "/old/online/7", token="a", token_path=None, timeout=None)
+            assert r.status_code == 200
+            calls.clear()
+            return await asyncio.gather(
+                *(client._fetch_online_shared(7, tok, None, None) for tok in ("a", "a", "expired")),
+                return_exceptions=True,
+            )
+        finally:
+            await client.aclose()
+
+    a1, a2, expired = asyncio.run(run())
+    # один запрос на аккаунт: 401 чужого аккаунта не достаётся остальным
+    assert sorted(calls) == ["a", "expired"]
+    assert a1["lat"] == a2["lat"] == 59.9
+    assert isinstance(expired, httpx.HTTPStatusError) and expired.response.status_code == 401
+
+
+def test_async_client_reads_token_and_writes_index_off_the_loop(monkeypatch, tmp_path, fake_ump):
+    import threading
+
+    from src.ump_bot.infra import vehicle_index
+    from src.ump_bot.infra.vehicle_index import VehicleIndex
+
+    index = fake_ump
+    monkeypatch.setattr(vehicle_index, "_SAVE_INTERVAL_SEC", 0.0)
+    threads = {}
+
+    def headers(token=None, token_path=None):
+        threads["headers"] = threading.current_thread()
+        return {"auth": "from-file"}
+
+    real_flush = index.flush
+
+    def flush():
+        threads["flush"] = threading.current_thread()
+        real_flush()
+
+    monkeypatch.setattr(otbivka, "_auth_headers", headers)
+    monkeypatch.setattr(index, "flush", flush)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=[{"depotNumber": "1001", "id": 11}])
+
+    async def run():
+        client = ump_client.AsyncUMPClient(base_url="http://ump.test", transport=httpx.MockTransport(handler))
+        try:
+            return await client._resolve_vehicle_id("1001", None, str(tmp_path / "token"), None)
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == (11, False)
+    # чтение токена (возможен перелогин) и запись индекса — не в потоке event loop
+    assert threads["headers"] is not threading.main_thread()
+    assert threads["flush"] is not threading.main_thread()
+    assert VehicleIndex(path=str(tmp_path / "idx.json"), ttl_sec=3600).get("1001") == 11
+
+
+def test_ump_client_of_stale_loop_is_closed(monkeypatch):
+    monkeypatch.setattr(ump_client, "_CLIENT", None)
+
+    async def current():
+        return ump_client.get_ump_client()
+
+    old_loop = asyncio.new_event_loop()
+    new_loop = asyncio.new_event_loop()
+    try:
+        old = old_loop.run_until_complete(current())
+        new = new_loop.run_until_complete(current())
+        assert new is not old
+        assert old._client.is_closed
+        new_loop.run_until_complete(ump_client.close_ump_client())
+    finally:
+        old_loop.close()
+        new_loop.close()
+
+
+def test_batch_refreshes_session_once_on_401(monkeypatch, fake_ump):
+    for i in range(4):
+        fake_ump.put(str(100 + i), 10 + i)
+    monkeypatch.setattr(otbivka, "_auth_headers", lambda token=None, token_path=None: {"Authorization": token_path})
+
+    refreshed = []
+
+    def refresh():
+        refreshed.append(1)
+        return "new"
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.01)
+        if request.headers["Authorization"] != "new":
+            return httpx.Response(401)
+        return httpx.Response(200, json={"center": "POINT(30.1 59.9)"})
+
+    async def run(reauth):
+        client = ump_client.AsyncUMPClient(base_url="http://ump.test", transport=httpx.MockTransport(handler))
+        try:
+            return await client.batch_get_positions(["100", "101", "102", "103"], token_path="old", reauth=reauth)
+        finally:
+            await client.aclose()
+
+    results = asyncio.run(run(refresh))
+    assert all(r["ok"] for r in results)
+    assert len(refreshed) == 1  # конкурентные 401 ждут одно обновление сессии
+
+    otbivka._POSITIONS.clear()
+    results = asyncio.run(run(lambda: None))
+    assert [r.get("status") for r in results] == [401] * 4
@@ -0,0 +1,36 @@
+"""Тесты записей ТС (VehicleStatus, CachedPosition)"""
+
+import pytest
+
+from src.ump_bot.infra import otbivka
+
+
+def test_vehicle_status_is_slotted_and_dict_compatible(monkeypatch):
+    from src.ump_bot.domain.vehicle import CachedPosition, VehicleStatus
+
+    ok = VehicleStatus(ok=True, depot_number="7", vehicle_id=3, lat=59.9, lon=30.1)
+    assert not hasattr(ok, "__dict__")
+    assert ok["park_name"] is None and ok.get("park_name", "x") is None  # ключ есть, как у словаря
+    assert "stale" not in ok and ok.get("stale", False) is False
+    ok["stale"] = True
+    assert ok.to_dict() == {
+        "ok": True, "depot_number": "7", "vehicle_id": 3, "lat": 59.9, "lon": 30.1,
+        "time": None, "in_park": None, "park_name": None, "stale": True,
+    }
+    err = VehicleStatus(ok=False, depot_number="8", error="vehicle_id_not_found")
+    assert err == {"ok": False, "depot_number": "8", "error": "vehicle_id_not_found"}
+    with pytest.raises(KeyError):
+        err["lat"]
+
+    # ответ UMP целиком не хранится, если не включена отладка
+    monkeypatch.setattr(otbivka, "_KEEP_RAW", False)
+    assert otbivka._parse_online(3, {"center": "POINT(30.1 59.9)", "extra": "x" * 1000})["raw"] is None
+    monkeypatch.setattr(otbivka, "_KEEP_RAW", True)
+    assert otbivka._parse_online(3, {"center": "POINT(30.1 59.9)"})["raw"] == {"center": "POINT(30.1 59.9)"}
+
+    monkeypatch.setattr(otbivka._POSITIONS, "_persist", None)
+    otbivka._save_cached_position(3, 59.9, 30.1, True, "A", "t")
+    cached = otbivka._POSITIONS.get(3)
+    assert isinstance(cached, CachedPosition) and cached.get("park_name") == "A"
+    assert otbivka._result_from_cache("7", 3, cached)["in_park"] is True
+    otbivka._POSITIONS.clear()